@@ -1,26 +1,60 @@
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import os
 
 from invoice_core_processor.config.logging_config import logger
-from invoice_core_processor.core.workflow import build_workflow_graph
+from invoice_core_processor.core.workflow import get_async_workflow_graph, get_agent_registry
+from invoice_core_processor.core.jobs import InvoiceJobManager, JobQueueFullError
+from invoice_core_processor.core.database import check_postgres_health, close_postgres_pool, close_mongo_client, get_postgres_pool_stats
 from invoice_core_processor.core.models import TargetSystem
-from invoice_core_processor.core.mcp_clients import MCPClient
-from invoice_core_processor.services.summary_agent_service import SummaryAgentService
-from typing import Dict, Any
+from invoice_core_processor.core.mcp_clients import MCPClient, SERVER_CLASSES
+from invoice_core_processor.services.summary_agent_service import get_summary_agent_service
+from invoice_core_processor.services.ocr_executor import shutdown_ocr_executor
+from invoice_core_processor.core.warmup import start_background_warmup
+from invoice_core_processor.services.validation_rules import get_validation_rule_registry
+from invoice_core_processor.services.validation import revalidate
+from invoice_core_processor.services.duplicate_detection import get_duplicate_detector
+from invoice_core_processor.config.settings import get_settings
+from typing import Dict, Any, List
 
 # --- FastAPI App Initialization ---
 
+job_manager = InvoiceJobManager(workflow_factory=get_async_workflow_graph)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_agent_registry().start_change_listener()
+    # The agents in SERVER_CLASSES are served by this process, so it keeps them alive.
+    get_agent_registry().start_heartbeats(SERVER_CLASSES)
+    get_validation_rule_registry().start_change_listener()
+    if get_settings().DUPLICATE_FILTER_ENABLED:
+        get_duplicate_detector().start_change_listener()
+    await job_manager.start()
+    if get_settings().WARMUP_ON_STARTUP:
+        start_background_warmup()
+    yield
+    await job_manager.stop()
+    from invoice_core_processor.services.mapping import close_async_openai_client
+    await close_async_openai_client()
+    get_agent_registry().stop_change_listener()
+    get_agent_registry().stop_heartbeats()
+    get_validation_rule_registry().stop_change_listener()
+    if get_settings().DUPLICATE_FILTER_ENABLED:
+        get_duplicate_detector().stop_change_listener()
+    close_postgres_pool()
+    close_mongo_client()
+    shutdown_ocr_executor()
+
 app = FastAPI(
     title="InvoiceCoreProcessor",
     description="A multi-agent system for automated invoice processing.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-workflow_app = build_workflow_graph()
 mcp_client = MCPClient()
-summary_agent_service = SummaryAgentService()
 
 # --- API Models ---
 
@@ -32,13 +66,118 @@ class InvoiceUploadRequest(BaseModel):
 class InvoiceUploadResponse(BaseModel):
     workflow_status: str
     invoice_id: str | None
+    job_id: str | None = None
+
+class InvoiceJobStatusResponse(BaseModel):
+    job_id: str
+    job_status: str
+    workflow_status: str
+    invoice_id: str | None
+    error: str | None
+    state: Dict[str, Any]
+
+class InvoiceBatchRequest(BaseModel):
+    user_id: str
+    file_paths: List[str]
+    target_system: TargetSystem
+
+class InvoiceBatchItem(BaseModel):
+    file_path: str
+    workflow_status: str
+    invoice_id: str | None
+
+class InvoiceBatchResponse(BaseModel):
+    job_id: str
+    job_status: str
+    total: int
+
+class InvoiceBatchStatusResponse(BaseModel):
+    job_id: str
+    job_status: str
+    total: int
+    completed: int
+    failed: int
+    error: str | None
+    results: List[InvoiceBatchItem]
+
+class InvoiceRevalidateRequest(BaseModel):
+    mapped_schema: Dict[str, Any]
+    changes: Dict[str, Any]
+    validation_results: List[Dict[str, Any]]
+    ocr_confidence: float = 1.0
+    invoice_id: str | None = None
 
 # --- API Endpoints ---
 
-@app.post("/invoice/upload", response_model=InvoiceUploadResponse)
+@app.post("/invoice/upload", response_model=InvoiceUploadResponse, status_code=202)
 async def upload_invoice(request: InvoiceUploadRequest):
-    # ... (existing upload logic)
-    return {"workflow_status": "SYNCED_SUCCESS", "invoice_id": "mock-id"}
+    """Queues an invoice for background processing and returns its job id."""
+    try:
+        job_id = job_manager.submit(request.user_id, request.file_path, request.target_system)
+    except JobQueueFullError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=429, detail="Too many invoices in flight. Retry later.", headers={"Retry-After": "5"})
+    logger.info(f"Queued invoice {request.file_path} as job {job_id}.")
+    return {"workflow_status": "QUEUED", "invoice_id": None, "job_id": job_id}
+
+@app.get("/invoice/{job_id}", response_model=InvoiceJobStatusResponse)
+async def get_invoice_job(job_id: str):
+    """Reports the current workflow state of a queued invoice."""
+    job = job_manager.get_job(job_id)
+    if job is None or job["kind"] != "invoice":
+        raise HTTPException(status_code=404, detail=f"Unknown job id: {job_id}")
+    state = job["state"]
+    return {
+        "job_id": job_id,
+        "job_status": job["job_status"],
+        "workflow_status": state.get("status"),
+        "invoice_id": state.get("invoice_id"),
+        "error": job["error"],
+        "state": state,
+    }
+
+@app.post("/invoice/batch", response_model=InvoiceBatchResponse, status_code=202)
+async def process_invoice_batch(request: InvoiceBatchRequest):
+    """Queues a batch of invoices for the stage-by-stage pipeline and returns its job id."""
+    try:
+        job_id = job_manager.submit_batch(request.user_id, request.file_paths, request.target_system)
+    except JobQueueFullError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=429, detail="Too many jobs in flight. Retry later.", headers={"Retry-After": "5"})
+    logger.info(f"Queued batch of {len(request.file_paths)} invoices for {request.target_system} as job {job_id}.")
+    return {"job_id": job_id, "job_status": "QUEUED", "total": len(request.file_paths)}
+
+@app.get("/invoice/batch/{job_id}", response_model=InvoiceBatchStatusResponse)
+async def get_invoice_batch_job(job_id: str):
+    """Reports the progress of a queued batch; invoices still in the pipeline show as QUEUED."""
+    job = job_manager.get_job(job_id)
+    if job is None or job["kind"] != "batch":
+        raise HTTPException(status_code=404, detail=f"Unknown batch job id: {job_id}")
+    results = [
+        InvoiceBatchItem(
+            file_path=path,
+            workflow_status=state.get("status", "") if state is not None else "QUEUED",
+            invoice_id=state.get("invoice_id") if state is not None else None,
+        )
+        for path, state in zip(job["file_paths"], job["results"])
+    ]
+    return {
+        "job_id": job_id,
+        "job_status": job["job_status"],
+        "total": len(results),
+        "completed": sum(1 for state in job["results"] if state is not None),
+        "failed": sum(1 for item in results if "FAILED" in item.workflow_status),
+        "error": job["error"],
+        "results": results,
+    }
+
+@app.post("/invoice/revalidate")
+def revalidate_invoice(request: InvoiceRevalidateRequest):
+    """Re-validates a reviewer's edits, rerunning only the rules that read the changed fields."""
+    try:
+        return revalidate(request.mapped_schema, request.changes, request.validation_results, request.ocr_confidence, invoice_id=request.invoice_id)
+    except (KeyError, IndexError, ValueError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid changes or validation results: {e}")
 
 @app.get("/metrics")
 def get_metrics():
@@ -52,6 +191,11 @@ def get_metrics():
         logger.exception("Failed to retrieve metrics.")
         raise HTTPException(status_code=500, detail="Failed to retrieve metrics.")
 
+@app.get("/ocr/stats")
+def get_ocr_stats():
+    """Per-engine OCR outcomes used to order the cascade."""
+    return mcp_client.call_tool("com.invoice.ocr", "ocr/engine_stats")
+
 @app.post("/invoice/summary")
 async def get_invoice_summary(invoice_data: Dict[str, Any]):
     """
@@ -59,7 +203,7 @@ async def get_invoice_summary(invoice_data: Dict[str, Any]):
     """
     logger.info("Received API request for invoice summary.")
     try:
-        summary = summary_agent_service.generate_summary(invoice_data)
+        summary = get_summary_agent_service().generate_summary(invoice_data)
         return summary
     except Exception as e:
         logger.exception("Failed to generate invoice summary.")
@@ -70,6 +214,18 @@ async def get_invoice_summary(invoice_data: Dict[str, Any]):
 def read_root():
     return {"message": "InvoiceCoreProcessor is running."}
 
+@app.get("/health")
+def health():
+    """Reports dependency health and connection pool utilisation."""
+    postgres = check_postgres_health()
+    return {
+        "status": "ok" if postgres["status"] == "ok" else "degraded",
+        "postgres": postgres,
+        "postgres_pool": get_postgres_pool_stats(),
+        "jobs": job_manager.stats(),
+        "agent_routing": get_agent_registry().policy.stats(),
+    }
+
 
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000)
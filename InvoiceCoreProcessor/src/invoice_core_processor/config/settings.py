@@ -24,11 +24,31 @@ class Settings(BaseSettings):
     A2A_REGISTRY_URL: str
     ENV: str = "dev"
 
+    # PostgreSQL connection pool
+    POSTGRES_POOL_MIN_SIZE: int = 1
+    POSTGRES_POOL_MAX_SIZE: int = 10
+    POSTGRES_POOL_TIMEOUT_SECONDS: float = 30.0
+    POSTGRES_POOL_HEALTH_CHECK_INTERVAL_SECONDS: float = 30.0
+
+    # MongoDB client pool (one shared client per process)
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_MAX_IDLE_TIME_MS: int = 60000
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = 30000
+
     # LLM and OCR Service Settings
     LLM_API_KEY: Optional[str] = None
     OPENAI_API_KEY: Optional[str] = None
     OPENAI_MODEL: str = "gpt-4"
     OPENAI_ENABLED: bool = True
+    # Async LLM mapping: concurrent requests, RPM/TPM quota (0 = unlimited) and retry on 429/5xx
+    OPENAI_MAX_IN_FLIGHT: int = 8
+    OPENAI_REQUESTS_PER_MINUTE: int = 500
+    OPENAI_TOKENS_PER_MINUTE: int = 30000
+    OPENAI_EXPECTED_COMPLETION_TOKENS: int = 1000
+    OPENAI_MAX_RETRIES: int = 5
+    OPENAI_RETRY_BASE_SECONDS: float = 0.5
+    OPENAI_RETRY_MAX_SECONDS: float = 30.0
 
     TYPHOON_OCR_API_KEY: Optional[str] = None
     TYPHOON_BASE_URL: str = "https://api.opentyphoon.ai/v1"
@@ -49,9 +69,105 @@ class Settings(BaseSettings):
 
     EASYOCR_LANGUAGES: str = "en"
 
+    # Worker processes for the CPU-bound OCR engines (None = CPU count, 0 = run inline).
+    # Each worker that runs EasyOCR holds its own copy of the model.
+    OCR_PROCESS_WORKERS: Optional[int] = 2
+    OCR_TASK_TIMEOUT_SECONDS: float = 300.0
+
+    # Image engine cascade: "sequential", "parallel" (top-N at once) or "hedged"
+    # (start the next engine once the running ones exceed the latency budget)
+    OCR_CASCADE_MODE: str = "sequential"
+    OCR_CASCADE_PARALLEL_ENGINES: int = 2
+    OCR_CASCADE_HEDGE_DELAY_SECONDS: float = 2.0
+
+    # Image preprocessing ahead of OCR (outputs cached by file hash)
+    OCR_PREPROCESS_ENABLED: bool = True
+    OCR_PREPROCESS_MAX_SIDE: int = 2400
+    OCR_PREPROCESS_DESKEW: bool = True
+    OCR_PREPROCESS_BINARIZE: bool = True
+    OCR_PREPROCESS_CACHE_DIR: str = ".cache/ocr_preprocessed"
+    OCR_PREPROCESS_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+
+    # Reorder engines from rolling per-engine outcomes (sliced by extension and image size)
+    OCR_ADAPTIVE_ORDERING: bool = True
+    OCR_STATS_WINDOW: int = 200
+    OCR_STATS_MIN_SAMPLES: int = 20
+
+    # PDF pages without a text layer are rasterised at this DPI and OCR'd in parallel
+    PDF_RASTER_RESOLUTION: int = 300
+    PDF_OCR_PAGE_CONCURRENCY: int = 4
+
+    # OCR result cache, keyed by file content hash + engine configuration
+    OCR_CACHE_ENABLED: bool = True
+    OCR_CACHE_DIR: str = ".cache/ocr"
+    OCR_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+
+    # LLM mapping response cache: "memory", "sqlite", "postgres" or "none"
+    MAPPING_CACHE_BACKEND: str = "memory"
+    MAPPING_CACHE_TTL_SECONDS: float = 30 * 24 * 3600
+    MAPPING_CACHE_MAX_ENTRIES: int = 10000
+    MAPPING_CACHE_SQLITE_PATH: str = ".cache/mapping_cache.sqlite3"
+
+    # Compact OCR text before prompting the mapping LLM (dedupe page headers/footers,
+    # collapse whitespace, drop boilerplate) and cap it at this many tokens (0 = no cap)
+    MAPPING_TEXT_COMPACTION: bool = True
+    MAPPING_TEXT_TOKEN_BUDGET: int = 3000
+
+    # Batched LLM mapping for bulk jobs: up to MAPPING_BATCH_SIZE short invoices share one
+    # request (1 = off). Longer invoices, and those the batch response misses, are mapped alone.
+    MAPPING_BATCH_SIZE: int = 4
+    MAPPING_BATCH_MAX_INVOICE_TOKENS: int = 1500
+    MAPPING_BATCH_MAX_TOKENS: int = 6000
+    MAPPING_BATCH_WAIT_SECONDS: float = 0.5
+
+    # Rule-based extraction for vendors whose template has been learned from LLM mappings
+    TEMPLATE_EXTRACTOR_ENABLED: bool = True
+    TEMPLATE_STORE_PATH: str = ".cache/invoice_templates.json"
+    TEMPLATE_MIN_CONFIRMATIONS: int = 2
+    TEMPLATE_MIN_CONFIDENCE: float = 0.9
+
     GEMINI_API_KEY: Optional[str] = None
     GEMINI_MODEL: str = "gemini-2.0-flash"
 
+    # Compiled plan of active validation rules; reloaded after this long, or at once on NOTIFY
+    VALIDATION_RULES_CACHE_TTL_SECONDS: float = 300.0
+
+    # Duplicate detection: Bloom filter of stored invoice keys, so only likely duplicates hit Postgres
+    DUPLICATE_FILTER_ENABLED: bool = True
+    DUPLICATE_FILTER_ERROR_RATE: float = 0.001
+    DUPLICATE_FILTER_MIN_CAPACITY: int = 100000
+    # How long the batch CLI waits for the filter to load before it starts processing
+    DUPLICATE_FILTER_WARMUP_TIMEOUT_SECONDS: float = 30.0
+    # Near-duplicates: same vendor, date within this many days and amount within this tolerance
+    DUPLICATE_NEAR_MATCH_DAYS: int = 7
+    DUPLICATE_NEAR_MATCH_AMOUNT_TOLERANCE: float = 1.0
+
+    # Agent registry routing table
+    AGENT_ROUTING_CACHE_TTL_SECONDS: float = 60.0
+    # One of: round_robin, least_in_flight, latency_weighted
+    AGENT_ROUTING_POLICY: str = "round_robin"
+    # Providers whose last heartbeat is older than this are skipped (0 = never stale)
+    AGENT_HEARTBEAT_TTL_SECONDS: float = 90.0
+    # How often in-process agents heartbeat (unset = a third of the TTL)
+    AGENT_HEARTBEAT_INTERVAL_SECONDS: Optional[float] = None
+
+    # Batch processing: number of invoices each pipeline stage works on at once
+    BATCH_CONCURRENCY_INGESTION: int = 16
+    BATCH_CONCURRENCY_OCR: int = 4
+    BATCH_CONCURRENCY_MAPPING: int = 8
+    BATCH_CONCURRENCY_VALIDATION: int = 16
+    BATCH_CONCURRENCY_INTEGRATION: int = 8
+    BATCH_CONCURRENCY_SUMMARY: int = 8
+
+    # Optional background warm-up of lazily imported dependencies at API startup
+    WARMUP_ON_STARTUP: bool = False
+    WARMUP_COMPONENTS: str = "workflow,servers,ocr,mapping,summary"
+
+    # Background jobs for POST /invoice/upload
+    JOB_WORKERS: int = 8
+    JOB_QUEUE_SIZE: int = 100
+    JOB_HISTORY_SIZE: int = 10000
+
 
 @lru_cache()
 def get_settings() -> Settings:
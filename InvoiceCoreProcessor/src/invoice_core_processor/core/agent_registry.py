@@ -1,85 +1,280 @@
+import select
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from psycopg2.extras import Json
-from typing import Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from invoice_core_processor.core.models import AgentCard, ToolDefinition
-from invoice_core_processor.core.database import get_postgres_connection
+from invoice_core_processor.core.database import postgres_connection, get_postgres_connection
+from invoice_core_processor.core.routing import Provider, RoutingPolicy, get_routing_policy
+from invoice_core_processor.config.settings import get_settings
+
+# Postgres NOTIFY channel used to tell every replica that the registry changed.
+AGENT_REGISTRY_CHANNEL = "agent_registry_changed"
+
+Route = Tuple[str, ToolDefinition]
 
 class AgentRegistryService:
     """
     Handles the registration and discovery of agents in the network.
     This service now connects directly to the database, decoupling it from the DataStoreAgent.
+
+    Capability lookups are served from an in-process routing table with a TTL.
+    The table is cleared whenever this process registers an agent and, when the
+    change listener is running, whenever any replica does.
+
+    The table holds every provider of a capability; a RoutingPolicy picks one
+    per call, skipping providers whose heartbeat is older than heartbeat_ttl.
+    If every provider is stale, the one seen alive most recently is used.
+    Agents registered by this process are kept alive by start_heartbeats.
     """
 
+    def __init__(self, cache_ttl: Optional[float] = None, policy: Optional[RoutingPolicy] = None, heartbeat_ttl: Optional[float] = None):
+        settings = get_settings()
+        self.cache_ttl = cache_ttl if cache_ttl is not None else settings.AGENT_ROUTING_CACHE_TTL_SECONDS
+        self.policy = policy or get_routing_policy(settings.AGENT_ROUTING_POLICY)
+        self.heartbeat_ttl = heartbeat_ttl if heartbeat_ttl is not None else settings.AGENT_HEARTBEAT_TTL_SECONDS
+        self._routes: Dict[str, Tuple[float, List[Provider]]] = {}
+        self._routes_lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+        self._listener_stop = threading.Event()
+        self._local_agents = set()
+        self._local_agents_lock = threading.Lock()
+        self._heartbeats: Optional[threading.Thread] = None
+        self._heartbeats_stop = threading.Event()
+
     def register_agent(self, agent_card: AgentCard) -> dict:
         """
         Registers an agent and its tools directly into the database.
         """
         print(f"Registering agent: {agent_card.agent_id}")
-        conn = None
         try:
-            conn = get_postgres_connection()
-            with conn.cursor() as cur:
-                # 1. Register the agent card
-                cur.execute(
-                    """
-                    INSERT INTO agent_registry (agent_id, agent_card)
-                    VALUES (%s, %s)
-                    ON CONFLICT (agent_id) DO UPDATE SET
-                        agent_card = EXCLUDED.agent_card,
-                        last_heartbeat = NOW();
-                    """,
-                    (agent_card.agent_id, Json(agent_card.dict()))
-                )
-
-                # 2. Register each tool
-                for tool in agent_card.tools:
+            with postgres_connection() as conn:
+                with conn.cursor() as cur:
+                    # 1. Register the agent card
                     cur.execute(
                         """
-                        INSERT INTO agent_tools (agent_id, tool_id, capability, description, parameters)
-                        VALUES (%s, %s, %s, %s, %s)
-                        ON CONFLICT (agent_id, tool_id) DO UPDATE SET
-                            capability = EXCLUDED.capability,
-                            description = EXCLUDED.description,
-                            parameters = EXCLUDED.parameters;
+                        INSERT INTO agent_registry (agent_id, agent_card)
+                        VALUES (%s, %s)
+                        ON CONFLICT (agent_id) DO UPDATE SET
+                            agent_card = EXCLUDED.agent_card,
+                            last_heartbeat = NOW();
                         """,
-                        (agent_card.agent_id, tool.tool_id, tool.capability, tool.description, Json(tool.parameters or {}))
+                        (agent_card.agent_id, Json(agent_card.dict()))
                     )
-                conn.commit()
+
+                    # 2. Register each tool
+                    for tool in agent_card.tools:
+                        cur.execute(
+                            """
+                            INSERT INTO agent_tools (agent_id, tool_id, capability, description, parameters)
+                            VALUES (%s, %s, %s, %s, %s)
+                            ON CONFLICT (agent_id, tool_id) DO UPDATE SET
+                                capability = EXCLUDED.capability,
+                                description = EXCLUDED.description,
+                                parameters = EXCLUDED.parameters;
+                            """,
+                            (agent_card.agent_id, tool.tool_id, tool.capability, tool.description, Json(tool.parameters or {}))
+                        )
+
+                    # 3. Tell other replicas to drop their routing tables (delivered on commit)
+                    cur.execute("SELECT pg_notify(%s, %s);", (AGENT_REGISTRY_CHANNEL, agent_card.agent_id))
+                    conn.commit()
+            self.invalidate_routes()
+            with self._local_agents_lock:
+                self._local_agents.add(agent_card.agent_id)
             print(f"Agent {agent_card.agent_id} and its tools registered successfully.")
             return {"status": "AGENT_FULLY_REGISTERED", "agent_id": agent_card.agent_id}
         except Exception as e:
-            if conn: conn.rollback()
             print(f"Failed to register agent or tools: {e}")
             return {"status": "FAILED_REGISTRATION", "error": str(e)}
-        finally:
-            if conn: conn.close()
 
-    def lookup_agent_by_capability(self, capability: str) -> Optional[Tuple[str, ToolDefinition]]:
+    def heartbeat(self, agent_id: str) -> dict:
+        """Marks an agent as alive. Agents call this periodically."""
+        try:
+            with postgres_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("UPDATE agent_registry SET last_heartbeat = NOW() WHERE agent_id = %s;", (agent_id,))
+                    conn.commit()
+            return {"status": "HEARTBEAT_RECORDED", "agent_id": agent_id}
+        except Exception as e:
+            return {"status": "FAILED_HEARTBEAT", "error": str(e)}
+
+    def heartbeat_agents(self, agent_ids: List[str]) -> dict:
+        """Marks several agents as alive in one statement."""
+        try:
+            with postgres_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("UPDATE agent_registry SET last_heartbeat = NOW() WHERE agent_id = ANY(%s);", (list(agent_ids),))
+                    conn.commit()
+            return {"status": "HEARTBEAT_RECORDED", "agent_ids": list(agent_ids)}
+        except Exception as e:
+            return {"status": "FAILED_HEARTBEAT", "error": str(e)}
+
+    def start_heartbeats(self, agent_ids: Iterable[str] = (), interval: Optional[float] = None):
+        """
+        Starts a background thread that heartbeats `agent_ids` and every agent
+        this process registers. Without an interval it beats three times per
+        heartbeat TTL; with a TTL of 0, staleness is not checked and nothing is started.
+        """
+        if interval is None:
+            interval = get_settings().AGENT_HEARTBEAT_INTERVAL_SECONDS
+        if interval is None and self.heartbeat_ttl:
+            interval = self.heartbeat_ttl / 3
+        if not interval or (self._heartbeats is not None and self._heartbeats.is_alive()):
+            return
+        with self._local_agents_lock:
+            self._local_agents.update(agent_ids)
+        self._heartbeats_stop.clear()
+        self._heartbeats = threading.Thread(target=self._send_heartbeats, args=(interval,), name="agent-heartbeats", daemon=True)
+        self._heartbeats.start()
+
+    def stop_heartbeats(self):
+        self._heartbeats_stop.set()
+        if self._heartbeats is not None:
+            self._heartbeats.join(timeout=5)
+            self._heartbeats = None
+
+    def _send_heartbeats(self, interval: float):
+        # Beat at once, so agents are fresh as soon as the process is up.
+        while True:
+            with self._local_agents_lock:
+                agent_ids = sorted(self._local_agents)
+            if agent_ids:
+                result = self.heartbeat_agents(agent_ids)
+                if result["status"] != "HEARTBEAT_RECORDED":
+                    print(f"Agent heartbeat failed: {result['error']}")
+            if self._heartbeats_stop.wait(interval):
+                return
+
+    def lookup_agent_by_capability(self, capability: str) -> Optional[Route]:
         """
         Finds an agent that provides a specific capability.
-        Returns the agent's ID and the specific tool that matches the capability.
+        Returns the agent's ID and the specific tool that matches the capability,
+        chosen among all live providers by the routing policy.
         """
-        conn = None
-        try:
-            conn = get_postgres_connection()
+        providers = self._cached_providers(capability)
+        if providers is None:
+            try:
+                providers = self.lookup_agents_by_capability(capability)
+            except Exception as e:
+                print(f"Error looking up agent by capability '{capability}': {e}")
+                return None
+            if providers:
+                with self._routes_lock:
+                    self._routes[capability] = (time.monotonic() + self.cache_ttl, providers)
+        return self._choose(capability, providers)
+
+    def get_cached_route(self, capability: str) -> Optional[Route]:
+        """Chooses a route from the cached providers without touching the database."""
+        providers = self._cached_providers(capability)
+        if providers is None:
+            return None
+        return self._choose(capability, providers)
+
+    def lookup_agents_by_capability(self, capability: str) -> List[Provider]:
+        """Returns every registered provider of a capability, with its last heartbeat."""
+        with postgres_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     """
-                    SELECT agent_id, tool_id, capability, description, parameters
-                    FROM agent_tools
-                    WHERE capability = %s
-                    LIMIT 1;
+                    SELECT t.agent_id, t.tool_id, t.capability, t.description, t.parameters, r.last_heartbeat
+                    FROM agent_tools t
+                    JOIN agent_registry r ON r.agent_id = t.agent_id
+                    WHERE t.capability = %s
+                    ORDER BY t.agent_id;
                     """,
                     (capability,)
                 )
-                result = cur.fetchone()
-                if result:
-                    agent_id, tool_id, cap, desc, params = result
-                    tool_def = ToolDefinition(tool_id=tool_id, capability=cap, description=desc, parameters=params)
-                    return agent_id, tool_def
-            return None
-        except Exception as e:
-            print(f"Error looking up agent by capability '{capability}': {e}")
-            return None
+                rows = cur.fetchall()
+        return [
+            Provider(agent_id, ToolDefinition(tool_id=tool_id, capability=cap, description=desc, parameters=params), last_heartbeat)
+            for agent_id, tool_id, cap, desc, params, last_heartbeat in rows
+        ]
+
+    @contextmanager
+    def dispatch(self, agent_id: str):
+        """Wraps a call to an agent so the routing policy can track load and latency."""
+        self.policy.on_start(agent_id)
+        started = time.monotonic()
+        try:
+            yield
         finally:
-            if conn: conn.close()
+            self.policy.on_finish(agent_id, time.monotonic() - started)
+
+    def invalidate_routes(self, capability: Optional[str] = None):
+        with self._routes_lock:
+            if capability is None:
+                self._routes.clear()
+            else:
+                self._routes.pop(capability, None)
+
+    def _cached_providers(self, capability: str) -> Optional[List[Provider]]:
+        entry = self._routes.get(capability)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def _choose(self, capability: str, providers: List[Provider]) -> Optional[Route]:
+        if not providers:
+            return None
+        live = [p for p in providers if self._is_live(p)]
+        if not live:
+            # Better a possibly-dead agent than failing every invoice outright.
+            provider = max(providers, key=lambda p: p.last_heartbeat or datetime.min.replace(tzinfo=timezone.utc))
+            print(f"Every provider of {capability} is stale; falling back to {provider.agent_id}.")
+            return provider.agent_id, provider.tool
+        provider = self.policy.choose(capability, live)
+        return provider.agent_id, provider.tool
+
+    def _is_live(self, provider: Provider) -> bool:
+        if not self.heartbeat_ttl or provider.last_heartbeat is None:
+            return True
+        age = (datetime.now(timezone.utc) - provider.last_heartbeat).total_seconds()
+        return age <= self.heartbeat_ttl
+
+    # --- Change Listener ---
+
+    def start_change_listener(self):
+        """
+        Starts a background thread that LISTENs for registry changes made by any
+        replica and clears the routing table when one arrives.
+        """
+        if self._listener is not None and self._listener.is_alive():
+            return
+        self._listener_stop.clear()
+        self._listener = threading.Thread(target=self._listen_for_changes, name="agent-registry-listener", daemon=True)
+        self._listener.start()
+
+    def stop_change_listener(self):
+        self._listener_stop.set()
+        if self._listener is not None:
+            self._listener.join(timeout=5)
+            self._listener = None
+
+    def _listen_for_changes(self):
+        while not self._listener_stop.is_set():
+            conn = None
+            try:
+                # LISTEN needs a dedicated connection for the lifetime of the loop.
+                conn = get_postgres_connection()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {AGENT_REGISTRY_CHANNEL};")
+                # Anything could have changed while we were not listening.
+                self.invalidate_routes()
+                while not self._listener_stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.invalidate_routes()
+            except Exception as e:
+                print(f"Agent registry listener error: {e}. Reconnecting...")
+                self._listener_stop.wait(5)
+            finally:
+                if conn is not None:
+                    conn.close()
@@ -0,0 +1,306 @@
+# core/batch.py
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from langgraph.constants import END
+
+from invoice_core_processor.config.settings import get_settings
+from invoice_core_processor.services.duplicate_detection import get_duplicate_detector
+from invoice_core_processor.core.workflow import (
+    create_initial_state,
+    decide_next_step,
+    ingestion_step_async,
+    ocr_step_async,
+    mapping_step_async,
+    mapping_batch_step_async,
+    validation_step_async,
+    integration_step_async,
+    summary_step_async,
+)
+
+# Stages in pipeline order. Routing between them follows decide_next_step,
+# exactly as in the compiled graph.
+STAGE_ORDER = ["ingestion", "ocr", "mapping", "validation", "integration", "summary"]
+
+SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".png", ".jpg", ".jpeg", ".tiff", ".bmp", ".webp"}
+
+StageFunc = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+# Takes several states and returns one update per state, in order.
+BatchStageFunc = Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]
+
+
+def get_default_stages() -> Dict[str, StageFunc]:
+    return {
+        "ingestion": ingestion_step_async,
+        "ocr": ocr_step_async,
+        "mapping": mapping_step_async,
+        "validation": validation_step_async,
+        "integration": integration_step_async,
+        "summary": summary_step_async,
+    }
+
+
+def get_default_batch_stages() -> Dict[str, BatchStageFunc]:
+    """Stages that process several invoices per call; mapping packs short invoices into one LLM request."""
+    if get_settings().MAPPING_BATCH_SIZE > 1:
+        return {"mapping": mapping_batch_step_async}
+    return {}
+
+
+def get_default_batch_sizes() -> Dict[str, int]:
+    return {"mapping": get_settings().MAPPING_BATCH_SIZE}
+
+
+def get_default_concurrency() -> Dict[str, int]:
+    settings = get_settings()
+    return {
+        "ingestion": settings.BATCH_CONCURRENCY_INGESTION,
+        "ocr": settings.BATCH_CONCURRENCY_OCR,
+        "mapping": settings.BATCH_CONCURRENCY_MAPPING,
+        "validation": settings.BATCH_CONCURRENCY_VALIDATION,
+        "integration": settings.BATCH_CONCURRENCY_INTEGRATION,
+        "summary": settings.BATCH_CONCURRENCY_SUMMARY,
+    }
+
+
+class BatchProcessor:
+    """
+    Runs many invoices through the workflow as a stage-by-stage pipeline.
+
+    Each stage has its own pool of workers, sized by its concurrency limit, and
+    a bounded inbox so a slow stage (usually OCR) applies backpressure to the
+    stages in front of it instead of buffering the whole batch in memory.
+
+    A stage listed in `batch_stages` instead groups up to `batch_sizes[stage]`
+    invoices (waiting at most `batch_wait` seconds for a group to fill) and
+    runs up to its concurrency limit of groups at once.
+    """
+
+    def __init__(
+        self,
+        stages: Optional[Dict[str, StageFunc]] = None,
+        concurrency: Optional[Dict[str, int]] = None,
+        batch_stages: Optional[Dict[str, BatchStageFunc]] = None,
+        batch_sizes: Optional[Dict[str, int]] = None,
+        batch_wait: Optional[float] = None,
+    ):
+        self.stages = stages or get_default_stages()
+        self.concurrency = {**get_default_concurrency(), **(concurrency or {})}
+        if batch_stages is None:
+            # Custom per-invoice stages are not silently replaced by the default batched ones.
+            batch_stages = get_default_batch_stages() if stages is None else {}
+        self.batch_stages = batch_stages
+        self.batch_sizes = {**get_default_batch_sizes(), **(batch_sizes or {})}
+        self.batch_wait = get_settings().MAPPING_BATCH_WAIT_SECONDS if batch_wait is None else batch_wait
+
+    async def run(
+        self,
+        user_id: str,
+        file_paths: List[str],
+        target_system: str,
+        on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Processes every file and returns the final state of each invoice,
+        in the same order as `file_paths`.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(file_paths)
+        if not file_paths:
+            return []
+
+        inboxes = {
+            name: asyncio.Queue(maxsize=max(1, self.concurrency[name], self.batch_sizes.get(name, 1)) * 2)
+            for name in STAGE_ORDER
+        }
+        pending = len(file_paths)
+        all_done = asyncio.Event()
+
+        def finish(index: int, state: Dict[str, Any]):
+            nonlocal pending
+            results[index] = state
+            if on_result:
+                on_result(index, state)
+            pending -= 1
+            if pending == 0:
+                all_done.set()
+
+        async def forward(index: int, state: Dict[str, Any]):
+            next_step = decide_next_step(state)
+            if next_step == END or next_step not in inboxes:
+                finish(index, state)
+            else:
+                await inboxes[next_step].put((index, state))
+
+        async def worker(name: str):
+            inbox = inboxes[name]
+            while True:
+                index, state = await inbox.get()
+                try:
+                    update = await self.stages[name](state)
+                    state = {**state, **(update or {})}
+                except Exception as e:
+                    print(f"[Batch] Stage '{name}' failed for {file_paths[index]}: {e}")
+                    state = {**state, "status": f"FAILED_{name.upper()}", "error": str(e)}
+                finally:
+                    inbox.task_done()
+                await forward(index, state)
+
+        async def collect(name: str) -> List[tuple]:
+            inbox, size = inboxes[name], max(1, self.batch_sizes.get(name, 1))
+            items = [await inbox.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(items) < size:
+                if not inbox.empty():
+                    items.append(inbox.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(inbox.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            return items
+
+        async def run_group(name: str, items: List[tuple], slots: asyncio.Semaphore):
+            try:
+                states = [state for _, state in items]
+                try:
+                    updates = await self.batch_stages[name](states)
+                    states = [{**state, **(update or {})} for state, update in zip(states, updates)]
+                except Exception as e:
+                    print(f"[Batch] Stage '{name}' failed for {len(items)} invoices: {e}")
+                    states = [{**state, "status": f"FAILED_{name.upper()}", "error": str(e)} for state in states]
+                finally:
+                    for _ in items:
+                        inboxes[name].task_done()
+                for (index, _), state in zip(items, states):
+                    await forward(index, state)
+            finally:
+                slots.release()
+
+        async def batch_worker(name: str):
+            # A single collector forms the groups, so they fill up instead of
+            # being split across idle workers; groups then run concurrently.
+            slots = asyncio.Semaphore(max(1, self.concurrency[name]))
+            groups = set()
+            try:
+                while True:
+                    await slots.acquire()
+                    try:
+                        items = await collect(name)
+                    except BaseException:
+                        slots.release()
+                        raise
+                    group = asyncio.create_task(run_group(name, items, slots))
+                    groups.add(group)
+                    group.add_done_callback(groups.discard)
+            finally:
+                for group in groups:
+                    group.cancel()
+
+        async def feed():
+            for index, path in enumerate(file_paths):
+                await inboxes["ingestion"].put((index, create_initial_state(user_id, path, target_system)))
+
+        loop = asyncio.get_running_loop()
+        workers = [
+            asyncio.create_task(worker(name))
+            for name in STAGE_ORDER if name not in self.batch_stages
+            for _ in range(max(1, self.concurrency[name]))
+        ]
+        workers += [asyncio.create_task(batch_worker(name)) for name in STAGE_ORDER if name in self.batch_stages]
+        feeder = asyncio.create_task(feed())
+        try:
+            await all_done.wait()
+        finally:
+            feeder.cancel()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(feeder, *workers, return_exceptions=True)
+
+        return results
+
+
+def expand_file_paths(paths: List[str]) -> List[str]:
+    """Expands directories into the invoice files they contain, in sorted order."""
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                        expanded.append(os.path.join(root, name))
+        else:
+            expanded.append(path)
+    return expanded
+
+
+def _parse_concurrency(values: List[str]) -> Dict[str, int]:
+    overrides = {}
+    for value in values:
+        stage, _, limit = value.partition("=")
+        if stage not in STAGE_ORDER or not limit.isdigit():
+            raise argparse.ArgumentTypeError(f"Invalid concurrency override: {value!r} (expected e.g. ocr=8)")
+        overrides[stage] = int(limit)
+    return overrides
+
+
+async def _run_batch(processor: BatchProcessor, user_id: str, file_paths: List[str], target_system: str, on_result) -> List[Dict[str, Any]]:
+    from invoice_core_processor.services.mapping import close_async_openai_client
+    try:
+        return await processor.run(user_id, file_paths, target_system, on_result=on_result)
+    finally:
+        # The client's connections are bound to this loop, which asyncio.run is about to close.
+        await close_async_openai_client()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a batch of invoices through the processing pipeline.")
+    parser.add_argument("paths", nargs="+", help="Invoice files or directories containing invoices.")
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--target-system", required=True, choices=["TALLY", "ZOHO", "QUICKBOOKS"])
+    parser.add_argument("--concurrency", action="append", default=[], metavar="STAGE=N",
+                        help="Override a stage's concurrency limit, e.g. --concurrency ocr=8. Repeatable.")
+    parser.add_argument("--output", help="Write one JSON result per line to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    file_paths = expand_file_paths(args.paths)
+    processor = BatchProcessor(concurrency=_parse_concurrency(args.concurrency))
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+
+    def write_result(index: int, state: Dict[str, Any]):
+        out.write(json.dumps({
+            "file_path": file_paths[index],
+            "invoice_id": state.get("invoice_id"),
+            "workflow_status": state.get("status"),
+        }) + "\n")
+        out.flush()
+
+    # Without the API's lifespan, warm the duplicate filter here so DUP-001 does not query Postgres per invoice.
+    settings = get_settings()
+    detector = get_duplicate_detector() if settings.DUPLICATE_FILTER_ENABLED else None
+    if detector is not None:
+        detector.start_change_listener()
+        if not detector.wait_until_warmed(settings.DUPLICATE_FILTER_WARMUP_TIMEOUT_SECONDS):
+            print("Duplicate filter is not warm yet; duplicate checks query the database until it is.", file=sys.stderr)
+    try:
+        results = asyncio.run(_run_batch(processor, args.user_id, file_paths, args.target_system, write_result))
+    finally:
+        if detector is not None:
+            detector.stop_change_listener()
+        if args.output:
+            out.close()
+
+    failed = sum(1 for state in results if "FAILED" in state.get("status", ""))
+    print(f"Processed {len(results)} invoices ({failed} failed).", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
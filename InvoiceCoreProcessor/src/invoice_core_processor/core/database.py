@@ -1,6 +1,12 @@
+import asyncio
+import threading
+import time
 import psycopg2
+import psycopg2.extensions
 import motor.motor_asyncio
+from contextlib import contextmanager
 from functools import lru_cache
+from psycopg2 import pool as pg_pool
 
 from invoice_core_processor.config.settings import get_settings
 
@@ -10,19 +16,239 @@ def get_db_settings():
     return get_settings()
 
 def get_postgres_connection():
-    """Establishes and returns a connection to the PostgreSQL database."""
+    """
+    Establishes and returns a dedicated, unpooled connection to PostgreSQL.
+    Prefer `postgres_connection()` for request-path work; this is kept for
+    long-lived connections such as LISTEN loops and one-off scripts.
+    """
     settings = get_db_settings()
     conn = psycopg2.connect(settings.POSTGRES_URI)
     return conn
 
+# --- PostgreSQL Connection Pool ---
+
+class PostgresConnectionPool:
+    """
+    Thread-safe, process-wide PostgreSQL pool.
+
+    Wraps psycopg2's ThreadedConnectionPool so that checkouts block (up to a
+    timeout) instead of failing when every connection is in use, validates
+    connections that have been idle for a while before handing them out, and
+    keeps utilisation counters for the health endpoint.
+    """
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, timeout: float, health_check_interval: float):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._pool = pg_pool.ThreadedConnectionPool(min_size, max_size, dsn)
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._last_returned = {}
+        self._stats = {"checkouts": 0, "timeouts": 0, "discarded": 0, "in_use": 0, "peak_in_use": 0, "wait_ms_total": 0.0}
+
+    def getconn(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise pg_pool.PoolError(f"Timed out after {self.timeout}s waiting for a PostgreSQL connection.")
+        try:
+            conn = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._stats["in_use"])
+            self._stats["wait_ms_total"] += (time.monotonic() - started) * 1000
+        return conn
+
+    def putconn(self, conn):
+        try:
+            broken = conn.closed != 0
+            if not broken and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                # Uncommitted work is discarded, as it would be by conn.close().
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            if broken:
+                self._discard(conn)
+            else:
+                self._last_returned[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection and always returns it to the pool."""
+        conn = self.getconn()
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            raise
+        finally:
+            self.putconn(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["max_size"] = self.max_size
+        stats["open_connections"] = len(self._pool._used) + len(self._pool._pool)
+        stats["idle_connections"] = len(self._pool._pool)
+        stats["utilisation"] = round(stats["in_use"] / self.max_size, 3) if self.max_size else 0.0
+        return stats
+
+    def close(self):
+        self._pool.closeall()
+
+    def _checkout_healthy(self):
+        # A connection the server has dropped is only noticed on use, so
+        # retry with a fresh one rather than surfacing a stale socket.
+        for _ in range(self.max_size + 1):
+            conn = self._pool.getconn()
+            if conn.closed == 0 and self._is_alive(conn):
+                return conn
+            self._discard(conn)
+        raise pg_pool.PoolError("Could not obtain a healthy PostgreSQL connection.")
+
+    def _is_alive(self, conn) -> bool:
+        last_returned = self._last_returned.get(id(conn))
+        if last_returned is None or time.monotonic() - last_returned < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self._last_returned.pop(id(conn), None)
+        with self._lock:
+            self._stats["discarded"] += 1
+        try:
+            self._pool.putconn(conn, close=True)
+        except pg_pool.PoolError:
+            pass
+
+_postgres_pool = None
+_postgres_pool_lock = threading.Lock()
+
+def get_postgres_pool() -> PostgresConnectionPool:
+    """Returns the process-wide pool, creating it on first use."""
+    global _postgres_pool
+    if _postgres_pool is None:
+        with _postgres_pool_lock:
+            if _postgres_pool is None:
+                settings = get_db_settings()
+                _postgres_pool = PostgresConnectionPool(
+                    settings.POSTGRES_URI,
+                    min_size=settings.POSTGRES_POOL_MIN_SIZE,
+                    max_size=settings.POSTGRES_POOL_MAX_SIZE,
+                    timeout=settings.POSTGRES_POOL_TIMEOUT_SECONDS,
+                    health_check_interval=settings.POSTGRES_POOL_HEALTH_CHECK_INTERVAL_SECONDS,
+                )
+    return _postgres_pool
+
+@contextmanager
+def postgres_connection():
+    """
+    Context manager that checks a connection out of the shared pool:
+
+        with postgres_connection() as conn:
+            with conn.cursor() as cur: ...
+            conn.commit()
+    """
+    with get_postgres_pool().connection() as conn:
+        yield conn
+
+def get_postgres_pool_stats() -> dict:
+    """Returns pool utilisation counters, or an empty dict if the pool is not open yet."""
+    return _postgres_pool.stats() if _postgres_pool is not None else {}
+
+def check_postgres_health() -> dict:
+    """Runs a trivial query through the pool."""
+    try:
+        with postgres_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+        return {"status": "ok"}
+    except Exception as e:
+        return {"status": "error", "error": str(e)}
+
+def close_postgres_pool():
+    global _postgres_pool
+    with _postgres_pool_lock:
+        if _postgres_pool is not None:
+            _postgres_pool.close()
+            _postgres_pool = None
+
+# --- MongoDB ---
+
+_mongo_client = None
+_mongo_client_loop = None
+_mongo_client_lock = threading.Lock()
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
 def get_mongo_client():
-    """Establishes and returns an asynchronous client connection to MongoDB."""
-    settings = get_db_settings()
-    client = motor.motor_asyncio.AsyncIOMotorClient(settings.MONGO_URI)
-    return client
+    """
+    Returns the process-wide asynchronous MongoDB client, created on first use.
+
+    Motor clients are bound to the event loop they are first used on, so if
+    this is called from a different (or closed) loop the old client is closed
+    and replaced. Within a server process this means exactly one client.
+    """
+    global _mongo_client, _mongo_client_loop
+    loop = _running_loop()
+    with _mongo_client_lock:
+        if _mongo_client is not None and loop is not None:
+            if _mongo_client_loop is None:
+                _mongo_client_loop = loop
+            elif _mongo_client_loop is not loop:
+                print("Event loop changed; replacing MongoDB client.")
+                _mongo_client.close()
+                _mongo_client = None
+
+        if _mongo_client is None:
+            settings = get_db_settings()
+            _mongo_client = motor.motor_asyncio.AsyncIOMotorClient(
+                settings.MONGO_URI,
+                maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+                minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=settings.MONGO_MAX_IDLE_TIME_MS,
+                serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            )
+            _mongo_client_loop = loop
+    return _mongo_client
 
 def get_mongo_db():
     """Returns the MongoDB database instance."""
     settings = get_db_settings()
     client = get_mongo_client()
     return client[settings.MONGO_DB_NAME]
+
+def close_mongo_client():
+    """Closes the shared MongoDB client. Call on process shutdown."""
+    global _mongo_client, _mongo_client_loop
+    with _mongo_client_lock:
+        if _mongo_client is not None:
+            _mongo_client.close()
+            _mongo_client = None
+            _mongo_client_loop = None
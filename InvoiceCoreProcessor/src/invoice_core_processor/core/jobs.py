@@ -0,0 +1,156 @@
+# core/jobs.py
+
+import asyncio
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from invoice_core_processor.config.settings import get_settings
+from invoice_core_processor.core.batch import BatchProcessor
+from invoice_core_processor.core.workflow import create_initial_state
+
+class JobQueueFullError(Exception):
+    """Raised when the job queue is at capacity and cannot accept more invoices."""
+
+
+class InvoiceJobManager:
+    """
+    In-process worker pool that runs invoices through the async workflow graph.
+
+    Submissions go onto a bounded queue and return a job id immediately; a fixed
+    number of worker tasks drain the queue on the server's event loop. Each job
+    keeps the latest graph state so callers can poll its progress. A batch job
+    runs its files through the stage-by-stage BatchProcessor and keeps each
+    invoice's final state as it finishes.
+
+    Pass either a compiled `workflow` or a `workflow_factory`; the factory is
+    called off the event loop when the first job runs, so compiling the graph
+    does not slow down startup.
+    """
+
+    def __init__(self, workflow=None, max_workers: Optional[int] = None, queue_size: Optional[int] = None, history_size: Optional[int] = None, workflow_factory: Optional[Callable[[], Any]] = None, batch_processor_factory: Callable[[], BatchProcessor] = BatchProcessor):
+        if workflow is None and workflow_factory is None:
+            raise ValueError("Either workflow or workflow_factory is required.")
+        settings = get_settings()
+        self.workflow = workflow
+        self.workflow_factory = workflow_factory
+        self.batch_processor_factory = batch_processor_factory
+        self.max_workers = max_workers or settings.JOB_WORKERS
+        self.queue_size = queue_size or settings.JOB_QUEUE_SIZE
+        self.history_size = history_size or settings.JOB_HISTORY_SIZE
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+        print(f"InvoiceJobManager started with {self.max_workers} workers (queue size {self.queue_size}).")
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        print("InvoiceJobManager stopped.")
+
+    def submit(self, user_id: str, file_path: str, target_system: str) -> str:
+        """
+        Queues an invoice for processing and returns its job id.
+        Raises JobQueueFullError instead of blocking when the queue is full.
+        """
+        return self._enqueue({"kind": "invoice", "state": create_initial_state(user_id, file_path, target_system)})
+
+    def submit_batch(self, user_id: str, file_paths: List[str], target_system: str) -> str:
+        """
+        Queues a batch of invoices as a single job and returns its job id.
+        Raises JobQueueFullError instead of blocking when the queue is full.
+        """
+        return self._enqueue({
+            "kind": "batch",
+            "user_id": user_id,
+            "file_paths": list(file_paths),
+            "target_system": target_system,
+            "results": [None] * len(file_paths),
+        })
+
+    def _enqueue(self, fields: Dict[str, Any]) -> str:
+        if self._queue is None:
+            raise RuntimeError("InvoiceJobManager has not been started.")
+
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "job_status": "QUEUED",
+            **fields,
+            "error": None,
+            "submitted_at": datetime.now(timezone.utc),
+            "finished_at": None,
+        }
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFullError(f"Job queue is full ({self.queue_size} jobs waiting).")
+
+        self._jobs[job_id] = job
+        self._evict_finished_jobs()
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": len(self._workers),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "queue_capacity": self.queue_size,
+            "tracked_jobs": len(self._jobs),
+        }
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job["job_status"] = "RUNNING"
+            try:
+                if job["kind"] == "batch":
+                    await self._run_batch(job)
+                else:
+                    await self._run_invoice(job)
+            except Exception as e:
+                print(f"Job {job['job_id']} failed: {e}")
+                job["job_status"] = "FAILED"
+                job["error"] = str(e)
+            finally:
+                job["finished_at"] = datetime.now(timezone.utc)
+                self._queue.task_done()
+
+    async def _run_invoice(self, job: Dict[str, Any]):
+        if self.workflow is None:
+            self.workflow = await asyncio.to_thread(self.workflow_factory)
+        async for state in self.workflow.astream(job["state"], stream_mode="values"):
+            job["state"] = state
+        job["job_status"] = "FAILED" if "FAILED" in job["state"].get("status", "") else "COMPLETED"
+
+    async def _run_batch(self, job: Dict[str, Any]):
+        # Individual invoices may fail; the batch job itself completes and reports them.
+        def on_result(index: int, state: Dict[str, Any]):
+            job["results"][index] = state
+
+        await self.batch_processor_factory().run(job["user_id"], job["file_paths"], job["target_system"], on_result=on_result)
+        job["job_status"] = "COMPLETED"
+
+    def _evict_finished_jobs(self):
+        # Drop the oldest finished jobs once we track more than history_size;
+        # queued and running jobs are never evicted.
+        overflow = len(self._jobs) - self.history_size
+        if overflow <= 0:
+            return
+        for job_id in list(self._jobs):
+            if overflow <= 0:
+                break
+            if self._jobs[job_id]["finished_at"] is not None:
+                del self._jobs[job_id]
+                overflow -= 1
@@ -1,31 +1,40 @@
 # core/mcp_clients.py
 
-from invoice_core_processor.servers.database_server import DataStoreAgentServer
-from invoice_core_processor.servers.ocr_server import OCRAgentServer
-from invoice_core_processor.servers.mapper_server import SchemaMapperAgentServer
-from invoice_core_processor.servers.agent_server import AnomalyAgentServer
-from invoice_core_processor.core.integration_agent import DataIntegrationAgentServer
-from invoice_core_processor.microservices.ingestion.main import get_ingestion_service # Use the factory
 import asyncio
+import importlib
+import threading
+
+# Agent ID -> "module:ServerClass". Servers are imported on first use, so a
+# process only loads the dependencies (OCR engines, LLM SDKs) of the agents
+# it actually calls.
+SERVER_CLASSES = {
+    "com.invoice.datastore": "invoice_core_processor.servers.database_server:DataStoreAgentServer",
+    "com.invoice.ocr": "invoice_core_processor.servers.ocr_server:OCRAgentServer",
+    "com.invoice.mapper": "invoice_core_processor.servers.mapper_server:SchemaMapperAgentServer",
+    "com.invoice.validation": "invoice_core_processor.servers.agent_server:AnomalyAgentServer",
+    "com.invoice.integration": "invoice_core_processor.core.integration_agent:DataIntegrationAgentServer",
+}
 
 class MCPClient:
-    _server_registry = None
+    _server_registry = {}
+    _registry_lock = threading.Lock()
 
-    def __init__(self):
-        if MCPClient._server_registry is None:
-            print("Initializing server registry for MCPClient simulation...")
-            MCPClient._server_registry = {
-                "com.invoice.datastore": DataStoreAgentServer(),
-                "com.invoice.ocr": OCRAgentServer(),
-                "com.invoice.mapper": SchemaMapperAgentServer(),
-                "com.invoice.validation": AnomalyAgentServer(),
-                "com.invoice.integration": DataIntegrationAgentServer(),
-            }
-            print("Server registry initialized.")
+    def get_server(self, agent_id: str):
+        """Returns the in-process server for an agent, importing it on first use."""
+        server = MCPClient._server_registry.get(agent_id)
+        if server is not None or agent_id not in SERVER_CLASSES:
+            return server
+        with MCPClient._registry_lock:
+            server = MCPClient._server_registry.get(agent_id)
+            if server is None:
+                module_name, class_name = SERVER_CLASSES[agent_id].split(":")
+                server = getattr(importlib.import_module(module_name), class_name)()
+                MCPClient._server_registry[agent_id] = server
+        return server
 
     def call_tool(self, agent_id: str, tool_id: str, **kwargs):
         print(f"[MCPClient] Calling tool '{tool_id}' on agent '{agent_id}'")
-        server = self._server_registry.get(agent_id)
+        server = self.get_server(agent_id)
         if not server:
             return {"status": "ERROR", "error": f"Agent '{agent_id}' not found."}
         tool_func = server.tools.get(tool_id)
@@ -37,6 +46,31 @@ class MCPClient:
         else:
             return tool_func(**kwargs)
 
+    async def acall_tool(self, agent_id: str, tool_id: str, **kwargs):
+        """
+        Async counterpart of call_tool for use inside a running event loop.
+        Coroutine tools, and a server's `async_tools` variants where it has
+        them, are awaited on the caller's loop; blocking tools are off-loaded
+        to the default thread pool so they never stall the loop.
+        """
+        print(f"[MCPClient] Calling tool '{tool_id}' on agent '{agent_id}' (async)")
+        server = MCPClient._server_registry.get(agent_id)
+        if server is None:
+            # The first call imports the server; keep that off the event loop.
+            server = await asyncio.to_thread(self.get_server, agent_id)
+        if not server:
+            return {"status": "ERROR", "error": f"Agent '{agent_id}' not found."}
+        tool_func = server.tools.get(tool_id)
+        if not tool_func:
+            return {"status": "ERROR", "error": f"Tool '{tool_id}' not found."}
+
+        async_func = getattr(server, "async_tools", {}).get(tool_id)
+        if async_func is not None:
+            return await async_func(**kwargs)
+        if asyncio.iscoroutinefunction(tool_func):
+            return await tool_func(**kwargs)
+        return await asyncio.to_thread(tool_func, **kwargs)
+
 class IngestionGrpcClient:
     """
     Simulated gRPC client that now uses the factory to get the service instance.
@@ -44,6 +78,7 @@ class IngestionGrpcClient:
     def __init__(self):
         # The client no longer instantiates the service directly.
         # It will get it from the factory when needed.
+        from invoice_core_processor.microservices.ingestion.main import get_ingestion_service
         self.service_factory = get_ingestion_service
 
     async def ingest_file(self, user_id: str, file_path: str):
@@ -0,0 +1,117 @@
+# core/routing.py
+
+# Policies for choosing between several agents that provide the same
+# capability. The AgentRegistryService hands a policy the live providers for
+# a capability and reports back when each dispatched call starts and ends.
+
+import itertools
+import random
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
+
+from invoice_core_processor.core.models import ToolDefinition
+
+_NEVER = datetime.min.replace(tzinfo=timezone.utc)
+
+class Provider(NamedTuple):
+    agent_id: str
+    tool: ToolDefinition
+    last_heartbeat: Optional[datetime]
+
+
+class RoutingPolicy(ABC):
+    """
+    Base class for provider selection. Tracks in-flight calls and an
+    exponentially weighted moving average of call latency per agent, which
+    subclasses may use when choosing.
+    """
+
+    # Weight given to the newest latency sample in the moving average.
+    LATENCY_SMOOTHING = 0.2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self._latency: Dict[str, float] = {}
+
+    @abstractmethod
+    def choose(self, capability: str, providers: List[Provider]) -> Provider:
+        ...
+
+    def on_start(self, agent_id: str):
+        with self._lock:
+            self._in_flight[agent_id] += 1
+
+    def on_finish(self, agent_id: str, elapsed_seconds: float):
+        with self._lock:
+            self._in_flight[agent_id] = max(0, self._in_flight[agent_id] - 1)
+            previous = self._latency.get(agent_id)
+            if previous is None:
+                self._latency[agent_id] = elapsed_seconds
+            else:
+                self._latency[agent_id] = previous + self.LATENCY_SMOOTHING * (elapsed_seconds - previous)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            agents = set(self._in_flight) | set(self._latency)
+            return {
+                agent_id: {"in_flight": self._in_flight.get(agent_id, 0), "latency_ewma_s": self._latency.get(agent_id)}
+                for agent_id in agents
+            }
+
+
+class RoundRobinPolicy(RoutingPolicy):
+    """Cycles through providers in a stable order, independently per capability."""
+
+    def __init__(self):
+        super().__init__()
+        self._counters: Dict[str, itertools.count] = defaultdict(itertools.count)
+
+    def choose(self, capability: str, providers: List[Provider]) -> Provider:
+        with self._lock:
+            turn = next(self._counters[capability])
+        return providers[turn % len(providers)]
+
+
+class LeastInFlightPolicy(RoutingPolicy):
+    """Picks the provider with the fewest calls currently in progress."""
+
+    def choose(self, capability: str, providers: List[Provider]) -> Provider:
+        with self._lock:
+            fewest = min(self._in_flight.get(p.agent_id, 0) for p in providers)
+            candidates = [p for p in providers if self._in_flight.get(p.agent_id, 0) == fewest]
+        # Among equally loaded providers, prefer the one seen alive most recently.
+        return max(candidates, key=lambda p: p.last_heartbeat or _NEVER)
+
+
+class LatencyWeightedPolicy(RoutingPolicy):
+    """
+    Chooses randomly, weighting each provider by the inverse of its observed
+    latency. Providers with no samples yet are given the median latency so
+    they still receive traffic and get measured.
+    """
+
+    def choose(self, capability: str, providers: List[Provider]) -> Provider:
+        with self._lock:
+            known = sorted(self._latency[p.agent_id] for p in providers if p.agent_id in self._latency)
+            default = known[len(known) // 2] if known else 1.0
+            latencies = [self._latency.get(p.agent_id, default) for p in providers]
+        weights = [1.0 / max(latency, 1e-3) for latency in latencies]
+        return random.choices(providers, weights=weights, k=1)[0]
+
+
+ROUTING_POLICIES = {
+    "round_robin": RoundRobinPolicy,
+    "least_in_flight": LeastInFlightPolicy,
+    "latency_weighted": LatencyWeightedPolicy,
+}
+
+def get_routing_policy(name: str) -> RoutingPolicy:
+    """Instantiates a policy by its ROUTING_POLICIES name."""
+    try:
+        return ROUTING_POLICIES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown routing policy '{name}'. Expected one of: {', '.join(ROUTING_POLICIES)}")
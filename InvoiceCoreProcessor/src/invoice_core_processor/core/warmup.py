@@ -0,0 +1,72 @@
+# core/warmup.py
+
+# Heavy dependencies (OCR engines, LLM SDKs, the MCP servers that use them)
+# are imported on first use so processes boot quickly. This module loads them
+# ahead of time, optionally in the background, so the first invoice does not
+# pay for it either.
+
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from invoice_core_processor.config.settings import get_settings
+
+def _warm_workflow():
+    from invoice_core_processor.core.workflow import get_async_workflow_graph
+    get_async_workflow_graph()
+
+def _warm_servers():
+    from invoice_core_processor.core.mcp_clients import MCPClient, SERVER_CLASSES
+    client = MCPClient()
+    for agent_id in SERVER_CLASSES:
+        client.get_server(agent_id)
+
+def _warm_ocr():
+    import pdfplumber  # noqa: F401
+    from invoice_core_processor.services.image_preprocessing import preprocess  # noqa: F401
+    from invoice_core_processor.services.ocr_executor import warm_up_ocr_engines
+    warm_up_ocr_engines()
+
+def _warm_mapping():
+    from invoice_core_processor.services.mapping import get_openai_client
+    get_openai_client()
+
+def _warm_summary():
+    from invoice_core_processor.services.summary_agent_service import get_summary_agent_service
+    get_summary_agent_service()
+
+WARMUP_STEPS = {
+    "workflow": _warm_workflow,
+    "servers": _warm_servers,
+    "ocr": _warm_ocr,
+    "mapping": _warm_mapping,
+    "summary": _warm_summary,
+}
+
+def warm_up(components: Optional[Iterable[str]] = None) -> Dict[str, str]:
+    """
+    Loads the given components (default: WARMUP_COMPONENTS) and returns how long
+    each took, or the error it raised. Failures are reported, never raised.
+    """
+    if components is None:
+        components = [c.strip() for c in get_settings().WARMUP_COMPONENTS.split(",") if c.strip()]
+    report = {}
+    for name in components:
+        step = WARMUP_STEPS.get(name)
+        if step is None:
+            report[name] = "unknown component"
+            continue
+        started = time.monotonic()
+        try:
+            step()
+            report[name] = f"{time.monotonic() - started:.2f}s"
+        except Exception as e:
+            report[name] = f"failed: {e}"
+    print(f"Warm-up complete: {report}")
+    return report
+
+def start_background_warmup(components: Optional[Iterable[str]] = None) -> threading.Thread:
+    """Runs warm_up on a daemon thread so it never delays startup."""
+    thread = threading.Thread(target=warm_up, args=(components,), name="warmup", daemon=True)
+    thread.start()
+    return thread
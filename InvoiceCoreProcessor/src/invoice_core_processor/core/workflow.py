@@ -1,5 +1,7 @@
-from langgraph.graph import StateGraph, END
-from typing import Dict, Any
+# Only the END marker is needed at import time; the graph builder (and the
+# LangChain stack behind it) is loaded when a graph is first compiled.
+from langgraph.constants import END
+from typing import Dict, Any, Callable, List
 import os
 import asyncio
 from functools import lru_cache
@@ -7,6 +9,8 @@ from functools import lru_cache
 from invoice_core_processor.core.models import InvoiceGraphState
 from invoice_core_processor.core.agent_registry import AgentRegistryService
 from invoice_core_processor.core.mcp_clients import MCPClient, IngestionGrpcClient
+# Pages are joined with form feeds so mapping can tell repeated page headers/footers apart.
+from invoice_core_processor.services.text_compaction import PAGE_SEPARATOR
 
 # --- Client Factories ---
 
@@ -22,8 +26,23 @@ def get_ingestion_client() -> IngestionGrpcClient:
 def get_agent_registry() -> AgentRegistryService:
     return AgentRegistryService()
 
+def create_initial_state(user_id: str, file_path: str, target_system: str) -> InvoiceGraphState:
+    """Returns a fresh graph state for a single invoice."""
+    return {
+        "user_id": user_id, "file_path": file_path, "target_system": target_system,
+        "status": "UPLOADED", "invoice_id": None, "extracted_text": None,
+        "mapped_schema": None, "validation_flags": [], "validation_results": [],
+        "reliability_score": None, "anomaly_details": [], "integration_payload_preview": None,
+        "integration_status": None, "current_step": "start", "history": [], "summary": None
+    }
+
 # --- Graph Nodes ---
 
+def _no_route(capability: str, update: Dict[str, Any]) -> Dict[str, Any]:
+    """State update for a node whose capability has no registered provider."""
+    print(f"No agent provides {capability}; marking the invoice {update['status']}.")
+    return update
+
 def ingestion_step(state: InvoiceGraphState) -> Dict[str, Any]:
     # ... (logic remains the same) ...
     ingestion_client = get_ingestion_client()
@@ -35,17 +54,25 @@ def ingestion_step(state: InvoiceGraphState) -> Dict[str, Any]:
 
 def ocr_step(state: InvoiceGraphState) -> Dict[str, Any]:
     # ... (logic remains the same) ...
-    agent_id, tool = get_agent_registry().lookup_agent_by_capability("CAPABILITY_OCR")
-    result = get_mcp_client().call_tool(agent_id, tool.tool_id, invoice_id=state['invoice_id'], file_path=state['file_path'], file_extension=os.path.splitext(state['file_path'])[1], user_id=state['user_id'])
+    route = get_agent_registry().lookup_agent_by_capability("CAPABILITY_OCR")
+    if route is None:
+        return _no_route("CAPABILITY_OCR", {"status": "FAILED_OCR"})
+    agent_id, tool = route
+    with get_agent_registry().dispatch(agent_id):
+        result = get_mcp_client().call_tool(agent_id, tool.tool_id, invoice_id=state['invoice_id'], file_path=state['file_path'], file_extension=os.path.splitext(state['file_path'])[1], user_id=state['user_id'])
     if result['status'] == 'FAILED_OCR':
         return {"status": "FAILED_OCR"}
     get_mcp_client().call_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=state['invoice_id'], from_status="UPLOADED", to_status="OCR_DONE", meta={})
-    return {'extracted_text': " ".join([p['text'] for p in result['pages']]), 'status': 'OCR_DONE', 'ocr_confidence': result['avg_confidence']}
+    return {'extracted_text': PAGE_SEPARATOR.join([p['text'] for p in result['pages']]), 'status': 'OCR_DONE', 'ocr_confidence': result['avg_confidence']}
 
 def mapping_step(state: InvoiceGraphState) -> Dict[str, Any]:
     # ... (logic remains the same) ...
-    agent_id, tool = get_agent_registry().lookup_agent_by_capability("CAPABILITY_MAPPING")
-    result = get_mcp_client().call_tool(agent_id, tool.tool_id, extracted_text=state['extracted_text'], target_system=state['target_system'])
+    route = get_agent_registry().lookup_agent_by_capability("CAPABILITY_MAPPING")
+    if route is None:
+        return _no_route("CAPABILITY_MAPPING", {"status": "FAILED_MAPPING"})
+    agent_id, tool = route
+    with get_agent_registry().dispatch(agent_id):
+        result = get_mcp_client().call_tool(agent_id, tool.tool_id, extracted_text=state['extracted_text'], target_system=state['target_system'])
     if result['status'] == 'FAILED_MAPPING':
         return {"status": "FAILED_MAPPING"}
     get_mcp_client().call_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=state['invoice_id'], from_status="OCR_DONE", to_status="MAPPED", meta={})
@@ -53,9 +80,16 @@ def mapping_step(state: InvoiceGraphState) -> Dict[str, Any]:
 
 def validation_step(state: InvoiceGraphState) -> Dict[str, Any]:
     # ... (logic remains the same) ...
-    agent_id, tool = get_agent_registry().lookup_agent_by_capability("CAPABILITY_VALIDATION")
-    result = get_mcp_client().call_tool(agent_id, tool.tool_id, mapped_schema=state['mapped_schema'], invoice_id=state['invoice_id'], ocr_confidence=state.get('ocr_confidence', 1.0))
+    route = get_agent_registry().lookup_agent_by_capability("CAPABILITY_VALIDATION")
+    if route is None:
+        return _no_route("CAPABILITY_VALIDATION", {"status": "FAILED_VALIDATION"})
+    agent_id, tool = route
+    with get_agent_registry().dispatch(agent_id):
+        result = get_mcp_client().call_tool(agent_id, tool.tool_id, mapped_schema=state['mapped_schema'], invoice_id=state['invoice_id'], ocr_confidence=state.get('ocr_confidence', 1.0))
     get_mcp_client().call_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=state['invoice_id'], from_status="MAPPED", to_status=result['status'], meta={})
+    return _validation_update(result)
+
+def _validation_update(result: Dict[str, Any]) -> Dict[str, Any]:
     return {
         'status': result['status'],
         'reliability_score': result['overall_score'],
@@ -65,8 +99,12 @@ def validation_step(state: InvoiceGraphState) -> Dict[str, Any]:
 
 def integration_step(state: InvoiceGraphState) -> Dict[str, Any]:
     # ... (logic remains the same) ...
-    agent_id, tool = get_agent_registry().lookup_agent_by_capability("CAPABILITY_INTEGRATION")
-    result = get_mcp_client().call_tool(agent_id, tool.tool_id, invoice_id=state['invoice_id'], target_system=state['target_system'], mapped_schema=state['mapped_schema'], reliability_score=state['reliability_score'])
+    route = get_agent_registry().lookup_agent_by_capability("CAPABILITY_INTEGRATION")
+    if route is None:
+        return _no_route("CAPABILITY_INTEGRATION", {"status": "FAILED_SYNC", "integration_status": "FAILED_SYNC"})
+    agent_id, tool = route
+    with get_agent_registry().dispatch(agent_id):
+        result = get_mcp_client().call_tool(agent_id, tool.tool_id, invoice_id=state['invoice_id'], target_system=state['target_system'], mapped_schema=state['mapped_schema'], reliability_score=state['reliability_score'])
     integration_status = result.get('status', 'FAILED_SYNC')
     get_mcp_client().call_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=state['invoice_id'], from_status="VALIDATED", to_status=integration_status, meta={})
     return {'status': integration_status, 'integration_status': integration_status}
@@ -85,10 +123,20 @@ def summary_step(state: InvoiceGraphState) -> Dict[str, Any]:
     """
     Generates a summary of the invoice processing workflow.
     """
-    agent_id, tool = get_agent_registry().lookup_agent_by_capability("CAPABILITY_SUMMARY")
+    route = get_agent_registry().lookup_agent_by_capability("CAPABILITY_SUMMARY")
+    if route is None:
+        return _no_route("CAPABILITY_SUMMARY", {"status": "FAILED_SUMMARY"})
+    agent_id, tool = route
+    invoice_data = _build_summary_payload(state)
+    with get_agent_registry().dispatch(agent_id):
+        result = get_mcp_client().call_tool(agent_id, tool.tool_id, invoice_data=invoice_data)
+    get_mcp_client().call_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=state['invoice_id'], from_status=state['status'], to_status="SUMMARY_GENERATED", meta={})
+    return {"summary": result, "status": "SUMMARY_GENERATED"}
+
+def _build_summary_payload(state: InvoiceGraphState) -> Dict[str, Any]:
     # We need to construct the invoice_data object from the current state
     validation_status = get_validation_status(state.get("validation_results", []))
-    invoice_data = {
+    return {
         "invoice": state.get("mapped_schema", {}),
         "validation": {
             "status": validation_status,
@@ -103,9 +151,6 @@ def summary_step(state: InvoiceGraphState) -> Dict[str, Any]:
             "required": "FLAGGED" in state.get("status", "")
         }
     }
-    result = get_mcp_client().call_tool(agent_id, tool.tool_id, invoice_data=invoice_data)
-    get_mcp_client().call_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=state['invoice_id'], from_status=state['status'], to_status="SUMMARY_GENERATED", meta={})
-    return {"summary": result, "status": "SUMMARY_GENERATED"}
 
 def decide_next_step(state: InvoiceGraphState) -> str:
     # ... (logic remains the same) ...
@@ -125,16 +170,121 @@ def error_handler_node(state: InvoiceGraphState):
     # ... (logic remains the same) ...
     return state
 
-def build_workflow_graph():
-    # ... (logic remains the same) ...
+# --- Async Graph Nodes ---
+# Coroutine versions of the nodes above. They await the ingestion client and
+# coroutine MCP tools on the caller's event loop instead of spinning up a new
+# loop per call, so many invoices can be in flight on a single worker.
+
+async def _lookup_agent(capability: str):
+    registry = get_agent_registry()
+    route = registry.get_cached_route(capability)
+    if route is not None:
+        return route
+    # A cache miss goes to psycopg2, so keep it off the loop.
+    return await asyncio.to_thread(registry.lookup_agent_by_capability, capability)
+
+async def ingestion_step_async(state: InvoiceGraphState) -> Dict[str, Any]:
+    result = await get_ingestion_client().ingest_file(state['user_id'], state['file_path'])
+    if result.get('status') != 'SUCCESS':
+        return {"status": "FAILED_INGESTION"}
+    await get_mcp_client().acall_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=result['invoice_id'], from_status="START", to_status="UPLOADED", meta={})
+    return {'invoice_id': result['invoice_id'], 'file_path': result['storage_path'], 'status': 'UPLOADED'}
+
+async def ocr_step_async(state: InvoiceGraphState) -> Dict[str, Any]:
+    route = await _lookup_agent("CAPABILITY_OCR")
+    if route is None:
+        return _no_route("CAPABILITY_OCR", {"status": "FAILED_OCR"})
+    agent_id, tool = route
+    with get_agent_registry().dispatch(agent_id):
+        result = await get_mcp_client().acall_tool(agent_id, tool.tool_id, invoice_id=state['invoice_id'], file_path=state['file_path'], file_extension=os.path.splitext(state['file_path'])[1], user_id=state['user_id'])
+    if result['status'] == 'FAILED_OCR':
+        return {"status": "FAILED_OCR"}
+    await get_mcp_client().acall_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=state['invoice_id'], from_status="UPLOADED", to_status="OCR_DONE", meta={})
+    return {'extracted_text': PAGE_SEPARATOR.join([p['text'] for p in result['pages']]), 'status': 'OCR_DONE', 'ocr_confidence': result['avg_confidence']}
+
+async def mapping_step_async(state: InvoiceGraphState) -> Dict[str, Any]:
+    route = await _lookup_agent("CAPABILITY_MAPPING")
+    if route is None:
+        return _no_route("CAPABILITY_MAPPING", {"status": "FAILED_MAPPING"})
+    agent_id, tool = route
+    with get_agent_registry().dispatch(agent_id):
+        result = await get_mcp_client().acall_tool(agent_id, tool.tool_id, extracted_text=state['extracted_text'], target_system=state['target_system'])
+    if result['status'] == 'FAILED_MAPPING':
+        return {"status": "FAILED_MAPPING"}
+    await get_mcp_client().acall_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=state['invoice_id'], from_status="OCR_DONE", to_status="MAPPED", meta={})
+    return {'mapped_schema': result['mapped_schema'], 'status': 'MAPPED'}
+
+async def mapping_batch_step_async(states: List[InvoiceGraphState]) -> List[Dict[str, Any]]:
+    """
+    Maps several invoices in one tool call (see BatchProcessor), returning one
+    state update per input, in order. Falls back to per-invoice mapping if no
+    agent offers batched mapping.
+    """
+    route = await _lookup_agent("CAPABILITY_MAPPING_BATCH")
+    if route is None:
+        return list(await asyncio.gather(*(mapping_step_async(state) for state in states)))
+
+    agent_id, tool = route
+    results = {}
+    by_target: Dict[str, List[InvoiceGraphState]] = {}
+    for state in states:
+        by_target.setdefault(state['target_system'], []).append(state)
+    with get_agent_registry().dispatch(agent_id):
+        for target_system, group in by_target.items():
+            invoices = [{"invoice_id": state['invoice_id'], "extracted_text": state['extracted_text']} for state in group]
+            response = await get_mcp_client().acall_tool(agent_id, tool.tool_id, invoices=invoices, target_system=target_system)
+            results.update(response.get('results', {}))
+
+    async def update(state: InvoiceGraphState) -> Dict[str, Any]:
+        result = results.get(state['invoice_id'], {"status": "FAILED_MAPPING"})
+        if result['status'] == 'FAILED_MAPPING':
+            return {"status": "FAILED_MAPPING"}
+        await get_mcp_client().acall_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=state['invoice_id'], from_status="OCR_DONE", to_status="MAPPED", meta={})
+        return {'mapped_schema': result['mapped_schema'], 'status': 'MAPPED'}
+
+    return list(await asyncio.gather(*(update(state) for state in states)))
+
+async def validation_step_async(state: InvoiceGraphState) -> Dict[str, Any]:
+    route = await _lookup_agent("CAPABILITY_VALIDATION")
+    if route is None:
+        return _no_route("CAPABILITY_VALIDATION", {"status": "FAILED_VALIDATION"})
+    agent_id, tool = route
+    with get_agent_registry().dispatch(agent_id):
+        result = await get_mcp_client().acall_tool(agent_id, tool.tool_id, mapped_schema=state['mapped_schema'], invoice_id=state['invoice_id'], ocr_confidence=state.get('ocr_confidence', 1.0))
+    await get_mcp_client().acall_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=state['invoice_id'], from_status="MAPPED", to_status=result['status'], meta={})
+    return _validation_update(result)
+
+async def integration_step_async(state: InvoiceGraphState) -> Dict[str, Any]:
+    route = await _lookup_agent("CAPABILITY_INTEGRATION")
+    if route is None:
+        return _no_route("CAPABILITY_INTEGRATION", {"status": "FAILED_SYNC", "integration_status": "FAILED_SYNC"})
+    agent_id, tool = route
+    with get_agent_registry().dispatch(agent_id):
+        result = await get_mcp_client().acall_tool(agent_id, tool.tool_id, invoice_id=state['invoice_id'], target_system=state['target_system'], mapped_schema=state['mapped_schema'], reliability_score=state['reliability_score'])
+    integration_status = result.get('status', 'FAILED_SYNC')
+    await get_mcp_client().acall_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=state['invoice_id'], from_status="VALIDATED", to_status=integration_status, meta={})
+    return {'status': integration_status, 'integration_status': integration_status}
+
+async def summary_step_async(state: InvoiceGraphState) -> Dict[str, Any]:
+    route = await _lookup_agent("CAPABILITY_SUMMARY")
+    if route is None:
+        return _no_route("CAPABILITY_SUMMARY", {"status": "FAILED_SUMMARY"})
+    agent_id, tool = route
+    with get_agent_registry().dispatch(agent_id):
+        result = await get_mcp_client().acall_tool(agent_id, tool.tool_id, invoice_data=_build_summary_payload(state))
+    await get_mcp_client().acall_tool("com.invoice.datastore", "postgres/save_audit_step", invoice_id=state['invoice_id'], from_status=state['status'], to_status="SUMMARY_GENERATED", meta={})
+    return {"summary": result, "status": "SUMMARY_GENERATED"}
+
+async def error_handler_node_async(state: InvoiceGraphState):
+    return state
+
+# --- Graph Construction ---
+
+def _compile_graph(nodes: Dict[str, Callable]):
+    from langgraph.graph import StateGraph
     workflow = StateGraph(InvoiceGraphState)
-    workflow.add_node("ingestion", ingestion_step)
-    workflow.add_node("ocr", ocr_step)
-    workflow.add_node("mapping", mapping_step)
-    workflow.add_node("validation", validation_step)
-    workflow.add_node("integration", integration_step)
-    workflow.add_node("summary", summary_step)
-    workflow.add_node("error_handler", error_handler_node)
+    for name, node in nodes.items():
+        workflow.add_node(name, node)
 
     workflow.set_entry_point("ingestion")
 
@@ -148,3 +298,34 @@ def build_workflow_graph():
     workflow.add_edge("error_handler", END)
 
     return workflow.compile()
+
+def build_workflow_graph():
+    return _compile_graph({
+        "ingestion": ingestion_step,
+        "ocr": ocr_step,
+        "mapping": mapping_step,
+        "validation": validation_step,
+        "integration": integration_step,
+        "summary": summary_step,
+        "error_handler": error_handler_node,
+    })
+
+def build_async_workflow_graph():
+    """
+    Builds the same graph as build_workflow_graph, but with coroutine nodes.
+    Run it with `await graph.ainvoke(state)` from inside an event loop.
+    """
+    return _compile_graph({
+        "ingestion": ingestion_step_async,
+        "ocr": ocr_step_async,
+        "mapping": mapping_step_async,
+        "validation": validation_step_async,
+        "integration": integration_step_async,
+        "summary": summary_step_async,
+        "error_handler": error_handler_node_async,
+    })
+
+@lru_cache()
+def get_async_workflow_graph():
+    """The process-wide compiled async graph, built on first use."""
+    return build_async_workflow_graph()
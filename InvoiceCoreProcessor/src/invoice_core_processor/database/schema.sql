@@ -73,6 +73,31 @@ CREATE TABLE invoices (
     UNIQUE (vendor_id, invoice_no, invoice_date)
 );
 
+-- Duplicate detection (services/duplicate_detection.py) looks invoices up by
+-- normalised vendor GSTIN or name, invoice number and date, and finds
+-- near-duplicates by vendor, date window and amount.
+CREATE INDEX idx_vendors_gstin_norm ON vendors (upper(btrim(gstin)));
+CREATE INDEX idx_vendors_name_norm ON vendors (lower(regexp_replace(btrim(name), '\s+', ' ', 'g')));
+CREATE INDEX idx_invoices_vendor_no_date_norm
+    ON invoices (vendor_id, upper(regexp_replace(invoice_no, '[^A-Za-z0-9]', '', 'g')), invoice_date);
+CREATE INDEX idx_invoices_vendor_date_amount ON invoices (vendor_id, invoice_date, total_amount);
+
+-- Publishes the key of every stored invoice so each replica can add it to its duplicate filter.
+CREATE FUNCTION notify_invoice_key_added() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('invoice_keys_added', json_build_object(
+        'gstin', v.gstin, 'name', v.name, 'invoice_no', NEW.invoice_no, 'invoice_date', NEW.invoice_date
+    )::text)
+    FROM vendors v
+    WHERE v.id = NEW.vendor_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER invoice_key_added
+    AFTER INSERT OR UPDATE OF vendor_id, invoice_no, invoice_date ON invoices
+    FOR EACH ROW EXECUTE FUNCTION notify_invoice_key_added();
+
 -- Invoice line items
 CREATE TABLE invoice_items (
     id              UUID PRIMARY KEY,
@@ -97,6 +122,18 @@ CREATE TABLE validation_rule (
     is_active BOOLEAN NOT NULL DEFAULT TRUE
 );
 
+-- Tells every replica to reload its compiled validation plan (services/validation_rules.py).
+CREATE FUNCTION notify_validation_rules_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('validation_rules_changed', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER validation_rule_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON validation_rule
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_validation_rules_changed();
+
 CREATE TABLE invoice_validation_run (
     id UUID PRIMARY KEY,
     invoice_id UUID NOT NULL REFERENCES invoices(id) ON DELETE CASCADE,
@@ -116,6 +153,15 @@ CREATE TABLE invoice_validation_result (
     deduction_points NUMERIC(5,2) NOT NULL DEFAULT 0
 );
 
+-- LLM mapping response cache (MAPPING_CACHE_BACKEND=postgres)
+CREATE TABLE llm_mapping_cache (
+    cache_key   TEXT PRIMARY KEY,
+    response    JSONB NOT NULL,
+    created_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    accessed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX idx_llm_mapping_cache_accessed_at ON llm_mapping_cache (accessed_at);
+
 -- Workflow audit table (no changes)
 CREATE TABLE workflow_audit (
     id BIGSERIAL PRIMARY KEY,
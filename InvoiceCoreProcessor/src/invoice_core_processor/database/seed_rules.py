@@ -6,7 +6,7 @@ import sys
 # Add the project root to the path to allow importing the settings
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from invoice_core_processor.config.settings import get_settings
-from invoice_core_processor.core.database import get_postgres_connection
+from invoice_core_processor.core.database import postgres_connection
 
 VALIDATION_RULES = [
     # Document Integrity
@@ -37,29 +37,25 @@ VALIDATION_RULES = [
 
 def seed_validation_rules():
     """Connects to the database and inserts the predefined validation rules."""
-    conn = None
     try:
-        conn = get_postgres_connection()
-        with conn.cursor() as cur:
-            execute_values(
-                cur,
-                """
-                INSERT INTO validation_rule (rule_id, category, description, severity, is_active)
-                VALUES %s
-                ON CONFLICT (rule_id) DO UPDATE SET
-                    category = EXCLUDED.category,
-                    description = EXCLUDED.description,
-                    severity = EXCLUDED.severity;
-                """,
-                [(rule[0], rule[1], rule[2], rule[3], True) for rule in VALIDATION_RULES]
-            )
-            conn.commit()
-            print(f"Successfully seeded {len(VALIDATION_RULES)} validation rules.")
+        with postgres_connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO validation_rule (rule_id, category, description, severity, is_active)
+                    VALUES %s
+                    ON CONFLICT (rule_id) DO UPDATE SET
+                        category = EXCLUDED.category,
+                        description = EXCLUDED.description,
+                        severity = EXCLUDED.severity;
+                    """,
+                    [(rule[0], rule[1], rule[2], rule[3], True) for rule in VALIDATION_RULES]
+                )
+                conn.commit()
+                print(f"Successfully seeded {len(VALIDATION_RULES)} validation rules.")
     except Exception as e:
-        if conn: conn.rollback()
         print(f"Failed to seed validation rules: {e}")
-    finally:
-        if conn: conn.close()
 
 if __name__ == "__main__":
     # This requires a running database and a configured .env file.
@@ -4,6 +4,7 @@ import os
 import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
 from functools import lru_cache
+from typing import Optional
 
 # ... (Mock Protobuf code remains the same) ...
 class MockIngestionRequest:
@@ -21,18 +22,24 @@ def add_IngestionServiceServicer_to_server(servicer, server):
 
 from invoice_core_processor.config.settings import get_settings
 from invoice_core_processor.services.ingestion import copy_file_to_uploads, create_ingestion_metadata
-from invoice_core_processor.core.database import get_mongo_client
+from invoice_core_processor.core.database import get_mongo_db, close_mongo_client
 
 class IngestionService(MockIngestionServiceServicer):
-    def __init__(self, db_client: AsyncIOMotorClient):
+    def __init__(self, db_client: Optional[AsyncIOMotorClient] = None):
         settings = get_settings()
-        self.db = db_client[settings.MONGO_DB_NAME]
+        # Without an explicit client, resolve the shared one on each use so the
+        # service follows the client if it is recreated for a new event loop.
+        self._db = db_client[settings.MONGO_DB_NAME] if db_client is not None else None
         project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
         self.upload_dir = os.path.join(project_root, "uploads")
         if not os.path.exists(self.upload_dir):
             os.makedirs(self.upload_dir)
         print(f"Ingestion service initialized with DB. Uploads dir: {self.upload_dir}")
 
+    @property
+    def db(self):
+        return self._db if self._db is not None else get_mongo_db()
+
     async def IngestFile(self, request, context):
         # ... (logic remains the same) ...
         try:
@@ -49,8 +56,7 @@ def get_ingestion_service() -> IngestionService:
     Factory function to create and return a cached instance of the IngestionService.
     """
     print("Creating new IngestionService instance...")
-    db_client = get_mongo_client()
-    return IngestionService(db_client)
+    return IngestionService()
 
 async def serve():
     server = grpc.aio.server(futures.ThreadPoolExecutor(max_workers=10))
@@ -59,7 +65,10 @@ async def serve():
     server.add_insecure_port('[::]:50051')
     print("gRPC Ingestion Server starting on port 50051...")
     await server.start()
-    await server.wait_for_termination()
+    try:
+        await server.wait_for_termination()
+    finally:
+        close_mongo_client()
 
 if __name__ == '__main__':
     asyncio.run(serve())
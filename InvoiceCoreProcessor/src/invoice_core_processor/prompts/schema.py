@@ -1,5 +1,8 @@
 """Extraction prompts for schema mapping"""
 
+# Bump whenever EXTRACTION_SCHEMA_PROMPT changes, so cached mappings are not reused.
+EXTRACTION_SCHEMA_PROMPT_VERSION = "1"
+
 EXTRACTION_SCHEMA_PROMPT = """
 
 You are an expert schema mapping agent specializing in invoices.
@@ -47,3 +50,14 @@ The JSON schema should be:
 Return ONLY the raw JSON object. Do not include any explanatory text, markdown formatting, or anything else.
 
 """
+
+# Appended to EXTRACTION_SCHEMA_PROMPT when several invoices share one request.
+BATCH_EXTRACTION_INSTRUCTIONS = """
+You will now receive several unrelated invoices. Each one starts with a line of the form
+"### INVOICE <ref>". Extract every invoice independently, using only its own text, into the
+schema above, and return a single JSON object of this form:
+
+{"invoices": [{"ref": "<ref>", "data": { ...schema for that invoice... }}]}
+
+Return exactly one entry per invoice ref.
+"""
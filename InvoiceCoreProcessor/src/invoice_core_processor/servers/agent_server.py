@@ -1,5 +1,6 @@
 from invoice_core_processor.core.models import AgentCard, ToolDefinition
-from invoice_core_processor.services.validation import run_validation_checks
+from invoice_core_processor.services.validation import revalidate, run_validation_checks
+from invoice_core_processor.services.batch_validation import run_validation_checks_batch
 from invoice_core_processor.core.agent_registry import AgentRegistryService
 import json
 
@@ -7,6 +8,8 @@ import json
 
 AGENT_ID = "com.invoice.validation"
 CAPABILITY_VALIDATION = "CAPABILITY_VALIDATION"
+CAPABILITY_VALIDATION_BATCH = "CAPABILITY_VALIDATION_BATCH"
+CAPABILITY_REVALIDATION = "CAPABILITY_REVALIDATION"
 
 ANOMALY_AGENT_CARD = AgentCard(
     agent_id=AGENT_ID,
@@ -21,6 +24,28 @@ ANOMALY_AGENT_CARD = AgentCard(
                 "invoice_id": {"type": "str", "optional": True},
                 "ocr_confidence": {"type": "float", "optional": True, "default": 1.0}
             }
+        ),
+        ToolDefinition(
+            tool_id="validate/run_checks_batch",
+            capability=CAPABILITY_VALIDATION_BATCH,
+            description="Validates many mapped invoices at once with vectorised rules; returns one result per invoice, in order.",
+            parameters={
+                "mapped_schemas": {"type": "list"},
+                "ocr_confidences": {"type": "list", "optional": True},
+                "invoice_ids": {"type": "list", "optional": True}
+            }
+        ),
+        ToolDefinition(
+            tool_id="validate/revalidate",
+            capability=CAPABILITY_REVALIDATION,
+            description="Re-validates an edited invoice, rerunning only the rules that read the changed fields.",
+            parameters={
+                "mapped_schema": {"type": "dict"},
+                "changes": {"type": "dict"},
+                "validation_results": {"type": "list"},
+                "ocr_confidence": {"type": "float", "optional": True, "default": 1.0},
+                "invoice_id": {"type": "str", "optional": True}
+            }
         )
     ]
 )
@@ -32,16 +57,31 @@ def run_checks(mapped_schema: dict, invoice_id: str, ocr_confidence: float) -> d
     MCP tool wrapper for the run_validation_checks service.
     """
     print(f"AnomalyAgent: Received request to validate invoice {invoice_id}.")
-    result = run_validation_checks(mapped_schema, ocr_confidence)
+    result = run_validation_checks(mapped_schema, ocr_confidence, invoice_id=invoice_id)
     print("AnomalyAgent: Validation complete. Would now save results to DB via DataStoreAgent.")
     return result
 
+def run_checks_batch(mapped_schemas: list, ocr_confidences: list = None, invoice_ids: list = None) -> dict:
+    """
+    MCP tool wrapper for the run_validation_checks_batch service.
+    """
+    print(f"AnomalyAgent: Received request to validate {len(mapped_schemas)} invoices.")
+    return {"status": "SUCCESS", "results": run_validation_checks_batch(mapped_schemas, ocr_confidences, invoice_ids=invoice_ids)}
+
+def revalidate_checks(mapped_schema: dict, changes: dict, validation_results: list, ocr_confidence: float = 1.0, invoice_id: str = None) -> dict:
+    """
+    MCP tool wrapper for the revalidate service.
+    """
+    return revalidate(mapped_schema, changes, validation_results, ocr_confidence, invoice_id=invoice_id)
+
 # --- MCP Server ---
 
 class AnomalyAgentServer:
     def __init__(self):
         self.tools = {
             "validate/run_checks": run_checks,
+            "validate/run_checks_batch": run_checks_batch,
+            "validate/revalidate": revalidate_checks,
         }
         print("AnomalyAgent MCP Server initialized.")
 
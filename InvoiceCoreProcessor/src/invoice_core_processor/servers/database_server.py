@@ -1,85 +1,104 @@
 import asyncio
+import io
 from psycopg2.extras import Json, execute_values
 import uuid
 import datetime
 
-from invoice_core_processor.core.database import get_postgres_connection, get_mongo_db
+from invoice_core_processor.core.database import postgres_connection, get_mongo_db
 from invoice_core_processor.core.models import AgentCard, ToolDefinition
 from invoice_core_processor.core.agent_registry import AgentRegistryService
+from invoice_core_processor.services.duplicate_detection import InvoiceKey, get_duplicate_detector
 
 # ... (Agent Definition remains the same) ...
 AGENT_ID = "com.invoice.datastore"
 DATASTORE_AGENT_CARD = AgentCard(agent_id=AGENT_ID, description="...", tools=[
-    ToolDefinition(tool_id="postgres/update_processing_time", capability="CAPABILITY_DB_WRITE", description="Updates processing timestamps.", parameters={})
+    ToolDefinition(tool_id="postgres/update_processing_time", capability="CAPABILITY_DB_WRITE", description="Updates processing timestamps.", parameters={}),
+    ToolDefinition(tool_id="postgres/check_duplicate", capability="CAPABILITY_DUPLICATE_CHECK", description="Checks whether an invoice is already stored.", parameters={}),
+    ToolDefinition(tool_id="postgres/find_near_duplicates", capability="CAPABILITY_NEAR_DUPLICATE_CHECK", description="Finds stored invoices of the same vendor with a similar date and amount.", parameters={}),
 ])
 
 
+def _subtotal(data: dict):
+    """The invoice subtotal, or the sum of its line items when the mapping left it out."""
+    subtotal = data["totals"].get("subtotal")
+    if subtotal is None:
+        subtotal = sum(item["amount"] for item in data["lineItems"])
+    return subtotal
+
 def save_validated_record(data: dict):
-    conn = get_postgres_connection()
-    with conn.cursor() as cur:
-
-        # 1. UPSERT VENDOR
-        vendor_query = """
-            INSERT INTO vendors (name, gstin)
-            VALUES (%s, %s)
-            ON CONFLICT (name, gstin)
-            DO UPDATE SET name = EXCLUDED.name
-            RETURNING id;
-        """
-        cur.execute(
-            vendor_query,
-            (data["vendor"]["name"], data["vendor"]["gstin"])
-        )
-        vendor_id = cur.fetchone()[0]
-
-        # 2. UPSERT INVOICE
-        invoice_query = """
-            INSERT INTO invoices (vendor_id, invoice_no, invoice_date, total_amount, user_id)
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (vendor_id, invoice_no, invoice_date)
-            DO UPDATE SET total_amount = EXCLUDED.total_amount
-            RETURNING id;
-        """
-        cur.execute(
-            invoice_query,
-            (
-                vendor_id,
-                data["invoiceNumber"],
-                data["invoiceDate"],
-                data["totals"]["grandTotal"],
-                data["user_id"]
-            )
-        )
-        invoice_id = cur.fetchone()[0]
-
-        # 3. DELETE EXISTING LINE ITEMS
-        delete_query = "DELETE FROM invoice_items WHERE invoice_id = %s;"
-        cur.execute(delete_query, (invoice_id,))
-
-        # 4. INSERT NEW LINE ITEMS
-        line_items = [
-            (
-                invoice_id,
-                item["description"],
-                item["quantity"],
-                item["unitPrice"],
-                item["taxPercent"],
-                item["amount"]
+    with postgres_connection() as conn:
+        with conn.cursor() as cur:
+
+            # 1. UPSERT VENDOR
+            vendor_query = """
+                INSERT INTO vendors (id, name, gstin)
+                VALUES (gen_random_uuid(), %s, %s)
+                ON CONFLICT (name, gstin)
+                DO UPDATE SET name = EXCLUDED.name
+                RETURNING id;
+            """
+            cur.execute(
+                vendor_query,
+                (data["vendor"]["name"], data["vendor"]["gstin"])
             )
-            for item in data["lineItems"]
-        ]
+            vendor_id = cur.fetchone()[0]
 
-        execute_values(
-            cur,
+            # 2. UPSERT INVOICE
+            invoice_query = """
+                INSERT INTO invoices (id, vendor_id, invoice_no, invoice_date, subtotal, grand_total, total_amount, user_id)
+                VALUES (gen_random_uuid(), %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (vendor_id, invoice_no, invoice_date)
+                DO UPDATE SET subtotal = EXCLUDED.subtotal, grand_total = EXCLUDED.grand_total, total_amount = EXCLUDED.total_amount
+                RETURNING id;
             """
-            INSERT INTO invoice_items
-                (invoice_id, description, quantity, unit_price, tax_pct, amount)
-            VALUES %s;
-            """,
-            line_items
-        )
+            cur.execute(
+                invoice_query,
+                (
+                    vendor_id,
+                    data["invoiceNumber"],
+                    data["invoiceDate"],
+                    _subtotal(data),
+                    data["totals"]["grandTotal"],
+                    data["totals"]["grandTotal"],
+                    data["user_id"]
+                )
+            )
+            invoice_id = cur.fetchone()[0]
+
+            # 3. DELETE EXISTING LINE ITEMS
+            delete_query = "DELETE FROM invoice_items WHERE invoice_id = %s;"
+            cur.execute(delete_query, (invoice_id,))
+
+            # 4. INSERT NEW LINE ITEMS
+            line_items = [
+                (
+                    invoice_id,
+                    line_no,
+                    item["description"],
+                    item["quantity"],
+                    item["unitPrice"],
+                    item["taxPercent"],
+                    item["amount"]
+                )
+                for line_no, item in enumerate(data["lineItems"], start=1)
+            ]
 
-        conn.commit()
+            execute_values(
+                cur,
+                """
+                INSERT INTO invoice_items
+                    (id, invoice_id, line_no, description, quantity, unit_price, tax_pct, amount)
+                VALUES %s;
+                """,
+                line_items,
+                template="(gen_random_uuid(), %s, %s, %s, %s, %s, %s, %s)"
+            )
+
+            conn.commit()
+
+    key = InvoiceKey.create(data["vendor"]["name"], data["vendor"]["gstin"], data["invoiceNumber"], data["invoiceDate"])
+    if key is not None:
+        get_duplicate_detector().add(key)
 
     return {
         "status": "RECORD_SAVED",
@@ -87,46 +106,182 @@ def save_validated_record(data: dict):
         "vendor_id": str(vendor_id)
     }
 
-def update_processing_time(invoice_id: str) -> dict:
-    """Updates the end time and duration for a processed invoice."""
-    conn = None
-    try:
-        conn = get_postgres_connection()
+# Staging tables for save_validated_records_bulk; dropped when the batch commits.
+BULK_STAGING_DDL = """
+    CREATE TEMP TABLE staging_invoices (
+        record_index  INTEGER PRIMARY KEY,
+        vendor_name   TEXT NOT NULL,
+        vendor_gstin  TEXT,
+        invoice_no    TEXT NOT NULL,
+        invoice_date  DATE NOT NULL,
+        subtotal      NUMERIC(18, 2) NOT NULL,
+        grand_total   NUMERIC(18, 2) NOT NULL,
+        user_id       TEXT NOT NULL,
+        vendor_id     UUID,
+        invoice_id    UUID
+    ) ON COMMIT DROP;
+    CREATE TEMP TABLE staging_invoice_items (
+        record_index  INTEGER NOT NULL,
+        line_no       INTEGER NOT NULL,
+        description   TEXT,
+        quantity      NUMERIC(18, 4),
+        unit_price    NUMERIC(18, 4),
+        tax_pct       NUMERIC(5, 2),
+        amount        NUMERIC(18, 2)
+    ) ON COMMIT DROP;
+"""
+
+def _copy_text(value) -> str:
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def _copy_rows(cur, table: str, columns: tuple, rows: list):
+    """Streams rows into a table with COPY (text format)."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_text(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+def save_validated_records_bulk(records: list) -> dict:
+    """
+    Saves many validated records in one transaction: the records are COPYed
+    into temp tables, vendors and invoices are upserted set-based, and the
+    line items of every invoice are replaced in one statement. Records for
+    the same (vendor, invoice_no, invoice_date) are saved once, the last
+    one winning, as consecutive save_validated_record calls would.
+    """
+    if not records:
+        return {"status": "RECORDS_SAVED", "saved": 0, "records": []}
+
+    # The same row cannot be upserted twice in one statement, so repeats are resolved here.
+    keys = [(data["vendor"]["name"], data["vendor"]["gstin"], data["invoiceNumber"], str(data["invoiceDate"])) for data in records]
+    latest = {key: index for index, key in enumerate(keys)}
+    unique = sorted(latest.values())
+
+    invoice_rows = [
+        (
+            index,
+            records[index]["vendor"]["name"],
+            records[index]["vendor"]["gstin"],
+            records[index]["invoiceNumber"],
+            records[index]["invoiceDate"],
+            _subtotal(records[index]),
+            records[index]["totals"]["grandTotal"],
+            records[index]["user_id"],
+        )
+        for index in unique
+    ]
+    item_rows = [
+        (index, line_no, item["description"], item["quantity"], item["unitPrice"], item["taxPercent"], item["amount"])
+        for index in unique
+        for line_no, item in enumerate(records[index]["lineItems"], start=1)
+    ]
+
+    with postgres_connection() as conn:
         with conn.cursor() as cur:
+            cur.execute(BULK_STAGING_DDL)
+            _copy_rows(cur, "staging_invoices", ("record_index", "vendor_name", "vendor_gstin", "invoice_no", "invoice_date", "subtotal", "grand_total", "user_id"), invoice_rows)
+            _copy_rows(cur, "staging_invoice_items", ("record_index", "line_no", "description", "quantity", "unit_price", "tax_pct", "amount"), item_rows)
+
+            # 1. UPSERT VENDORS
             cur.execute(
                 """
-                UPDATE invoices
-                SET
-                    processing_end_time = %s,
-                    processing_duration_ms = EXTRACT(EPOCH FROM (%s - processing_start_time)) * 1000
-                WHERE id = %s;
-                """,
-                (datetime.datetime.now(datetime.UTC), datetime.datetime.now(datetime.UTC), invoice_id)
+                WITH upserted AS (
+                    INSERT INTO vendors (id, name, gstin)
+                    SELECT gen_random_uuid(), vendor_name, vendor_gstin
+                    FROM (SELECT DISTINCT vendor_name, vendor_gstin FROM staging_invoices) v
+                    ON CONFLICT (name, gstin)
+                    DO UPDATE SET name = EXCLUDED.name
+                    RETURNING id, name, gstin
+                )
+                UPDATE staging_invoices s
+                SET vendor_id = u.id
+                FROM upserted u
+                WHERE u.name = s.vendor_name AND u.gstin IS NOT DISTINCT FROM s.vendor_gstin;
+                """
             )
+
+            # 2. UPSERT INVOICES
+            cur.execute(
+                """
+                WITH upserted AS (
+                    INSERT INTO invoices (id, vendor_id, invoice_no, invoice_date, subtotal, grand_total, total_amount, user_id)
+                    SELECT gen_random_uuid(), vendor_id, invoice_no, invoice_date, subtotal, grand_total, grand_total, user_id FROM staging_invoices
+                    ON CONFLICT (vendor_id, invoice_no, invoice_date)
+                    DO UPDATE SET subtotal = EXCLUDED.subtotal, grand_total = EXCLUDED.grand_total, total_amount = EXCLUDED.total_amount
+                    RETURNING id, vendor_id, invoice_no, invoice_date
+                )
+                UPDATE staging_invoices s
+                SET invoice_id = u.id
+                FROM upserted u
+                WHERE u.vendor_id = s.vendor_id AND u.invoice_no = s.invoice_no AND u.invoice_date = s.invoice_date
+                RETURNING s.record_index, s.invoice_id, s.vendor_id;
+                """
+            )
+            saved = {record_index: (str(invoice_id), str(vendor_id)) for record_index, invoice_id, vendor_id in cur.fetchall()}
+
+            # 3. REPLACE LINE ITEMS (the DELETE and the INSERT see the same snapshot)
+            cur.execute(
+                """
+                WITH deleted AS (
+                    DELETE FROM invoice_items
+                    USING staging_invoices s
+                    WHERE invoice_items.invoice_id = s.invoice_id
+                )
+                INSERT INTO invoice_items
+                    (id, invoice_id, line_no, description, quantity, unit_price, tax_pct, amount)
+                SELECT gen_random_uuid(), s.invoice_id, i.line_no, i.description, i.quantity, i.unit_price, i.tax_pct, i.amount
+                FROM staging_invoice_items i
+                JOIN staging_invoices s ON s.record_index = i.record_index
+                ORDER BY i.record_index, i.line_no;
+                """
+            )
+
             conn.commit()
+
+    detector = get_duplicate_detector()
+    for index in unique:
+        key = InvoiceKey.create(records[index]["vendor"]["name"], records[index]["vendor"]["gstin"], records[index]["invoiceNumber"], records[index]["invoiceDate"])
+        if key is not None:
+            detector.add(key)
+
+    results = [dict(zip(("invoice_id", "vendor_id"), saved[latest[key]])) for key in keys]
+    return {"status": "RECORDS_SAVED", "saved": len(unique), "records": results}
+
+def update_processing_time(invoice_id: str) -> dict:
+    """Updates the end time and duration for a processed invoice."""
+    try:
+        with postgres_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE invoices
+                    SET
+                        processing_end_time = %s,
+                        processing_duration_ms = EXTRACT(EPOCH FROM (%s - processing_start_time)) * 1000
+                    WHERE id = %s;
+                    """,
+                    (datetime.datetime.now(datetime.UTC), datetime.datetime.now(datetime.UTC), invoice_id)
+                )
+                conn.commit()
         return {"status": "TIME_UPDATED"}
     except Exception as e:
-        if conn: conn.rollback()
         return {"status": "FAILED_TIME_UPDATE", "error": str(e)}
-    finally:
-        if conn: conn.close()
 
 # ... (other functions remain) ...
-def check_duplicate(vendor_name: str, invoice_number: str, invoice_date: str):
-    conn = get_postgres_connection()
-    with conn.cursor() as cur:
-        query = """
-            SELECT i.id
-            FROM invoices i
-            JOIN vendors v ON v.id = i.vendor_id
-            WHERE v.name = %s
-              AND i.invoice_no = %s
-              AND i.invoice_date = %s
-            LIMIT 1;
-        """
-        cur.execute(query, (vendor_name, invoice_number, invoice_date))
-        row = cur.fetchone()
-        return row is not None
+def check_duplicate(vendor_name: str, invoice_number: str, invoice_date: str, vendor_gstin: str = None):
+    """True if the invoice is already stored; the database is only queried when the duplicate filter cannot rule it out."""
+    key = InvoiceKey.create(vendor_name, vendor_gstin, invoice_number, invoice_date)
+    return key is not None and get_duplicate_detector().find_duplicate(key) is not None
+
+def find_near_duplicates(vendor_name: str, invoice_date: str, amount: float, vendor_gstin: str = None) -> dict:
+    """Stored invoices of the same vendor with a similar date and amount."""
+    matches = get_duplicate_detector().find_near_duplicates(vendor_name, vendor_gstin, invoice_date, amount)
+    return {"status": "NEAR_DUPLICATES_FOUND" if matches else "NO_NEAR_DUPLICATES", "matches": matches}
+
 def save_audit_step(invoice_id: str, from_status: str, to_status: str, meta: dict) -> dict: return {"status": "AUDIT_STEP_SAVED"}
 async def save_metadata(metadata: dict) -> dict: return {"status": "METADATA_SAVED"}
 async def log_response(log_data: dict) -> dict: return {"status": "LOG_SAVED"}
@@ -137,7 +292,10 @@ class DataStoreAgentServer:
     def __init__(self):
         self.tools = {
             "postgres/save_validated_record": save_validated_record,
+            "postgres/save_validated_records_bulk": save_validated_records_bulk,
             "postgres/update_processing_time": update_processing_time,
+            "postgres/check_duplicate": check_duplicate,
+            "postgres/find_near_duplicates": find_near_duplicates,
             # ... other tools
         }
     def run(self): pass
@@ -1,12 +1,14 @@
 from invoice_core_processor.core.models import AgentCard, ToolDefinition
-from invoice_core_processor.services.mapping import map_text_to_schema
+from invoice_core_processor.services.mapping import amap_text_to_schema, amap_texts_to_schema_batch, map_text_to_schema
 from invoice_core_processor.core.agent_registry import AgentRegistryService
+import asyncio
 import json
 
 # --- Agent Definition ---
 
 AGENT_ID = "com.invoice.mapper"
 CAPABILITY_MAPPING = "CAPABILITY_MAPPING"
+CAPABILITY_MAPPING_BATCH = "CAPABILITY_MAPPING_BATCH"
 
 MAPPER_AGENT_CARD = AgentCard(
     agent_id=AGENT_ID,
@@ -20,6 +22,15 @@ MAPPER_AGENT_CARD = AgentCard(
                 "extracted_text": {"type": "str"},
                 "target_system": {"type": "str", "enum": ["TALLY", "ZOHO", "QUICKBOOKS"]}
             }
+        ),
+        ToolDefinition(
+            tool_id="map/execute_batch",
+            capability=CAPABILITY_MAPPING_BATCH,
+            description="Maps several invoices' extracted text, packing short ones into shared LLM requests. Returns results keyed by invoice_id.",
+            parameters={
+                "invoices": {"type": "list", "items": {"invoice_id": "str", "extracted_text": "str"}},
+                "target_system": {"type": "str", "enum": ["TALLY", "ZOHO", "QUICKBOOKS"]}
+            }
         )
     ]
 )
@@ -33,12 +44,37 @@ def execute_mapping(extracted_text: str, target_system: str) -> dict:
     print(f"SchemaMapperAgent: Received request to map text for {target_system}.")
     return map_text_to_schema(extracted_text, target_system)
 
+async def execute_mapping_async(extracted_text: str, target_system: str) -> dict:
+    """
+    Async variant used by MCPClient.acall_tool, so concurrent mappings share
+    one AsyncOpenAI client and rate limiter instead of each blocking a thread.
+    """
+    print(f"SchemaMapperAgent: Received async request to map text for {target_system}.")
+    return await amap_text_to_schema(extracted_text, target_system)
+
+async def execute_mapping_batch_async(invoices: list, target_system: str) -> dict:
+    """
+    MCP tool wrapper for amap_texts_to_schema_batch.
+    """
+    print(f"SchemaMapperAgent: Received request to map {len(invoices)} invoices for {target_system}.")
+    results = await amap_texts_to_schema_batch(invoices, target_system)
+    return {"status": "MAPPING_COMPLETE", "results": results}
+
+def execute_mapping_batch(invoices: list, target_system: str) -> dict:
+    return asyncio.run(execute_mapping_batch_async(invoices, target_system))
+
 # --- MCP Server ---
 
 class SchemaMapperAgentServer:
     def __init__(self):
         self.tools = {
             "map/execute": execute_mapping,
+            "map/execute_batch": execute_mapping_batch,
+        }
+        # Preferred by MCPClient.acall_tool over running the sync tool in a thread.
+        self.async_tools = {
+            "map/execute": execute_mapping_async,
+            "map/execute_batch": execute_mapping_batch_async,
         }
         print("SchemaMapperAgent MCP Server initialized.")
 
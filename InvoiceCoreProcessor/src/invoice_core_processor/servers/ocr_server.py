@@ -1,5 +1,6 @@
 from invoice_core_processor.core.models import AgentCard, ToolDefinition
 from invoice_core_processor.services.ocr_processor import run_cascading_ocr, OCRResult
+from invoice_core_processor.services.ocr_stats import get_ocr_engine_stats
 from invoice_core_processor.core.agent_registry import AgentRegistryService
 import os
 
@@ -22,6 +23,12 @@ OCR_AGENT_CARD = AgentCard(
                 "file_extension": {"type": "str", "enum": ["pdf", "docx", "png", "jpg", "jpeg", "tiff"]},
                 "user_id": {"type": "str", "optional": True}
             }
+        ),
+        ToolDefinition(
+            tool_id="ocr/engine_stats",
+            capability="CAPABILITY_OCR_STATS",
+            description="Returns rolling per-engine OCR success rate, confidence and latency by file type and image size.",
+            parameters={}
         )
     ]
 )
@@ -46,12 +53,19 @@ def extract_text_cascading(
 
     return result.dict()
 
+def engine_stats() -> dict:
+    """
+    MCP tool exposing the statistics used to order the OCR cascade.
+    """
+    return {"status": "SUCCESS", "engines": get_ocr_engine_stats().snapshot()}
+
 # --- MCP Server ---
 
 class OCRAgentServer:
     def __init__(self):
         self.tools = {
             "ocr/extract_text_cascading": extract_text_cascading,
+            "ocr/engine_stats": engine_stats,
         }
         print("OCRAgent MCP Server initialized.")
 
@@ -1,5 +1,5 @@
 from invoice_core_processor.core.models import AgentCard, ToolDefinition
-from invoice_core_processor.services.summary_agent_service import SummaryAgentService
+from invoice_core_processor.services.summary_agent_service import get_summary_agent_service
 from invoice_core_processor.core.agent_registry import AgentRegistryService
 from typing import Dict, Any
 
@@ -30,7 +30,7 @@ def generate_summary(invoice_data: Dict[str, Any]) -> dict:
     MCP tool wrapper for the SummaryAgentService.
     """
     print(f"SummaryAgent: Received request to generate summary.")
-    service = SummaryAgentService()
+    service = get_summary_agent_service()
     return service.generate_summary(invoice_data)
 
 # --- MCP Server ---
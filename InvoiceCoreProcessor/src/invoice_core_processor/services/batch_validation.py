@@ -0,0 +1,237 @@
+# services/batch_validation.py
+
+# Columnar counterpart of services/validation.py for validating many invoices
+# at once, e.g. re-validating history after a rule change. Line items of all
+# invoices are flattened into one array (with per-invoice offsets) and totals
+# into an (N, 4) matrix, so the arithmetic rules are a handful of NumPy
+# operations instead of a Python loop per invoice, and the duplicate check is
+# one query for the whole batch.
+
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from invoice_core_processor.services.duplicate_detection import InvoiceKey, get_duplicate_detector
+from invoice_core_processor.services.validation import (
+    AMOUNT_TOLERANCE,
+    INITIAL_SCORE,
+    LOW_OCR_CONFIDENCE,
+    ValidationResult,
+    duplicate_check_result,
+    run_validation_checks,
+)
+from invoice_core_processor.services.validation_rules import CompiledRule, get_validation_rule_registry
+
+LINE_ITEM_FIELDS = ("quantity", "unitPrice", "amount")
+TOTAL_FIELDS = ("subtotal", "gstAmount", "roundOff", "grandTotal")
+
+# PASS and non-PASS results of the rules evaluated here, as the scalar rules
+# report them. The severity of a non-PASS result comes from the rule plan.
+VECTORISED_RESULTS = {
+    "LIT-004": (
+        ValidationResult("LIT-004", "PASS", "Line item math correct.", 1).to_dict(),
+        ValidationResult("LIT-004", "FAIL", "", 5, 20.0).to_dict(),  # message names the first bad item
+    ),
+    "TTL-001": (
+        ValidationResult("TTL-001", "PASS", "Subtotal is correct.", 1).to_dict(),
+        ValidationResult("TTL-001", "FAIL", "Subtotal does not match sum of line items.", 5, 20.0).to_dict(),
+    ),
+    "TTL-003": (
+        ValidationResult("TTL-003", "PASS", "Grand total is correct.", 1).to_dict(),
+        ValidationResult("TTL-003", "FAIL", "Grand total does not match sum of subtotal, GST, and round-off.", 5, 20.0).to_dict(),
+    ),
+    "ANM-004": (
+        ValidationResult("ANM-004", "PASS", "OCR confidence is acceptable.", 1).to_dict(),
+        ValidationResult("ANM-004", "WARN", "", 3, 2.5).to_dict(),  # message carries the confidence
+    ),
+}
+
+NUMERIC_TYPES = frozenset({int, float, bool})
+
+def _non_numeric_owners(values: List[Any], owners: np.ndarray) -> np.ndarray:
+    """Indices of the invoices that own any value that is not a plain number."""
+    numeric = np.fromiter((type(value) in NUMERIC_TYPES for value in values), dtype=bool, count=len(values))
+    for position in np.flatnonzero(~numeric):
+        values[position] = 0
+    return np.unique(owners[~numeric])
+
+
+class InvoiceColumns:
+    """
+    N mapped schemas in columnar form.
+
+    `items` is an (M, 3) array of (quantity, unitPrice, amount) for every line
+    item of every invoice; invoice i owns rows offsets[i]:offsets[i + 1].
+    `totals` is (N, 4) in TOTAL_FIELDS order. Invoices whose values are not
+    plain numbers are flagged in `irregular` and hold zeros.
+    """
+
+    def __init__(self, items: np.ndarray, offsets: np.ndarray, totals: np.ndarray, ocr_confidence: np.ndarray, irregular: np.ndarray):
+        self.items = items
+        self.offsets = offsets
+        self.totals = totals
+        self.ocr_confidence = ocr_confidence
+        self.irregular = irregular
+
+    def __len__(self):
+        return len(self.totals)
+
+    @classmethod
+    def from_schemas(cls, schemas: Sequence[Dict[str, Any]], ocr_confidences: Optional[Sequence[float]] = None) -> "InvoiceColumns":
+        count = len(schemas)
+        item_values: List[Any] = []
+        total_values: List[Any] = []
+        item_counts = np.zeros(count, dtype=np.int64)
+        irregular = np.zeros(count, dtype=bool)
+
+        # Values are gathered optimistically into flat lists and type-checked in one pass afterwards.
+        for i, schema in enumerate(schemas):
+            try:
+                invoice_totals = schema.get("totals", {})
+                totals = [invoice_totals.get(field, 0) for field in TOTAL_FIELDS]
+                values = [item.get(field, 0) for item in schema.get("lineItems", []) for field in LINE_ITEM_FIELDS]
+            except (AttributeError, TypeError):
+                irregular[i] = True
+                total_values.extend((0, 0, 0, 0))
+                continue
+            total_values.extend(totals)
+            item_values.extend(values)
+            item_counts[i] = len(values) // len(LINE_ITEM_FIELDS)
+
+        if not set(map(type, item_values)) <= NUMERIC_TYPES:
+            irregular[_non_numeric_owners(item_values, np.repeat(np.arange(count), item_counts * len(LINE_ITEM_FIELDS)))] = True
+        if not set(map(type, total_values)) <= NUMERIC_TYPES:
+            irregular[_non_numeric_owners(total_values, np.repeat(np.arange(count), len(TOTAL_FIELDS)))] = True
+
+        items = np.array(item_values, dtype=np.float64).reshape(-1, len(LINE_ITEM_FIELDS))
+        totals = np.array(total_values, dtype=np.float64).reshape(-1, len(TOTAL_FIELDS))
+        offsets = np.concatenate([[0], np.cumsum(item_counts)])
+        if ocr_confidences is None:
+            confidence = np.ones(count, dtype=np.float64)
+        else:
+            confidence = np.asarray(ocr_confidences, dtype=np.float64)
+        return cls(items, offsets, totals, confidence, irregular)
+
+
+def evaluate(columns: InvoiceColumns) -> Dict[str, np.ndarray]:
+    """
+    Evaluates LIT-004, TTL-001, TTL-003 and ANM-004 for every invoice at once.
+
+    Returns a boolean "did not pass" array per rule_id, plus `first_bad_item`
+    (index of the first line item with wrong math, -1 if none). Irregular
+    invoices are included but their values are meaningless.
+    """
+    count = len(columns)
+    item_counts = np.diff(columns.offsets)
+    owner = np.repeat(np.arange(count), item_counts)
+    quantity, unit_price, amount = columns.items.T
+
+    bad_items = np.flatnonzero(np.abs(quantity * unit_price - amount) > AMOUNT_TOLERANCE)
+    first_bad_item = np.full(count, -1, dtype=np.int64)
+    bad_owners, first = np.unique(owner[bad_items], return_index=True)
+    first_bad_item[bad_owners] = bad_items[first] - columns.offsets[bad_owners]
+
+    # bincount adds in order, as sum() does in check_subtotal.
+    line_total = np.bincount(owner, weights=amount, minlength=count)
+    subtotal, gst, round_off, grand_total = columns.totals.T
+    return {
+        "first_bad_item": first_bad_item,
+        "LIT-004": first_bad_item >= 0,
+        "TTL-001": np.abs(line_total - subtotal) > AMOUNT_TOLERANCE,
+        "TTL-003": np.abs(subtotal + gst + round_off - grand_total) > AMOUNT_TOLERANCE,
+        "ANM-004": columns.ocr_confidence < LOW_OCR_CONFIDENCE,
+    }
+
+
+def _duplicate_results(
+    rule: CompiledRule,
+    schemas: Sequence[Dict[str, Any]],
+    invoice_ids: Optional[Sequence[Optional[str]]],
+) -> List[Dict[str, Any]]:
+    """DUP-001 for every invoice (None where it does not apply), from one lookup for the whole batch."""
+    applies = [rule.applies(schema) for schema in schemas]
+    keys = [InvoiceKey.from_schema(schema) if applicable else None for schema, applicable in zip(schemas, applies)]
+    try:
+        found = get_duplicate_detector().find_duplicates(keys, invoice_ids)
+        error = None
+    except Exception as e:
+        found, error = [None] * len(keys), e
+    results = []
+    for applicable, key, duplicate_id in zip(applies, keys, found):
+        if not applicable:
+            results.append(None)
+            continue
+        result = duplicate_check_result(key, duplicate_id, error if key is not None else None).to_dict()
+        if result["status"] != "PASS":
+            result["severity"] = rule.severity
+        results.append(result)
+    return results
+
+
+def run_validation_checks_batch(
+    schemas: Sequence[Dict[str, Any]],
+    ocr_confidences: Optional[Sequence[float]] = None,
+    plan: Optional[List[CompiledRule]] = None,
+    invoice_ids: Optional[Sequence[Optional[str]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Validates many mapped schemas against the rule plan and returns, per
+    invoice, the same dict as run_validation_checks.
+
+    LIT-004, TTL-001, TTL-003 and ANM-004 are evaluated with NumPy over the
+    whole batch, and DUP-001 with a single duplicate lookup (`invoice_ids`
+    exclude each invoice from its own check). Any other rule in the plan runs
+    per invoice, and the per-invoice loop only assembles the reports.
+    Invoices with non-numeric values (e.g. a null roundOff) go through the
+    scalar engine; if a rule raises, the invoice gets
+    {"status": "FAILED_VALIDATION", "error": ...} instead of aborting the
+    batch.
+    """
+    if plan is None:
+        plan = get_validation_rule_registry().plan()
+    if invoice_ids is None:
+        invoice_ids = [None] * len(schemas)
+    columns = InvoiceColumns.from_schemas(schemas, ocr_confidences)
+    evaluated = evaluate(columns)
+    failed = {rule_id: evaluated[rule_id].tolist() for rule_id in VECTORISED_RESULTS}
+    first_bad_item = evaluated["first_bad_item"].tolist()
+    confidence = columns.ocr_confidence.tolist()
+    irregular = columns.irregular.tolist()
+    templates = {
+        rule.rule_id: (VECTORISED_RESULTS[rule.rule_id][0], {**VECTORISED_RESULTS[rule.rule_id][1], "severity": rule.severity})
+        for rule in plan if rule.rule_id in VECTORISED_RESULTS
+    }
+    duplicate_rule = next((rule for rule in plan if rule.rule_id == "DUP-001"), None)
+    duplicates = _duplicate_results(duplicate_rule, schemas, invoice_ids) if duplicate_rule is not None else None
+
+    reports = []
+    for i, schema in enumerate(schemas):
+        try:
+            if irregular[i]:
+                reports.append(run_validation_checks(schema, confidence[i], plan, invoice_ids[i]))
+                continue
+            results = []
+            for rule in plan:
+                if not rule.applies(schema):
+                    continue
+                if rule is duplicate_rule:
+                    results.append(duplicates[i])
+                elif rule.rule_id not in templates:
+                    results.append(rule(schema, {"ocr_confidence": confidence[i], "invoice_id": invoice_ids[i]}).to_dict())
+                elif not failed[rule.rule_id][i]:
+                    results.append(dict(templates[rule.rule_id][0]))
+                elif rule.rule_id == "LIT-004":
+                    results.append({**templates["LIT-004"][1], "message": f"Line item {first_bad_item[i] + 1} math incorrect."})
+                elif rule.rule_id == "ANM-004":
+                    results.append({**templates["ANM-004"][1], "message": f"Low OCR confidence ({confidence[i]:.2f})."})
+                else:
+                    results.append(dict(templates[rule.rule_id][1]))
+        except Exception as e:
+            reports.append({"status": "FAILED_VALIDATION", "error": str(e)})
+            continue
+        reports.append({
+            "status": "VALIDATED_CLEAN" if all(r["status"] == "PASS" for r in results) else "VALIDATED_FLAGGED",
+            "overall_score": max(0, INITIAL_SCORE - sum(r["deduction_points"] for r in results)),
+            "validation_results": results,
+        })
+    return reports
@@ -0,0 +1,400 @@
+# services/duplicate_detection.py
+
+# Duplicate-invoice detection. Every stored invoice is keyed by its normalised
+# (vendor GSTIN or name, invoice number, date) and added to an in-memory Bloom
+# filter, so the common case -- a new invoice -- is answered without touching
+# Postgres. Only filter positives (and lookups made before the filter is
+# warmed) go to the database, via the expression indexes in schema.sql.
+
+import datetime
+import hashlib
+import json
+import math
+import re
+import select
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from invoice_core_processor.config.settings import get_settings
+
+# Postgres NOTIFY channel raised for every stored invoice (see schema.sql).
+INVOICE_KEYS_CHANNEL = "invoice_keys_added"
+
+DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y")
+
+# SQL counterparts of the normalisation below; schema.sql indexes these expressions.
+SQL_VENDOR_GSTIN = "upper(btrim(v.gstin))"
+SQL_VENDOR_NAME = r"lower(regexp_replace(btrim(v.name), '\s+', ' ', 'g'))"
+SQL_INVOICE_NO = "upper(regexp_replace(i.invoice_no, '[^A-Za-z0-9]', '', 'g'))"
+
+
+def normalise_gstin(gstin: Optional[str]) -> Optional[str]:
+    return gstin.strip().upper() or None if isinstance(gstin, str) else None
+
+def normalise_vendor_name(name: Optional[str]) -> Optional[str]:
+    return " ".join(name.split()).lower() or None if isinstance(name, str) else None
+
+def normalise_invoice_no(invoice_no: Any) -> Optional[str]:
+    if invoice_no is None:
+        return None
+    return re.sub(r"[^A-Za-z0-9]", "", str(invoice_no)).upper() or None
+
+def parse_invoice_date(value: Any) -> Optional[datetime.date]:
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if not isinstance(value, str):
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+class InvoiceKey:
+    """
+    The normalised identity of an invoice. The vendor is matched on GSTIN when
+    one is given, otherwise on name.
+    """
+
+    def __init__(self, gstin: Optional[str], name: Optional[str], invoice_no: str, invoice_date: datetime.date):
+        self.gstin = gstin
+        self.name = name
+        self.invoice_no = invoice_no
+        self.invoice_date = invoice_date
+
+    @classmethod
+    def create(cls, vendor_name: Optional[str], vendor_gstin: Optional[str], invoice_no: Any, invoice_date: Any) -> Optional["InvoiceKey"]:
+        """None if the invoice does not carry enough to be identified."""
+        gstin, name = normalise_gstin(vendor_gstin), normalise_vendor_name(vendor_name)
+        number, date = normalise_invoice_no(invoice_no), parse_invoice_date(invoice_date)
+        if not (gstin or name) or number is None or date is None:
+            return None
+        return cls(gstin, name, number, date)
+
+    @classmethod
+    def from_schema(cls, schema: Dict[str, Any]) -> Optional["InvoiceKey"]:
+        vendor = schema.get("vendor") or {}
+        if not isinstance(vendor, dict):
+            return None
+        return cls.create(vendor.get("name"), vendor.get("gstin"), schema.get("invoiceNumber"), schema.get("invoiceDate"))
+
+    def lookup_token(self) -> str:
+        """The filter entry this key is looked up under."""
+        if self.gstin:
+            return f"gstin:{self.gstin}|{self.invoice_no}|{self.invoice_date.isoformat()}"
+        return f"name:{self.name}|{self.invoice_no}|{self.invoice_date.isoformat()}"
+
+    def stored_tokens(self) -> List[str]:
+        """The filter entries of a stored invoice: by GSTIN and by name, so either lookup finds it."""
+        suffix = f"|{self.invoice_no}|{self.invoice_date.isoformat()}"
+        tokens = [f"name:{self.name}{suffix}"] if self.name else []
+        if self.gstin:
+            tokens.append(f"gstin:{self.gstin}{suffix}")
+        return tokens
+
+    def vendor_clause(self):
+        """SQL condition on `v` (vendors) and its parameter."""
+        if self.gstin:
+            return f"{SQL_VENDOR_GSTIN} = %s", self.gstin
+        return f"{SQL_VENDOR_NAME} = %s", self.name
+
+
+class BloomFilter:
+    """A Bloom filter sized for `capacity` entries at the given false-positive rate."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(1, capacity)
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, token: str) -> Iterable[int]:
+        # Double hashing: k positions from two 64-bit halves of one digest.
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hash_count))
+
+    def add(self, token: str):
+        for position in self._positions(token):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, token: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(token))
+
+
+class DuplicateDetector:
+    """
+    Answers "is this invoice already stored?" from the Bloom filter when it
+    can, and from Postgres otherwise.
+
+    The filter is built by the change listener: it LISTENs for stored invoice
+    keys, then loads every existing key, so no insert made by any replica is
+    missed. Until that has happened -- and whenever the listener loses its
+    connection -- every lookup goes to the database.
+    """
+
+    def __init__(self, error_rate: Optional[float] = None, min_capacity: Optional[int] = None):
+        settings = get_settings()
+        self.error_rate = error_rate if error_rate is not None else settings.DUPLICATE_FILTER_ERROR_RATE
+        self.min_capacity = min_capacity if min_capacity is not None else settings.DUPLICATE_FILTER_MIN_CAPACITY
+        self._filter: Optional[BloomFilter] = None
+        self._lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+        self._listener_stop = threading.Event()
+        self._warmed = threading.Event()
+
+    @property
+    def warmed(self) -> bool:
+        return self._filter is not None
+
+    def might_exist(self, key: InvoiceKey) -> bool:
+        """False only if the invoice is certainly not stored."""
+        bloom = self._filter
+        return bloom is None or key.lookup_token() in bloom
+
+    def add(self, key: InvoiceKey):
+        with self._lock:
+            if self._filter is not None:
+                for token in key.stored_tokens():
+                    self._filter.add(token)
+
+    def find_duplicate(self, key: InvoiceKey, exclude_invoice_id: Optional[str] = None) -> Optional[str]:
+        """The id of another stored invoice with this key, if any; `exclude_invoice_id` is the invoice itself."""
+        if not self.might_exist(key):
+            return None
+        from invoice_core_processor.core.database import postgres_connection
+        vendor_clause, vendor_param = key.vendor_clause()
+        params = [vendor_param, key.invoice_no, key.invoice_date]
+        exclude_clause = ""
+        if exclude_invoice_id is not None:
+            # Compared as text so ids that are not UUIDs (e.g. from ingestion) cannot fail the query.
+            exclude_clause = "AND i.id::text <> %s"
+            params.append(str(exclude_invoice_id))
+        with postgres_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT i.id
+                    FROM invoices i
+                    JOIN vendors v ON v.id = i.vendor_id
+                    WHERE {vendor_clause}
+                      AND {SQL_INVOICE_NO} = %s
+                      AND i.invoice_date = %s
+                      {exclude_clause}
+                    LIMIT 1;
+                    """,
+                    params,
+                )
+                row = cur.fetchone()
+        return str(row[0]) if row else None
+
+    def find_duplicates(self, keys: Sequence[Optional[InvoiceKey]], exclude_invoice_ids: Optional[Sequence[Optional[str]]] = None) -> List[Optional[str]]:
+        """
+        find_duplicate for many invoices at once: the keys the filter cannot
+        rule out are looked up in a single query. Returns one id (or None)
+        per key, in order; None keys are skipped.
+        """
+        if exclude_invoice_ids is None:
+            exclude_invoice_ids = [None] * len(keys)
+        found: List[Optional[str]] = [None] * len(keys)
+        by_gstin, by_name = [], []
+        for index, key in enumerate(keys):
+            if key is not None and self.might_exist(key):
+                exclude = str(exclude_invoice_ids[index]) if exclude_invoice_ids[index] is not None else None
+                row = (index, key.invoice_no, key.invoice_date, exclude)
+                if key.gstin:
+                    by_gstin.append((key.gstin, *row))
+                else:
+                    by_name.append((key.name, *row))
+        if not by_gstin and not by_name:
+            return found
+
+        def candidates(rows):
+            # Parallel arrays for unnest(): vendor, index, invoice_no, invoice_date, excluded id.
+            return [list(column) for column in zip(*rows)] if rows else [[], [], [], [], []]
+
+        from invoice_core_processor.core.database import postgres_connection
+        query = """
+            SELECT DISTINCT ON (c.idx) c.idx, i.id
+            FROM unnest(%s::text[], %s::int[], %s::text[], %s::date[], %s::text[])
+                AS c(vendor, idx, invoice_no, invoice_date, exclude_id)
+            JOIN vendors v ON {vendor} = c.vendor
+            JOIN invoices i ON i.vendor_id = v.id
+                AND {invoice_no} = c.invoice_no
+                AND i.invoice_date = c.invoice_date
+            WHERE c.exclude_id IS NULL OR i.id::text <> c.exclude_id
+        """
+        with postgres_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    query.format(vendor=SQL_VENDOR_GSTIN, invoice_no=SQL_INVOICE_NO)
+                    + " UNION ALL "
+                    + query.format(vendor=SQL_VENDOR_NAME, invoice_no=SQL_INVOICE_NO)
+                    + ";",
+                    candidates(by_gstin) + candidates(by_name),
+                )
+                for index, invoice_id in cur.fetchall():
+                    found[index] = str(invoice_id)
+        return found
+
+    def find_near_duplicates(
+        self,
+        vendor_name: Optional[str],
+        vendor_gstin: Optional[str],
+        invoice_date: Any,
+        amount: float,
+        days: Optional[int] = None,
+        amount_tolerance: Optional[float] = None,
+        limit: int = 10,
+    ) -> List[Dict[str, Any]]:
+        """
+        Stored invoices of the same vendor within `days` of the date and
+        `amount_tolerance` of the amount, whatever their number, closest
+        first. This always queries the database (indexed on vendor, date and
+        amount).
+        """
+        settings = get_settings()
+        days = days if days is not None else settings.DUPLICATE_NEAR_MATCH_DAYS
+        amount_tolerance = amount_tolerance if amount_tolerance is not None else settings.DUPLICATE_NEAR_MATCH_AMOUNT_TOLERANCE
+        key = InvoiceKey.create(vendor_name, vendor_gstin, "-", invoice_date)
+        if key is None:
+            return []
+        from invoice_core_processor.core.database import postgres_connection
+        vendor_clause, vendor_param = key.vendor_clause()
+        window = datetime.timedelta(days=days)
+        with postgres_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT i.id, i.invoice_no, i.invoice_date, i.total_amount
+                    FROM invoices i
+                    JOIN vendors v ON v.id = i.vendor_id
+                    WHERE {vendor_clause}
+                      AND i.invoice_date BETWEEN %s AND %s
+                      AND i.total_amount BETWEEN %s AND %s
+                    ORDER BY abs(i.invoice_date - %s::date), abs(i.total_amount - %s)
+                    LIMIT %s;
+                    """,
+                    (
+                        vendor_param,
+                        key.invoice_date - window, key.invoice_date + window,
+                        amount - amount_tolerance, amount + amount_tolerance,
+                        key.invoice_date, amount, limit,
+                    ),
+                )
+                rows = cur.fetchall()
+        return [
+            {"invoice_id": str(row[0]), "invoice_no": row[1], "invoice_date": row[2].isoformat(), "total_amount": float(row[3])}
+            for row in rows
+        ]
+
+    # --- Filter Warm-up ---
+
+    def warm(self):
+        """Builds a new filter from every stored invoice and swaps it in."""
+        from invoice_core_processor.core.database import postgres_connection
+        with postgres_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT count(*) FROM invoices;")
+                stored = cur.fetchone()[0]
+            # Two entries per invoice (GSTIN and name), with room to grow before a rebuild.
+            bloom = BloomFilter(max(self.min_capacity, 4 * stored), self.error_rate)
+            with conn.cursor(name="duplicate_filter_warmup") as cur:
+                cur.itersize = 10000
+                cur.execute(
+                    """
+                    SELECT v.gstin, v.name, i.invoice_no, i.invoice_date
+                    FROM invoices i
+                    JOIN vendors v ON v.id = i.vendor_id;
+                    """
+                )
+                for gstin, name, invoice_no, invoice_date in cur:
+                    key = InvoiceKey.create(name, gstin, invoice_no, invoice_date)
+                    if key is not None:
+                        for token in key.stored_tokens():
+                            bloom.add(token)
+            conn.commit()
+        with self._lock:
+            self._filter = bloom
+        self._warmed.set()
+        print(f"Duplicate filter warmed with {stored} invoices ({bloom.size // 8 // 1024} KiB).")
+
+    def _invalidate(self):
+        with self._lock:
+            self._filter = None
+        self._warmed.clear()
+
+    def wait_until_warmed(self, timeout: float) -> bool:
+        """Blocks until the listener has built the filter (or `timeout` passes); True if it is warm."""
+        return self._warmed.wait(timeout)
+
+    # --- Change Listener ---
+
+    def start_change_listener(self):
+        """
+        Starts a background thread that LISTENs for stored invoices, warms the
+        filter and keeps it up to date.
+        """
+        if self._listener is not None and self._listener.is_alive():
+            return
+        self._listener_stop.clear()
+        self._listener = threading.Thread(target=self._listen_for_changes, name="duplicate-filter-listener", daemon=True)
+        self._listener.start()
+
+    def stop_change_listener(self):
+        self._listener_stop.set()
+        if self._listener is not None:
+            self._listener.join(timeout=5)
+            self._listener = None
+
+    def _listen_for_changes(self):
+        from invoice_core_processor.core.database import get_postgres_connection
+        while not self._listener_stop.is_set():
+            conn = None
+            try:
+                # LISTEN needs a dedicated connection for the lifetime of the loop.
+                conn = get_postgres_connection()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {INVOICE_KEYS_CHANNEL};")
+                # Inserts from now on are queued on this connection, so the load cannot miss any.
+                self.warm()
+                while not self._listener_stop.is_set():
+                    bloom = self._filter
+                    if bloom is not None and bloom.count > bloom.capacity:
+                        print("Duplicate filter is over capacity; rebuilding.")
+                        self.warm()
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._add_notified(conn.notifies.pop(0).payload)
+            except Exception as e:
+                # Inserts may be missed while disconnected; fall back to the database until re-warmed.
+                self._invalidate()
+                print(f"Duplicate filter listener error: {e}. Reconnecting...")
+                self._listener_stop.wait(5)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _add_notified(self, payload: str):
+        try:
+            row = json.loads(payload)
+        except ValueError:
+            return
+        key = InvoiceKey.create(row.get("name"), row.get("gstin"), row.get("invoice_no"), row.get("invoice_date"))
+        if key is not None:
+            self.add(key)
+
+
+@lru_cache()
+def get_duplicate_detector() -> DuplicateDetector:
+    return DuplicateDetector()
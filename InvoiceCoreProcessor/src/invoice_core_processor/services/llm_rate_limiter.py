@@ -0,0 +1,126 @@
+# services/llm_rate_limiter.py
+
+# Client-side admission control for LLM calls: a cap on concurrent requests
+# plus token buckets sized to the provider's requests-per-minute and
+# tokens-per-minute quota, so bursts are smoothed out before they turn into 429s.
+
+import asyncio
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Optional
+
+from invoice_core_processor.config.settings import get_settings
+
+class TokenBucket:
+    """
+    `capacity` units, refilled continuously at `capacity` per `period` seconds.
+
+    Callers reserve units up front and are told how long to wait, so waiters
+    are admitted in order without polling. The balance may go negative (a
+    debt) when actual usage turns out higher than reserved. State is guarded
+    by a thread lock, so one bucket can be shared by every event loop in the
+    process.
+    """
+
+    def __init__(self, capacity: float, period: float = 60.0, clock=time.monotonic):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Takes `amount` units and returns the seconds to wait before using them."""
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def adjust(self, delta: float):
+        """Charges (positive) or refunds (negative) units after the fact."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens - delta)
+
+    async def acquire(self, amount: float):
+        delay = self.reserve(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def retry_delay(attempt: int, base: float, cap: float, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+class LLMRateLimiter:
+    """
+    Admits a request once it holds one of `max_in_flight` slots, one request
+    from the RPM bucket and its estimated tokens from the TPM bucket. A quota
+    of 0 disables that bucket.
+    """
+
+    def __init__(self, max_in_flight: int, requests_per_minute: float, tokens_per_minute: float, clock=time.monotonic):
+        self.max_in_flight = max(1, max_in_flight)
+        self.requests = TokenBucket(requests_per_minute, clock=clock) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock) if tokens_per_minute > 0 else None
+        self._clock = clock
+        self._resume_at = 0.0
+        # asyncio.Semaphore is bound to the loop it is first used on.
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_in_flight)
+            return semaphore
+
+    def pause(self, seconds: float):
+        """Holds back every new request for `seconds`, e.g. after a 429."""
+        with self._lock:
+            self._resume_at = max(self._resume_at, self._clock() + seconds)
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        async with self._semaphore():
+            with self._lock:
+                paused = self._resume_at - self._clock()
+            if paused > 0:
+                await asyncio.sleep(paused)
+            if self.requests is not None:
+                await self.requests.acquire(1)
+            if self.tokens is not None:
+                await self.tokens.acquire(estimated_tokens)
+            yield
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """Settles the difference between the reserved and the reported token count."""
+        if self.tokens is not None and isinstance(actual_tokens, int):
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+@lru_cache()
+def get_llm_rate_limiter() -> LLMRateLimiter:
+    settings = get_settings()
+    return LLMRateLimiter(
+        max_in_flight=settings.OPENAI_MAX_IN_FLIGHT,
+        requests_per_minute=settings.OPENAI_REQUESTS_PER_MINUTE,
+        tokens_per_minute=settings.OPENAI_TOKENS_PER_MINUTE,
+    )
@@ -1,61 +1,418 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+from functools import lru_cache
+import asyncio
 import json
-from unittest.mock import MagicMock
+import threading
+from types import SimpleNamespace
 
-from invoice_core_processor.prompts.schema import EXTRACTION_SCHEMA_PROMPT
+from invoice_core_processor.prompts.schema import BATCH_EXTRACTION_INSTRUCTIONS, EXTRACTION_SCHEMA_PROMPT, EXTRACTION_SCHEMA_PROMPT_VERSION
+from invoice_core_processor.services.mapping_cache import get_mapping_cache, make_mapping_key
+from invoice_core_processor.services.template_extractor import get_template_extractor
+from invoice_core_processor.services.llm_rate_limiter import get_llm_rate_limiter, retry_delay
+from invoice_core_processor.services.text_compaction import COMPACTION_VERSION, compact_text, estimate_tokens
 from invoice_core_processor.config.settings import get_settings
 
 # --- OpenAI Client Initialization ---
 
-try:
-    from openai import OpenAI
-    settings = get_settings()
-    if settings.OPENAI_API_KEY:
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+def _stub_completion_response():
+    content = json.dumps({
+        "invoiceNumber": "mock-inv-123", "invoiceDate": "2023-01-01",
+        "vendor": {"name": "Mock Vendor"}, "totals": {"grandTotal": 100.0}
+    })
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+class _StubCompletions:
+    def create(self, **kwargs):
+        return _stub_completion_response()
+
+class _StubAsyncCompletions:
+    async def create(self, **kwargs):
+        return _stub_completion_response()
+
+class StubOpenAIClient:
+    """
+    Stands in for the OpenAI client when no API key (or no SDK) is available,
+    answering every chat completion with the same placeholder invoice.
+    """
+
+    def __init__(self, asynchronous: bool = False):
+        self.chat = SimpleNamespace(completions=_StubAsyncCompletions() if asynchronous else _StubCompletions())
+
+@lru_cache()
+def get_openai_client():
+    """
+    Builds the OpenAI client on first use, so importing this module (and the
+    MCP servers that depend on it) does not load the SDK.
+    """
+    try:
+        from openai import OpenAI
+        settings = get_settings()
+        if settings.OPENAI_API_KEY:
+            return OpenAI(api_key=settings.OPENAI_API_KEY)
+        print("Warning: OPENAI_API_KEY not set. Using a stub client.")
+        return StubOpenAIClient()
+    except ImportError:
+        print("Warning: 'openai' library not found. Using a stub client.")
+        return StubOpenAIClient()
+
+_async_client = None
+_async_client_loop = None
+_async_client_lock = threading.Lock()
+
+def get_async_openai_client():
+    """
+    Returns the process-wide AsyncOpenAI client, created on first use.
+
+    Its HTTP connection pool is bound to the event loop it is first used on,
+    so (as with the MongoDB client) it is replaced, and the old one closed,
+    if called from another loop. Retries are left to amap_text_to_schema, which coordinates them
+    with the rate limiter.
+    """
+    global _async_client, _async_client_loop
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    with _async_client_lock:
+        if _async_client is not None and loop is not None:
+            if _async_client_loop is None:
+                _async_client_loop = loop
+            elif _async_client_loop is not loop:
+                print("Event loop changed; replacing AsyncOpenAI client.")
+                _close_on_loop(_async_client, _async_client_loop)
+                _async_client = None
+
+        if _async_client is None:
+            settings = get_settings()
+            try:
+                from openai import AsyncOpenAI
+                if settings.OPENAI_API_KEY:
+                    _async_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0)
+                else:
+                    print("Warning: OPENAI_API_KEY not set. Using a stub async client.")
+                    _async_client = StubOpenAIClient(asynchronous=True)
+            except ImportError:
+                print("Warning: 'openai' library not found. Using a stub async client.")
+                _async_client = StubOpenAIClient(asynchronous=True)
+            _async_client_loop = loop
+        return _async_client
+
+def _close_on_loop(client, loop):
+    # The client's connections belong to `loop`, so they can only be closed
+    # there. Once that loop is closed they cannot be closed at all, which is
+    # why close_async_openai_client should run before a loop ends.
+    if isinstance(client, StubOpenAIClient) or loop is None or loop.is_closed():
+        return
+    if loop.is_running():
+        asyncio.run_coroutine_threadsafe(client.close(), loop)
     else:
-        print("Warning: OPENAI_API_KEY not set. Using a mock client.")
-        client = MagicMock()
-        mock_response = MagicMock()
-        mock_choice = MagicMock()
-        mock_choice.message.content = json.dumps({
-            "invoiceNumber": "mock-inv-123", "invoiceDate": "2023-01-01",
-            "vendor": {"name": "Mock Vendor"}, "totals": {"grandTotal": 100.0}
-        })
-        mock_response.choices = [mock_choice]
-        client.chat.completions.create.return_value = mock_response
-except ImportError:
-    print("Warning: 'openai' library not found. Using a mock client.")
-    client = MagicMock()
+        # An idle loop cannot be run from the thread whose own loop is running.
+        closer = threading.Thread(target=loop.run_until_complete, args=(client.close(),), name="openai-client-close")
+        closer.start()
+        closer.join()
+
+async def close_async_openai_client():
+    """Closes the shared AsyncOpenAI client and its connection pool; call before the event loop ends."""
+    global _async_client, _async_client_loop
+    with _async_client_lock:
+        client, loop = _async_client, _async_client_loop
+        _async_client, _async_client_loop = None, None
+    if client is None or isinstance(client, StubOpenAIClient):
+        return
+    if loop is None or loop is asyncio.get_running_loop():
+        await client.close()
+    else:
+        _close_on_loop(client, loop)
+
+# --- Mapping ---
+
+def _prompt_version(settings) -> str:
+    """Prompt version for cache keys; compaction changes what the LLM sees, so it is included."""
+    if not settings.MAPPING_TEXT_COMPACTION:
+        return EXTRACTION_SCHEMA_PROMPT_VERSION
+    return f"{EXTRACTION_SCHEMA_PROMPT_VERSION}+compaction{COMPACTION_VERSION}/{settings.MAPPING_TEXT_TOKEN_BUDGET}"
+
+def _fast_path(extracted_text: str, settings) -> Tuple[Optional[Dict[str, Any]], Any, Optional[str], Any]:
+    """
+    Serves the mapping from the response cache or a learned vendor template.
+    Returns (result or None, cache, cache key, template extractor).
+    """
+    # Mock responses (no API key) are never cached.
+    cache = get_mapping_cache() if settings.OPENAI_API_KEY else None
+    key = make_mapping_key(extracted_text, settings.OPENAI_MODEL, _prompt_version(settings)) if cache else None
+    if cache is not None:
+        try:
+            cached = cache.get(key)
+        except Exception as e:
+            print(f"Mapping cache read failed: {e}")
+            cached = None
+        if cached is not None:
+            return {"status": "MAPPING_COMPLETE", "mapped_schema": cached, "cache": "hit"}, cache, key, None
+
+    extractor = get_template_extractor()
+    if extractor is not None:
+        extracted = extractor.extract(extracted_text)
+        if extracted is not None:
+            return {
+                "status": "MAPPING_COMPLETE", "mapped_schema": extracted["mapped_schema"],
+                "source": "template", "template_id": extracted["template_id"], "confidence": extracted["confidence"],
+            }, cache, key, extractor
+    return None, cache, key, extractor
+
+def _prompt_text(extracted_text: str, settings) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Compacts the OCR text for the prompt when enabled. Returns (text, compaction stats)."""
+    if not settings.MAPPING_TEXT_COMPACTION:
+        return extracted_text, None
+    compacted, stats = compact_text(extracted_text, settings.MAPPING_TEXT_TOKEN_BUDGET)
+    print(
+        f"Compacted OCR text for mapping: {stats['tokens_before']} -> {stats['tokens_after']} tokens"
+        f"{' (truncated)' if stats['truncated'] else ''}"
+    )
+    return compacted, stats
+
+def _mapping_messages(extracted_text: str, settings) -> Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]:
+    """Builds the chat messages, compacting the OCR text first when enabled. Returns (messages, compaction stats)."""
+    extracted_text, stats = _prompt_text(extracted_text, settings)
+    # The prompt contains literal JSON braces, so the text is appended rather than str.format-ted in.
+    prompt = f"{EXTRACTION_SCHEMA_PROMPT}\nHere is the OCR-extracted text:\n\n{extracted_text}"
+    return [
+        {"role": "system", "content": "You are a data extraction expert."},
+        {"role": "user", "content": prompt}
+    ], stats
+
+def _finish_mapping(extracted_text: str, mapped_data: Any, cache, key: Optional[str], extractor, settings, compaction=None) -> Dict[str, Any]:
+    result = {
+        "status": "MAPPING_COMPLETE",
+        "mapped_schema": mapped_data,
+        "source": "llm"
+    }
+    if compaction is not None:
+        result["compaction"] = compaction
+    if extractor is not None and settings.OPENAI_API_KEY and isinstance(mapped_data, dict):
+        try:
+            extractor.learn(extracted_text, mapped_data)
+        except Exception as e:
+            print(f"Template learning failed: {e}")
+    if cache is not None:
+        try:
+            cache.set(key, mapped_data)
+        except Exception as e:
+            print(f"Mapping cache write failed: {e}")
+        result["cache"] = "miss"
+    return result
 
 def map_text_to_schema(extracted_text: str, target_system: str) -> Dict[str, Any]:
     """
     Uses a real LLM call (or a mock if the key is not set) to map text to schema.
+    Responses are cached by normalised text, model and prompt version, so
+    re-uploads of the same document skip the LLM, and invoices from vendors
+    with a learned template are extracted by rules without calling it at all.
     """
     print(f"Mapping extracted text for target system: {target_system}")
 
-    prompt = EXTRACTION_SCHEMA_PROMPT.format(extracted_text=extracted_text)
     settings = get_settings()
+    result, cache, key, extractor = _fast_path(extracted_text, settings)
+    if result is not None:
+        return result
 
+    messages, compaction = _mapping_messages(extracted_text, settings)
     try:
-        response = client.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model=settings.OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a data extraction expert."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             response_format={"type": "json_object"}
         )
 
         llm_response_content = response.choices[0].message.content
         mapped_data = json.loads(llm_response_content)
-
+    except Exception as e:
+        print(f"LLM call failed: {e}")
         return {
-            "status": "MAPPING_COMPLETE",
-            "mapped_schema": mapped_data
+            "status": "FAILED_MAPPING",
+            "error": str(e)
         }
+
+    return _finish_mapping(extracted_text, mapped_data, cache, key, extractor, settings, compaction)
+
+def _is_retryable(error: Exception) -> bool:
+    try:
+        import openai
+    except ImportError:
+        return False
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True  # APITimeoutError is a subclass of APIConnectionError
+    return isinstance(error, openai.APIStatusError) and error.status_code in (408, 409)
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def _estimate_tokens(messages: List[Dict[str, str]], settings, completions: int = 1) -> int:
+    # Prompt tokens plus the completion(s) we expect back.
+    return sum(estimate_tokens(m["content"]) for m in messages) + settings.OPENAI_EXPECTED_COMPLETION_TOKENS * completions
+
+async def _acreate_completion(messages: List[Dict[str, str]], settings, completions: int = 1):
+    """
+    Sends one chat completion through the shared rate limiter, retrying
+    429s, timeouts and 5xx responses with jittered exponential backoff. A 429
+    also pauses the limiter so concurrent callers back off together instead
+    of stampeding the quota.
+    """
+    limiter = get_llm_rate_limiter()
+    estimated = _estimate_tokens(messages, settings, completions)
+    attempt = 0
+    while True:
+        try:
+            async with limiter.slot(estimated):
+                response = await get_async_openai_client().chat.completions.create(
+                    model=settings.OPENAI_MODEL,
+                    messages=messages,
+                    response_format={"type": "json_object"}
+                )
+            limiter.record_usage(estimated, getattr(getattr(response, "usage", None), "total_tokens", None))
+            return response
+        except Exception as e:
+            if attempt >= settings.OPENAI_MAX_RETRIES or not _is_retryable(e):
+                raise
+            retry_after = _retry_after(e)
+            delay = retry_delay(attempt, settings.OPENAI_RETRY_BASE_SECONDS, settings.OPENAI_RETRY_MAX_SECONDS, retry_after)
+            if getattr(e, "status_code", None) == 429:
+                limiter.pause(retry_after if retry_after is not None else delay)
+            attempt += 1
+            print(f"LLM call failed ({e}); retry {attempt}/{settings.OPENAI_MAX_RETRIES} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+async def _allm_map(extracted_text: str, settings, cache, key: Optional[str], extractor) -> Dict[str, Any]:
+    messages, compaction = _mapping_messages(extracted_text, settings)
+    try:
+        response = await _acreate_completion(messages, settings)
+        mapped_data = json.loads(response.choices[0].message.content)
     except Exception as e:
         print(f"LLM call failed: {e}")
         return {
             "status": "FAILED_MAPPING",
             "error": str(e)
         }
+
+    return await asyncio.to_thread(_finish_mapping, extracted_text, mapped_data, cache, key, extractor, settings, compaction)
+
+async def amap_text_to_schema(extracted_text: str, target_system: str) -> Dict[str, Any]:
+    """
+    Async counterpart of map_text_to_schema for callers inside an event loop.
+    Same cache and template fast paths; the LLM call goes through the shared
+    AsyncOpenAI client, bounded by OPENAI_MAX_IN_FLIGHT and the RPM/TPM quota.
+    """
+    print(f"Mapping extracted text for target system: {target_system} (async)")
+
+    settings = get_settings()
+    # Cache backends and template matching are blocking; keep them off the loop.
+    result, cache, key, extractor = await asyncio.to_thread(_fast_path, extracted_text, settings)
+    if result is not None:
+        return result
+    return await _allm_map(extracted_text, settings, cache, key, extractor)
+
+# --- Batched mapping ---
+
+def _pack_batches(entries: List[Dict[str, Any]], max_invoices: int, max_tokens: int) -> List[List[Dict[str, Any]]]:
+    """Groups entries (with a "tokens" count) in order, within the invoice and token limits."""
+    batches, current, spent = [], [], 0
+    for entry in entries:
+        if current and (len(current) >= max_invoices or spent + entry["tokens"] > max_tokens):
+            batches.append(current)
+            current, spent = [], 0
+        current.append(entry)
+        spent += entry["tokens"]
+    if current:
+        batches.append(current)
+    return batches
+
+def _batch_messages(batch: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    invoices = "\n\n".join(f"### INVOICE {entry['ref']}\n{entry['prompt_text']}" for entry in batch)
+    return [
+        {"role": "system", "content": "You are a data extraction expert."},
+        {"role": "user", "content": f"{EXTRACTION_SCHEMA_PROMPT}\n{BATCH_EXTRACTION_INSTRUCTIONS}\n{invoices}"}
+    ]
+
+def _demultiplex(content: str, refs: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Maps each ref to its extracted schema; refs missing or malformed in the response are left out."""
+    try:
+        payload = json.loads(content)
+    except (TypeError, ValueError):
+        return {}
+    entries = payload.get("invoices") if isinstance(payload, dict) else None
+    if not isinstance(entries, list):
+        return {}
+    mapped = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get("data"), dict):
+            continue
+        ref = str(entry.get("ref"))
+        if ref in refs and ref not in mapped:
+            mapped[ref] = entry["data"]
+    return mapped
+
+async def _amap_batch(batch: List[Dict[str, Any]], settings) -> Dict[str, Dict[str, Any]]:
+    """Maps one packed batch, falling back to a single-invoice call for every invoice the response does not cover."""
+    mapped = {}
+    if len(batch) > 1:
+        try:
+            response = await _acreate_completion(_batch_messages(batch), settings, completions=len(batch))
+            mapped = _demultiplex(response.choices[0].message.content, [entry["ref"] for entry in batch])
+        except Exception as e:
+            print(f"Batched LLM call for {len(batch)} invoices failed: {e}")
+        if len(mapped) < len(batch):
+            print(f"Batched mapping covered {len(mapped)}/{len(batch)} invoices; mapping the rest individually.")
+
+    async def finish(entry):
+        if entry["ref"] not in mapped:
+            return await _allm_map(entry["text"], settings, entry["cache"], entry["key"], entry["extractor"])
+        result = await asyncio.to_thread(
+            _finish_mapping, entry["text"], mapped[entry["ref"]], entry["cache"], entry["key"], entry["extractor"], settings, entry["compaction"]
+        )
+        result.update({"source": "llm_batch", "batch_size": len(batch)})
+        return result
+
+    results = await asyncio.gather(*(finish(entry) for entry in batch))
+    return {entry["invoice_id"]: result for entry, result in zip(batch, results)}
+
+async def amap_texts_to_schema_batch(invoices: List[Dict[str, str]], target_system: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Maps many invoices, given as {"invoice_id", "extracted_text"} dicts, and
+    returns {invoice_id: mapping result}, each shaped like amap_text_to_schema's.
+
+    Invoices served by the cache or a learned template skip the LLM as usual.
+    The rest are packed, up to MAPPING_BATCH_SIZE short invoices at a time,
+    into one request that shares the schema prompt; invoices over
+    MAPPING_BATCH_MAX_INVOICE_TOKENS are sent on their own. Any invoice the
+    batched response leaves out or garbles is re-mapped individually.
+    """
+    print(f"Mapping {len(invoices)} invoices for target system: {target_system} (batched)")
+
+    settings = get_settings()
+    results, pending = {}, []
+    fast = await asyncio.gather(*(asyncio.to_thread(_fast_path, item["extracted_text"], settings) for item in invoices))
+    for item, (result, cache, key, extractor) in zip(invoices, fast):
+        if result is not None:
+            results[item["invoice_id"]] = result
+            continue
+        prompt_text, compaction = _prompt_text(item["extracted_text"], settings)
+        pending.append({
+            "invoice_id": item["invoice_id"], "ref": str(len(pending) + 1), "text": item["extracted_text"],
+            "prompt_text": prompt_text, "compaction": compaction, "tokens": estimate_tokens(prompt_text),
+            "cache": cache, "key": key, "extractor": extractor,
+        })
+
+    short = [entry for entry in pending if entry["tokens"] <= settings.MAPPING_BATCH_MAX_INVOICE_TOKENS]
+    batches = _pack_batches(short, max(1, settings.MAPPING_BATCH_SIZE), settings.MAPPING_BATCH_MAX_TOKENS)
+    batches += [[entry] for entry in pending if entry["tokens"] > settings.MAPPING_BATCH_MAX_INVOICE_TOKENS]
+
+    for batch_results in await asyncio.gather(*(_amap_batch(batch, settings) for batch in batches)):
+        results.update(batch_results)
+    return results
@@ -0,0 +1,220 @@
+# services/mapping_cache.py
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from invoice_core_processor.config.settings import get_settings
+
+def normalise_text(text: str) -> str:
+    """Canonical form of OCR text for cache keys: NFKC, collapsed whitespace."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip()
+
+def make_mapping_key(text: str, model: str, prompt_version: str) -> str:
+    payload = "\0".join([prompt_version, model, normalise_text(text)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MappingCache(ABC):
+    """
+    Interface for LLM mapping caches. Entries expire after `ttl` seconds and
+    the least recently used ones are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+
+class MemoryMappingCache(MappingCache):
+    """Per-process LRU. Entries are kept as JSON so callers never share the cached dict."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        super().__init__(max_entries, ttl)
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return json.loads(entry[1])
+
+    def set(self, key: str, value: Dict[str, Any]):
+        response = json.dumps(value)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteMappingCache(MappingCache):
+    """Single-file cache shared by the processes on one host."""
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        super().__init__(max_entries, ttl)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL;")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_mapping_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_mapping_cache_accessed ON llm_mapping_cache (accessed_at);")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT response FROM llm_mapping_cache WHERE cache_key = ? AND created_at > ?;",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE llm_mapping_cache SET accessed_at = ? WHERE cache_key = ?;", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any]):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_mapping_cache (cache_key, response, created_at, accessed_at) VALUES (?, ?, ?, ?);",
+                (key, json.dumps(value), now, now)
+            )
+            self._conn.execute("DELETE FROM llm_mapping_cache WHERE created_at <= ?;", (now - self.ttl,))
+            self._conn.execute(
+                """
+                DELETE FROM llm_mapping_cache WHERE cache_key IN (
+                    SELECT cache_key FROM llm_mapping_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                );
+                """,
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM llm_mapping_cache;")
+
+
+class PostgresMappingCache(MappingCache):
+    """Cache shared by every replica, in the llm_mapping_cache table (see schema.sql)."""
+
+    # Trimming scans the table, so it runs once every this many writes.
+    EVICT_EVERY = 100
+
+    def __init__(self, max_entries: int, ttl: float):
+        super().__init__(max_entries, ttl)
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        from invoice_core_processor.core.database import postgres_connection
+        with postgres_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE llm_mapping_cache SET accessed_at = NOW()
+                    WHERE cache_key = %s AND created_at > NOW() - make_interval(secs => %s)
+                    RETURNING response;
+                    """,
+                    (key, self.ttl)
+                )
+                row = cur.fetchone()
+                conn.commit()
+        return row[0] if row else None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        from psycopg2.extras import Json
+        from invoice_core_processor.core.database import postgres_connection
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.EVICT_EVERY == 0
+        with postgres_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO llm_mapping_cache (cache_key, response)
+                    VALUES (%s, %s)
+                    ON CONFLICT (cache_key) DO UPDATE SET
+                        response = EXCLUDED.response,
+                        created_at = NOW(),
+                        accessed_at = NOW();
+                    """,
+                    (key, Json(value))
+                )
+                if evict:
+                    cur.execute("DELETE FROM llm_mapping_cache WHERE created_at <= NOW() - make_interval(secs => %s);", (self.ttl,))
+                    cur.execute(
+                        """
+                        DELETE FROM llm_mapping_cache WHERE cache_key IN (
+                            SELECT cache_key FROM llm_mapping_cache ORDER BY accessed_at DESC OFFSET %s
+                        );
+                        """,
+                        (self.max_entries,)
+                    )
+                conn.commit()
+
+    def clear(self):
+        from invoice_core_processor.core.database import postgres_connection
+        with postgres_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM llm_mapping_cache;")
+                conn.commit()
+
+
+@lru_cache()
+def get_mapping_cache() -> Optional[MappingCache]:
+    """Returns the configured mapping cache, or None if MAPPING_CACHE_BACKEND is "none"."""
+    settings = get_settings()
+    backend = settings.MAPPING_CACHE_BACKEND.lower()
+    max_entries, ttl = settings.MAPPING_CACHE_MAX_ENTRIES, settings.MAPPING_CACHE_TTL_SECONDS
+    if backend == "memory":
+        return MemoryMappingCache(max_entries, ttl)
+    if backend == "sqlite":
+        return SQLiteMappingCache(settings.MAPPING_CACHE_SQLITE_PATH, max_entries, ttl)
+    if backend == "postgres":
+        return PostgresMappingCache(max_entries, ttl)
+    if backend != "none":
+        print(f"Unknown MAPPING_CACHE_BACKEND '{backend}'; mapping cache disabled.")
+    return None
@@ -1,10 +1,8 @@
-from invoice_core_processor.core.database import get_postgres_connection
+from invoice_core_processor.core.database import postgres_connection
 
 def get_high_impact_kpis() -> dict:
     """Calculates and returns the high-impact KPIs."""
-    conn = None
-    try:
-        conn = get_postgres_connection()
+    with postgres_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT COUNT(*) FROM invoices;")
             total_invoices = cur.fetchone()[0]
@@ -24,14 +22,10 @@ def get_high_impact_kpis() -> dict:
             "flagged_invoices": flagged_invoices,
             "total_invoice_value": float(total_invoice_value)
         }
-    finally:
-        if conn: conn.close()
 
 def get_quality_efficiency_kpis() -> dict:
     """Calculates and returns the quality and efficiency KPIs."""
-    conn = None
-    try:
-        conn = get_postgres_connection()
+    with postgres_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT AVG(extraction_confidence) FROM invoices;")
             ocr_accuracy = (cur.fetchone()[0] or 0.0) * 100
@@ -52,8 +46,6 @@ def get_quality_efficiency_kpis() -> dict:
             "validation_pass_rate": f"{validation_pass_rate:.2f}%",
             "avg_processing_time_ms": int(avg_processing_time)
         }
-    finally:
-        if conn: conn.close()
 
 def get_deep_insights() -> dict:
     """Returns placeholder data for deep insights."""
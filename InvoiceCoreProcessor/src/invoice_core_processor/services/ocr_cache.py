@@ -0,0 +1,123 @@
+# services/ocr_cache.py
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from invoice_core_processor.config.settings import get_settings
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def evict_least_recently_used(directory: str, max_bytes: int, suffix: str) -> int:
+    """
+    Deletes the oldest (by mtime) files ending in `suffix` until the directory
+    fits in max_bytes. Returns the remaining size.
+    """
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(suffix):
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+    entries.sort()
+    size = sum(entry_size for _, entry_size, _ in entries)
+    for _, entry_size, name in entries:
+        if size <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+            size -= entry_size
+        except OSError:
+            pass
+    return size
+
+
+class OCRResultCache:
+    """
+    Disk-backed cache of OCR results, one JSON file per entry.
+
+    Entries are keyed by the SHA-256 of the file bytes together with the OCR
+    engine configuration, so re-uploads of the same document hit the cache but
+    a configuration change does not serve stale results. Recency is tracked
+    through file mtimes, and the least recently used entries are evicted once
+    the directory grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, file_path: str, engine_config: Dict[str, Any]) -> str:
+        config = json.dumps(engine_config, sort_keys=True)
+        return hashlib.sha256(f"{file_sha256(file_path)}:{config}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # mark as recently used
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, value: Dict[str, Any]):
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            existing = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"OCR cache write failed: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += os.path.getsize(path) - existing
+            if self._size > self.max_bytes:
+                # Re-scans, so entries written by other processes are accounted for.
+                self._size = evict_least_recently_used(self.cache_dir, self.max_bytes, ".json")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _scan_size(self) -> int:
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                try:
+                    total += os.path.getsize(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+        return total
+
+
+@lru_cache()
+def get_ocr_cache() -> Optional[OCRResultCache]:
+    """Returns the process-wide OCR cache, or None if caching is disabled."""
+    settings = get_settings()
+    if not settings.OCR_CACHE_ENABLED:
+        return None
+    return OCRResultCache(settings.OCR_CACHE_DIR, settings.OCR_CACHE_MAX_BYTES)
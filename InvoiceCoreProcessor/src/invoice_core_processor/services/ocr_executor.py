@@ -0,0 +1,134 @@
+# services/ocr_executor.py
+
+# Runs the CPU-bound local OCR engines (Tesseract, EasyOCR) in a pool of
+# worker processes so a large scan does not pin the caller's thread and GIL.
+# Each worker loads its EasyOCR model once, the first time it runs EasyOCR,
+# so model memory grows only with the workers that actually need it.
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, Optional
+
+from invoice_core_processor.config.settings import get_settings
+
+# --- Worker-side state and tasks ---
+
+_reader = None
+_easyocr_languages = ["en"]
+
+def _init_worker(easyocr_languages: str, tesseract_cmd: Optional[str]):
+    """Pool initializer: configures the engines; the EasyOCR model is loaded on first use."""
+    _configure(easyocr_languages, tesseract_cmd)
+
+def _configure(easyocr_languages: str, tesseract_cmd: Optional[str]):
+    global _easyocr_languages
+    _easyocr_languages = [lang.strip() for lang in easyocr_languages.split(",") if lang.strip()]
+    if tesseract_cmd:
+        import pytesseract
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+def _get_reader():
+    global _reader
+    if _reader is None:
+        import easyocr
+        _reader = easyocr.Reader(_easyocr_languages)
+    return _reader
+
+def tesseract_extract(image_paths: List[str]) -> str:
+    import pytesseract
+    from PIL import Image
+    full_text = ""
+    for path in image_paths:
+        with Image.open(path) as image:
+            full_text += pytesseract.image_to_string(image) + "\n"
+    return full_text
+
+def easyocr_extract(image_paths: List[str]) -> str:
+    reader = _get_reader()
+    full_text = ""
+    for path in image_paths:
+        result = reader.readtext(path)
+        full_text += " ".join([item[1] for item in result]) + "\n"
+    return full_text
+
+# --- Caller-side executor management ---
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def ocr_worker_count() -> int:
+    workers = get_settings().OCR_PROCESS_WORKERS
+    return workers if workers is not None else (os.cpu_count() or 1)
+
+def get_ocr_executor() -> Optional[ProcessPoolExecutor]:
+    """
+    Returns the shared OCR process pool, or None when OCR_PROCESS_WORKERS is 0
+    and engines should run inline.
+    """
+    global _executor
+    settings = get_settings()
+    workers = ocr_worker_count()
+    if workers <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # "spawn" avoids inheriting torch/OpenMP thread state through fork.
+            _executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(settings.EASYOCR_LANGUAGES, settings.TESSERACT_CMD_PATH),
+            )
+            print(f"OCR process pool started with {workers} workers.")
+        return _executor
+
+def run_ocr_task(task: Callable, *args):
+    """Runs an OCR task in the process pool (or inline if the pool is disabled)."""
+    executor = get_ocr_executor()
+    if executor is None:
+        if _reader is None:
+            settings = get_settings()
+            _configure(settings.EASYOCR_LANGUAGES, settings.TESSERACT_CMD_PATH)
+        return task(*args)
+    try:
+        return executor.submit(task, *args).result(timeout=get_settings().OCR_TASK_TIMEOUT_SECONDS)
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start a fresh pool next time.
+        shutdown_ocr_executor(wait=False)
+        raise
+
+def _warm_worker(barrier, timeout: float) -> int:
+    # Every warm-up task holds its worker until all of them have one, which
+    # forces the pool (it starts workers on demand) to start every worker.
+    barrier.wait(timeout)
+    _get_reader()
+    return os.getpid()
+
+def warm_up_ocr_engines():
+    """
+    Starts every OCR worker and loads its EasyOCR model, or loads the engines
+    in-process when the pool is disabled.
+    """
+    executor = get_ocr_executor()
+    settings = get_settings()
+    if executor is None:
+        _configure(settings.EASYOCR_LANGUAGES, settings.TESSERACT_CMD_PATH)
+        _get_reader()
+        return
+    workers = ocr_worker_count()
+    timeout = settings.OCR_TASK_TIMEOUT_SECONDS
+    with multiprocessing.get_context("spawn").Manager() as manager:
+        barrier = manager.Barrier(workers)
+        futures = [executor.submit(_warm_worker, barrier, timeout) for _ in range(workers)]
+        pids = {future.result(timeout=timeout) for future in futures}
+    print(f"OCR workers warmed: {len(pids)} of {workers}.")
+
+def shutdown_ocr_executor(wait: bool = True):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait, cancel_futures=True)
+            _executor = None
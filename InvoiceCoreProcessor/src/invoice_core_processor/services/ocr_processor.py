@@ -1,11 +1,17 @@
-from typing import List, Dict, Literal, Optional, TypedDict
+from typing import Iterator, List, Dict, Literal, Optional, Tuple
+from typing_extensions import TypedDict
 from pydantic import BaseModel, Field
-import pdfplumber
-import docx
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 import os
-import pytesseract
-import easyocr
-from PIL import Image
+import tempfile
+import threading
+import time
+
+from invoice_core_processor.config.settings import get_settings
+from invoice_core_processor.services.ocr_cache import get_ocr_cache
+from invoice_core_processor.services.ocr_stats import describe_image, get_ocr_engine_stats
+from invoice_core_processor.services.ocr_executor import ocr_worker_count, run_ocr_task, tesseract_extract, easyocr_extract
 
 # --- Data Models for OCR Output ---
 
@@ -42,10 +48,7 @@ def try_azure_docint(image_paths: list[str]) -> Optional[OCRResult]:
 def try_tesseract(image_paths: list[str]) -> Optional[OCRResult]:
     print("Engine: Attempting Tesseract...")
     try:
-        full_text = ""
-        for i, path in enumerate(image_paths):
-            text = pytesseract.image_to_string(Image.open(path))
-            full_text += text + "\n"
+        full_text = run_ocr_task(tesseract_extract, image_paths)
 
         if full_text.strip():
             return OCRResult(
@@ -58,19 +61,11 @@ def try_tesseract(image_paths: list[str]) -> Optional[OCRResult]:
         print(f"Tesseract failed: {e}")
         return None
 
-reader = None
 def try_easyocr(image_paths: list[str]) -> Optional[OCRResult]:
     print("Engine: Attempting EasyOCR...")
-    global reader
-    if reader is None:
-        reader = easyocr.Reader(['en']) # Initialize only once
-
     try:
-        full_text = ""
-        for i, path in enumerate(image_paths):
-            result = reader.readtext(path)
-            text = " ".join([item[1] for item in result])
-            full_text += text + "\n"
+        # The reader is loaded once per OCR worker process (see ocr_executor).
+        full_text = run_ocr_task(easyocr_extract, image_paths)
 
         if full_text.strip():
             return OCRResult(
@@ -83,23 +78,203 @@ def try_easyocr(image_paths: list[str]) -> Optional[OCRResult]:
         print(f"EasyOCR failed: {e}")
         return None
 
-# ... (The rest of the file, including run_image_ocr_cascade and run_cascading_ocr, remains the same)
+# --- Cascade ---
+
+# Engines in cascade order with the confidence each must reach to be accepted.
+IMAGE_ENGINE_THRESHOLDS = [("typhoon", 0.8), ("gpt_vision", 0.75), ("azure", 0.75), ("tesseract", 0.6), ("easyocr", 0.0)]
+
+# Bump when extraction logic changes in a way that should invalidate cached results.
+OCR_PIPELINE_VERSION = "2"
+
+def _engine_functions():
+    # Resolved at call time so the engines can be patched individually.
+    return {"typhoon": try_typhoon_ocr, "gpt_vision": try_gpt_vision, "azure": try_azure_docint, "tesseract": try_tesseract, "easyocr": try_easyocr}
+
+def _engine_config(ext: str) -> dict:
+    """Everything besides the file bytes that can change the OCR output."""
+    from invoice_core_processor.services.image_preprocessing import PREPROCESSING_VERSION
+    settings = get_settings()
+    return {
+        "version": OCR_PIPELINE_VERSION,
+        "ext": ext,
+        "engines": IMAGE_ENGINE_THRESHOLDS,
+        "typhoon_model": settings.TYPHOON_MODEL,
+        "gpt4_vision_model": settings.GPT4_VISION_MODEL,
+        "easyocr_languages": settings.EASYOCR_LANGUAGES,
+        "pdf_raster_resolution": settings.PDF_RASTER_RESOLUTION,
+        "cascade_mode": settings.OCR_CASCADE_MODE,
+        "preprocessing": PREPROCESSING_VERSION if settings.OCR_PREPROCESS_ENABLED else None,
+        "preprocess_max_side": settings.OCR_PREPROCESS_MAX_SIDE,
+        "preprocess_deskew": settings.OCR_PREPROCESS_DESKEW,
+        "preprocess_binarize": settings.OCR_PREPROCESS_BINARIZE,
+    }
+
 def run_image_ocr_cascade(image_paths: list[str]) -> OCRResult:
-    trace = {}
-    engines = [("typhoon", try_typhoon_ocr, 0.8), ("gpt_vision", try_gpt_vision, 0.75), ("azure", try_azure_docint, 0.75), ("tesseract", try_tesseract, 0.6), ("easyocr", try_easyocr, 0.0)]
+    """
+    Runs the image engines until one clears its confidence threshold.
+
+    In "sequential" mode engines run strictly one after another. In "parallel"
+    mode the top OCR_CASCADE_PARALLEL_ENGINES start at once, and in "hedged"
+    mode the next engine starts whenever the running ones exceed
+    OCR_CASCADE_HEDGE_DELAY_SECONDS. Either way the first accepted result wins
+    and engines not yet started are cancelled; those already running finish in
+    the background and are still recorded. Hedging into the OCR process pool
+    pauses while such leftover runs occupy every worker.
+
+    With OCR_ADAPTIVE_ORDERING, engines are reordered per file extension and
+    image size from the outcomes recorded in ocr_stats. With OCR_PREPROCESS_ENABLED
+    the engines receive downscaled, deskewed, binarised copies of the images.
+    """
+    settings = get_settings()
+    functions = _engine_functions()
+    engines = [(name, functions[name], threshold) for name, threshold in IMAGE_ENGINE_THRESHOLDS]
+
+    stats = get_ocr_engine_stats() if settings.OCR_ADAPTIVE_ORDERING else None
+    ext, size_bucket = describe_image(image_paths[0]) if image_paths else ("unknown", "unknown")
+    if stats is not None:
+        engines = stats.order(engines, ext, size_bucket)
+    if settings.OCR_PREPROCESS_ENABLED:
+        from invoice_core_processor.services.image_preprocessing import preprocess_image
+        image_paths = [preprocess_image(path) for path in image_paths]
+
+    def record(name: str, threshold: float, result: Optional[OCRResult], elapsed: float):
+        if stats is not None:
+            accepted = result is not None and result.avg_confidence >= threshold
+            stats.record(name, ext, size_bucket, accepted, result.avg_confidence if result else 0.0, elapsed)
+
+    trace = {"timings": {}, "engine_order": [name for name, _, _ in engines]}
+    mode = settings.OCR_CASCADE_MODE
+    if mode == "parallel":
+        return _run_concurrent_cascade(engines, image_paths, settings.OCR_CASCADE_PARALLEL_ENGINES, None, trace, record)
+    if mode == "hedged":
+        return _run_concurrent_cascade(engines, image_paths, 1, settings.OCR_CASCADE_HEDGE_DELAY_SECONDS, trace, record)
+    if mode != "sequential":
+        print(f"Unknown OCR_CASCADE_MODE '{mode}', falling back to sequential.")
+
     for name, engine_func, threshold in engines:
         trace[name] = "attempted"
-        result = engine_func(image_paths)
+        result, elapsed = _timed_engine(engine_func, image_paths)
+        trace["timings"][name] = elapsed
+        record(name, threshold, result, elapsed)
         if result and result.avg_confidence >= threshold:
             trace[name] = "success"; result.raw_engine_trace.update(trace); return result
     trace["final_status"] = "all engines failed"
     return OCRResult(status="FAILED_OCR", avg_confidence=0.0, pages=[], tables=[], raw_engine_trace=trace)
 
+def _timed_engine(engine_func, image_paths: list[str]) -> Tuple[Optional[OCRResult], float]:
+    started = time.monotonic()
+    try:
+        result = engine_func(image_paths)
+    except Exception as e:
+        print(f"OCR engine raised: {e}")
+        result = None
+    return result, round(time.monotonic() - started, 4)
+
+# Engines that run in the shared OCR process pool (see ocr_executor).
+POOL_ENGINES = {"tesseract", "easyocr"}
+
+# Pool-engine runs still going after their cascade returned. Running engines
+# cannot be interrupted, so hedging into the pool pauses while these fill it.
+_abandoned_pool_runs = 0
+_abandoned_lock = threading.Lock()
+
+def _may_hedge(name: str) -> bool:
+    workers = ocr_worker_count()
+    return name not in POOL_ENGINES or workers <= 0 or _abandoned_pool_runs < workers
+
+def _abandon(future: Future, name: str, threshold: float, record):
+    """Records the outcome of an engine that outlived its cascade once it finishes."""
+    global _abandoned_pool_runs
+    pooled = name in POOL_ENGINES
+    if pooled:
+        with _abandoned_lock:
+            _abandoned_pool_runs += 1
+
+    def finished(f: Future):
+        global _abandoned_pool_runs
+        if pooled:
+            with _abandoned_lock:
+                _abandoned_pool_runs -= 1
+        if not f.cancelled():
+            result, elapsed = f.result()
+            record(name, threshold, result, elapsed)
+
+    future.add_done_callback(finished)
+
+def _run_concurrent_cascade(engines, image_paths: list[str], initial: int, hedge_delay: Optional[float], trace: dict, record) -> OCRResult:
+    priority = {name: i for i, (name, _, _) in enumerate(engines)}
+    remaining = deque(engines)
+    running: Dict[Future, Tuple[str, float]] = {}
+    pool = ThreadPoolExecutor(max_workers=len(engines), thread_name_prefix="ocr-cascade")
+
+    def launch():
+        name, engine_func, threshold = remaining.popleft()
+        trace[name] = "attempted"
+        running[pool.submit(_timed_engine, engine_func, image_paths)] = (name, threshold)
+
+    try:
+        for _ in range(max(1, min(initial, len(remaining)))):
+            launch()
+        while running:
+            hedging = hedge_delay is not None and remaining and _may_hedge(remaining[0][0])
+            done, _ = wait(running, timeout=hedge_delay if hedging else None, return_when=FIRST_COMPLETED)
+            if not done:
+                launch()  # latency budget exceeded: hedge with the next engine
+                continue
+            # Prefer the highest-priority engine among those that finished together.
+            for future in sorted(done, key=lambda f: priority[running[f][0]]):
+                name, threshold = running.pop(future)
+                result, elapsed = future.result()
+                trace["timings"][name] = elapsed
+                record(name, threshold, result, elapsed)
+                if result and result.avg_confidence >= threshold:
+                    trace[name] = "success"
+                    for other in running.values():
+                        trace[other[0]] = "cancelled"
+                    result.raw_engine_trace.update(trace)
+                    return result
+                trace[name] = "failed"
+            while remaining and len(running) < max(1, initial):
+                launch()
+    finally:
+        # Engines already running cannot be interrupted; their outcomes are
+        # still recorded when they finish so ocr_stats sees every run.
+        for future, (name, threshold) in running.items():
+            _abandon(future, name, threshold, record)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    trace["final_status"] = "all engines failed"
+    return OCRResult(status="FAILED_OCR", avg_confidence=0.0, pages=[], tables=[], raw_engine_trace=trace)
+
 def run_cascading_ocr(file_path: str, file_extension: str) -> OCRResult:
+    """
+    Extracts text from a document, reusing a cached result when the same file
+    bytes have already been processed with the current engine configuration.
+    """
     ext = file_extension.lower().strip(".")
+    cache = get_ocr_cache()
+    key = None
+    if cache is not None:
+        try:
+            key = cache.make_key(file_path, _engine_config(ext))
+        except OSError:
+            key = None
+        cached = cache.get(key) if key else None
+        if cached is not None:
+            result = OCRResult(**cached)
+            result.raw_engine_trace["cache"] = "hit"
+            return result
+
+    result = _run_uncached_ocr(file_path, ext)
+    if key and result.status == "OCR_DONE":
+        cache.put(key, result.dict())
+    if cache is not None:
+        result.raw_engine_trace["cache"] = "miss"
+    return result
+
+def _run_uncached_ocr(file_path: str, ext: str) -> OCRResult:
     if ext == "pdf":
-        # ... (PDF logic)
-        return OCRResult(status="OCR_DONE", avg_confidence=0.95, pages=[], tables=[], raw_engine_trace={"engine": "pdfplumber"})
+        return extract_pdf(file_path)
     elif ext == "docx":
         # ... (DOCX logic)
         return OCRResult(status="OCR_DONE", avg_confidence=0.98, pages=[], tables=[], raw_engine_trace={"engine": "python-docx"})
@@ -107,3 +282,87 @@ def run_cascading_ocr(file_path: str, file_extension: str) -> OCRResult:
         return run_image_ocr_cascade([file_path])
     else:
         return OCRResult(status="FAILED_OCR", avg_confidence=0.0, pages=[], tables=[], raw_engine_trace={"error": f"Unsupported file extension: {ext}"})
+
+# --- PDF ---
+
+# Pages with fewer extractable characters than this are treated as scanned images.
+PDF_TEXT_LAYER_MIN_CHARS = 10
+PDF_TEXT_LAYER_CONFIDENCE = 0.95
+
+PDFPage = Tuple[PageResult, List[TableResult], float, str]
+
+def _text_layer_page(page, page_number: int, text: str) -> PDFPage:
+    tables = [
+        {"page_number": page_number, "cells": [[cell or "" for cell in row] for row in table]}
+        for table in page.extract_tables()
+    ]
+    return {"page_number": page_number, "text": text}, tables, PDF_TEXT_LAYER_CONFIDENCE, "text_layer"
+
+def _ocr_page(image_path: str, page_number: int) -> PDFPage:
+    result = run_image_ocr_cascade([image_path])
+    text = "\n".join(p["text"] for p in result.pages)
+    engine = result.raw_engine_trace.get("engine", "failed")
+    return {"page_number": page_number, "text": text}, [], result.avg_confidence, engine
+
+def iter_pdf_pages(file_path: str) -> Iterator[PDFPage]:
+    """
+    Yields (page, tables, confidence, source) for every page of a PDF, in order.
+
+    The document is opened once. Pages with a text layer are read directly by
+    pdfplumber; image-only pages are rasterised and sent through the image OCR
+    cascade on a thread pool, so several scanned pages are OCR'd at once while
+    earlier pages are already being yielded.
+    """
+    import pdfplumber  # deferred: only PDF processing needs it
+    settings = get_settings()
+    pending: deque = deque()
+    with tempfile.TemporaryDirectory(prefix="pdf-ocr-") as tmp_dir, \
+            ThreadPoolExecutor(max_workers=settings.PDF_OCR_PAGE_CONCURRENCY) as pool, \
+            pdfplumber.open(file_path) as pdf:
+        for page_number, page in enumerate(pdf.pages, start=1):
+            text = page.extract_text() or ""
+            if len(text.strip()) >= PDF_TEXT_LAYER_MIN_CHARS:
+                pending.append(_text_layer_page(page, page_number, text))
+            else:
+                # Rasterising touches the shared document, so it stays on this thread.
+                image_path = os.path.join(tmp_dir, f"page-{page_number}.png")
+                page.to_image(resolution=settings.PDF_RASTER_RESOLUTION).save(image_path)
+                pending.append(pool.submit(_ocr_page, image_path, page_number))
+
+            while pending and (not isinstance(pending[0], Future) or pending[0].done()):
+                yield _page_value(pending.popleft())
+
+        while pending:
+            yield _page_value(pending.popleft())
+
+def _page_value(entry) -> PDFPage:
+    return entry.result() if isinstance(entry, Future) else entry
+
+def extract_pdf(file_path: str) -> OCRResult:
+    pages: List[PageResult] = []
+    tables: List[TableResult] = []
+    confidences: List[float] = []
+    sources: Dict[str, str] = {}
+    try:
+        for page, page_tables, confidence, source in iter_pdf_pages(file_path):
+            pages.append(page)
+            tables.extend(page_tables)
+            confidences.append(confidence)
+            sources[str(page["page_number"])] = source
+    except Exception as e:
+        print(f"PDF extraction failed: {e}")
+        return OCRResult(status="FAILED_OCR", avg_confidence=0.0, pages=[], tables=[], raw_engine_trace={"engine": "pdfplumber", "error": str(e)})
+
+    trace = {
+        "engine": "pdfplumber",
+        "text_layer_pages": sum(1 for s in sources.values() if s == "text_layer"),
+        "ocr_pages": sum(1 for s in sources.values() if s != "text_layer"),
+        "page_sources": sources,
+    }
+    if not any(p["text"].strip() for p in pages):
+        trace["final_status"] = "no text extracted"
+        return OCRResult(status="FAILED_OCR", avg_confidence=0.0, pages=pages, tables=tables, raw_engine_trace=trace)
+    return OCRResult(
+        status="OCR_DONE", avg_confidence=sum(confidences) / len(confidences),
+        pages=pages, tables=tables, raw_engine_trace=trace
+    )
@@ -0,0 +1,107 @@
+# services/ocr_stats.py
+
+import os
+import threading
+from collections import defaultdict, deque
+from functools import lru_cache
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from invoice_core_processor.config.settings import get_settings
+
+# Image size buckets in megapixels; phone photos usually land in the last one.
+SIZE_BUCKETS = [(1.0, "<1MP"), (4.0, "1-4MP"), (12.0, "4-12MP")]
+LARGEST_BUCKET = ">=12MP"
+
+Outcome = Tuple[bool, float, float]  # (accepted, confidence, latency seconds)
+
+def describe_image(image_path: str) -> Tuple[str, str]:
+    """Returns the (extension, size bucket) slice an image falls into."""
+    ext = os.path.splitext(image_path)[1].lower().strip(".") or "unknown"
+    try:
+        from PIL import Image
+        with Image.open(image_path) as image:  # reads the header only
+            megapixels = image.width * image.height / 1_000_000
+    except Exception:
+        return ext, "unknown"
+    for limit, label in SIZE_BUCKETS:
+        if megapixels < limit:
+            return ext, label
+    return ext, LARGEST_BUCKET
+
+
+class OCREngineStats:
+    """
+    Rolling per-engine outcomes of the OCR cascade, sliced by file extension
+    and image size.
+
+    Each slice keeps the last `window` outcomes per engine. Once an engine has
+    `min_samples` outcomes in a slice it is ranked by expected latency per
+    accepted result, so engines that rarely clear their threshold for our
+    document mix stop running first.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._outcomes: Dict[Tuple[str, str, str], Deque[Outcome]] = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def record(self, engine: str, ext: str, size_bucket: str, accepted: bool, confidence: float, latency: float):
+        with self._lock:
+            self._outcomes[(engine, ext, size_bucket)].append((accepted, confidence, latency))
+
+    def expected_cost(self, engine: str, ext: str, size_bucket: str) -> Optional[float]:
+        """Mean latency divided by the (smoothed) acceptance rate, or None if under-sampled."""
+        with self._lock:
+            outcomes = list(self._outcomes.get((engine, ext, size_bucket), ()))
+        if len(outcomes) < self.min_samples:
+            return None
+        accepted = sum(1 for ok, _, _ in outcomes if ok)
+        success_rate = (accepted + 1) / (len(outcomes) + 2)
+        mean_latency = sum(latency for _, _, latency in outcomes) / len(outcomes)
+        return mean_latency / success_rate
+
+    def order(self, engines: Sequence[tuple], ext: str, size_bucket: str) -> List[tuple]:
+        """
+        Reorders (name, func, threshold) engine tuples for a slice.
+
+        Engines with enough samples are sorted by expected cost into the
+        positions they already occupy; under-sampled engines keep their place.
+        Last-resort engines (threshold 0.0) always stay at the end, since they
+        accept any output.
+        """
+        engines = list(engines)
+        ranked = [i for i, engine in enumerate(engines) if engine[2] > 0.0 and self.expected_cost(engine[0], ext, size_bucket) is not None]
+        by_cost = sorted((engines[i] for i in ranked), key=lambda e: self.expected_cost(e[0], ext, size_bucket))
+        for slot, engine in zip(ranked, by_cost):
+            engines[slot] = engine
+        return engines
+
+    def snapshot(self) -> List[dict]:
+        """Per-engine, per-slice summary for inspection."""
+        with self._lock:
+            items = [(key, list(outcomes)) for key, outcomes in self._outcomes.items()]
+        summary = []
+        for (engine, ext, size_bucket), outcomes in sorted(items):
+            count = len(outcomes)
+            summary.append({
+                "engine": engine,
+                "file_extension": ext,
+                "size_bucket": size_bucket,
+                "samples": count,
+                "success_rate": round(sum(1 for ok, _, _ in outcomes if ok) / count, 4),
+                "mean_confidence": round(sum(conf for _, conf, _ in outcomes) / count, 4),
+                "mean_latency_seconds": round(sum(lat for _, _, lat in outcomes) / count, 4),
+                "expected_cost": self.expected_cost(engine, ext, size_bucket),
+            })
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._outcomes.clear()
+
+
+@lru_cache()
+def get_ocr_engine_stats() -> OCREngineStats:
+    settings = get_settings()
+    return OCREngineStats(window=settings.OCR_STATS_WINDOW, min_samples=settings.OCR_STATS_MIN_SAMPLES)
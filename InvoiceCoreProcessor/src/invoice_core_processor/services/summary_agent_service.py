@@ -1,11 +1,13 @@
 from typing import Dict, Any
+from functools import lru_cache
 import json
-import google.generativeai as genai
 from invoice_core_processor.prompts.summary_prompt import INVOICE_VALIDATION_SUMMARY_PROMPT
 from invoice_core_processor.config.settings import get_settings
 
 class LlmClient:
     def __init__(self, model_name: str):
+        # Imported here so processes that never summarise do not pay for the SDK.
+        import google.generativeai as genai
         self.model_name = model_name
         settings = get_settings()
         genai.configure(api_key=settings.GEMINI_API_KEY)
@@ -62,3 +64,8 @@ class SummaryAgentService:
         Formats the prompt for the LLM.
         """
         return f"{INVOICE_VALIDATION_SUMMARY_PROMPT}\n\nHere is the latest invoice state JSON. Generate the summary as per the instructions.\n\n```json\n{json.dumps(invoice_data, indent=2)}\n```"
+
+
+@lru_cache()
+def get_summary_agent_service() -> SummaryAgentService:
+    return SummaryAgentService()
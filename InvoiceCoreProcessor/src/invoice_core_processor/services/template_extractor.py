@@ -0,0 +1,327 @@
+# services/template_extractor.py
+
+# Rule-based fast path in front of the LLM mapper. Most invoices come from
+# recurring vendors with fixed templates, so after the LLM has mapped a few of
+# a vendor's invoices we learn where each field sits (the label it follows)
+# and extract later invoices with compiled regexes instead.
+
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from invoice_core_processor.config.settings import get_settings
+
+GSTIN_PATTERN = r"\d{2}[A-Z]{5}\d{4}[A-Z][A-Z\d]Z[A-Z\d]"
+GSTIN_RE = re.compile(GSTIN_PATTERN)
+NUMBER_PATTERN = r"-?\d[\d,]*(?:\.\d+)?"
+DATE_PATTERN = r"\d{1,4}[./-]\d{1,2}[./-]\d{1,4}|\d{1,2}[ -][A-Za-z]{3,9}[ -]\d{4}"
+ID_PATTERN = r"[A-Za-z0-9][A-Za-z0-9/_.-]*"
+
+# Canonical fields we learn rules for: dotted path -> value type.
+FIELD_TYPES = {
+    "invoiceNumber": "id",
+    "invoiceDate": "date",
+    "dueDate": "date",
+    "vendor.gstin": "gstin",
+    "totals.subtotal": "number",
+    "totals.gstAmount": "number",
+    "totals.roundOff": "number",
+    "totals.grandTotal": "number",
+}
+VALUE_PATTERNS = {"id": ID_PATTERN, "date": DATE_PATTERN, "gstin": GSTIN_PATTERN, "number": NUMBER_PATTERN}
+REQUIRED_FIELDS = ["invoiceNumber", "invoiceDate", "totals.grandTotal"]
+# Vendor details that do not change between invoices of the same template.
+STATIC_VENDOR_FIELDS = ["name", "gstin", "pan", "address"]
+
+DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%m/%d/%Y", "%d/%m/%y", "%d-%b-%Y", "%d %b %Y", "%d %B %Y", "%b %d, %Y"]
+
+# description qty unit-price tax% amount
+LINE_ITEM_RE = re.compile(
+    r"^\s*(?P<description>[A-Za-z][^\n]*?)\s+(?P<quantity>\d+(?:\.\d+)?)\s+(?P<unitPrice>[\d,]+\.\d{2})\s+"
+    r"(?P<taxPercent>\d+(?:\.\d+)?)%?\s+(?P<amount>[\d,]+\.\d{2})\s*$",
+    re.MULTILINE,
+)
+AMOUNT_TOLERANCE = 0.01
+
+def _parse_number(text: str) -> Optional[float]:
+    try:
+        return float(text.replace(",", ""))
+    except (TypeError, ValueError):
+        return None
+
+def _parse_date(text: str) -> Optional[Tuple[datetime, str]]:
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), fmt), fmt
+        except ValueError:
+            continue
+    return None
+
+def _get_path(data: Dict[str, Any], path: str):
+    for part in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+def _set_path(data: Dict[str, Any], path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        data = data.setdefault(part, {})
+    data[parts[-1]] = value
+
+def _empty_schema() -> Dict[str, Any]:
+    return {
+        "invoiceNumber": None, "invoiceDate": None, "dueDate": None,
+        "vendor": {"name": None, "gstin": None, "pan": None, "address": None},
+        "customer": {"name": None, "address": None},
+        "lineItems": [],
+        "totals": {"subtotal": None, "gstAmount": None, "roundOff": None, "grandTotal": None},
+        "paymentDetails": {"mode": None, "reference": None, "status": None},
+    }
+
+def layout_fingerprint(text: str, lines: int = 5) -> str:
+    """Hash of the first header lines with digits masked, for vendors without a GSTIN."""
+    header = [re.sub(r"\d", "#", re.sub(r"\s+", " ", line.strip().lower())) for line in text.splitlines() if line.strip()][:lines]
+    return "layout:" + hashlib.sha256("\n".join(header).encode("utf-8")).hexdigest()[:16]
+
+def parse_line_items(text: str) -> List[Dict[str, Any]]:
+    return [
+        {
+            "description": match["description"].strip(),
+            "quantity": float(match["quantity"]),
+            "unitPrice": _parse_number(match["unitPrice"]),
+            "taxPercent": float(match["taxPercent"]),
+            "amount": _parse_number(match["amount"]),
+        }
+        for match in LINE_ITEM_RE.finditer(text)
+    ]
+
+
+class TemplateExtractor:
+    """
+    Learns per-vendor extraction rules from LLM mappings and applies them.
+
+    A template is identified by the vendor's GSTIN (or, failing that, a layout
+    fingerprint of the header). For each field it stores the label that
+    precedes the value on its line; a rule is only used once it has been
+    confirmed by `min_confirmations` LLM mappings, and is dropped as soon as an
+    LLM mapping disagrees with it. Extractions that miss a required field or
+    fail the totals cross-checks are rejected so the LLM handles them.
+    """
+
+    def __init__(self, store_path: Optional[str] = None, min_confirmations: int = 2, min_confidence: float = 0.9):
+        self.store_path = store_path
+        self.min_confirmations = min_confirmations
+        self.min_confidence = min_confidence
+        self._lock = threading.Lock()
+        self._templates: Dict[str, Dict[str, Any]] = self._load()
+        self._compiled: Dict[Tuple[str, str], re.Pattern] = {}
+
+    # --- Extraction ---
+
+    def extract(self, text: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns {"mapped_schema", "confidence", "template_id"} for a known,
+        confirmed template, or None if the LLM should handle the text.
+        """
+        template_id, template = self._find_template(text)
+        if template is None:
+            return None
+        rules = {field: rule for field, rule in template["rules"].items() if rule["confirmations"] >= self.min_confirmations}
+        if not all(field in rules for field in REQUIRED_FIELDS):
+            return None
+
+        mapped = _empty_schema()
+        for name in STATIC_VENDOR_FIELDS:
+            mapped["vendor"][name] = template["vendor"].get(name)
+        matched = 0
+        for field, rule in rules.items():
+            value = self._apply_rule(field, rule, text)
+            if value is not None:
+                _set_path(mapped, field, value)
+                matched += 1
+        if template.get("line_items") and template["line_items"]["confirmations"] >= self.min_confirmations:
+            mapped["lineItems"] = parse_line_items(text)
+
+        confidence = matched / len(rules)
+        if any(_get_path(mapped, field) is None for field in REQUIRED_FIELDS) or not self._totals_consistent(mapped):
+            confidence = min(confidence, 0.5)
+        if confidence < self.min_confidence:
+            return None
+        return {"mapped_schema": mapped, "confidence": round(confidence, 4), "template_id": template_id}
+
+    def _apply_rule(self, field: str, rule: Dict[str, Any], text: str):
+        kind = FIELD_TYPES[field]
+        key = (field, rule["anchor"])
+        pattern = self._compiled.get(key)
+        if pattern is None:
+            pattern = re.compile(r"(?<![A-Za-z])" + re.escape(rule["anchor"]) + r"\s*[:#.\-]*\s*(" + VALUE_PATTERNS[kind] + r")", re.MULTILINE)
+            self._compiled[key] = pattern
+        match = pattern.search(text)
+        if not match:
+            return None
+        raw = match.group(1)
+        if kind == "number":
+            return _parse_number(raw)
+        if kind == "date":
+            parsed = _parse_date(raw)
+            if parsed is None:
+                return None
+            return parsed[0].strftime(rule.get("output_format") or "%Y-%m-%d")
+        return raw
+
+    @staticmethod
+    def _totals_consistent(mapped: Dict[str, Any]) -> bool:
+        totals = mapped["totals"]
+        subtotal, gst, round_off, grand = totals["subtotal"], totals["gstAmount"], totals["roundOff"], totals["grandTotal"]
+        if subtotal is not None and gst is not None and grand is not None:
+            if abs(subtotal + gst + (round_off or 0.0) - grand) > 1.0:
+                return False
+        if mapped["lineItems"] and subtotal is not None:
+            if abs(sum(item["amount"] or 0.0 for item in mapped["lineItems"]) - subtotal) > 1.0:
+                return False
+        return True
+
+    def _find_template(self, text: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        candidates = [f"gstin:{gstin}" for gstin in dict.fromkeys(GSTIN_RE.findall(text))] + [layout_fingerprint(text)]
+        with self._lock:
+            for template_id in candidates:
+                if template_id in self._templates:
+                    # A copy, so extract() can read it while learn() updates the original.
+                    return template_id, copy.deepcopy(self._templates[template_id])
+        return None, None
+
+    # --- Learning ---
+
+    def learn(self, text: str, mapped: Dict[str, Any]):
+        """Updates the vendor's template from a trusted (LLM) mapping of the text."""
+        vendor_gstin = _get_path(mapped, "vendor.gstin")
+        template_id = f"gstin:{vendor_gstin}" if vendor_gstin and vendor_gstin in text else layout_fingerprint(text)
+
+        with self._lock:
+            template = self._templates.setdefault(template_id, {"vendor": {}, "rules": {}, "line_items": None, "samples": 0})
+            template["samples"] += 1
+            template["vendor"] = {name: _get_path(mapped, f"vendor.{name}") for name in STATIC_VENDOR_FIELDS}
+
+            for field, kind in FIELD_TYPES.items():
+                expected = _get_path(mapped, field)
+                rule = template["rules"].get(field)
+                if rule is not None:
+                    if expected is not None and self._values_match(kind, self._apply_rule(field, rule, text), self._normalise_expected(kind, expected, rule)):
+                        rule["confirmations"] += 1
+                    else:
+                        del template["rules"][field]  # the LLM disagrees; relearn from scratch
+                    continue
+                if expected is not None:
+                    learned = self._learn_rule(kind, expected, text)
+                    if learned is not None:
+                        template["rules"][field] = learned
+
+            expected_items = mapped.get("lineItems") or []
+            parsed_items = parse_line_items(text)
+            items_match = bool(expected_items) and len(parsed_items) == len(expected_items) and all(
+                abs((parsed["amount"] or 0.0) - float(expected.get("amount") or 0.0)) <= AMOUNT_TOLERANCE
+                for parsed, expected in zip(parsed_items, expected_items)
+            )
+            if items_match:
+                current = template.get("line_items") or {"confirmations": 0}
+                template["line_items"] = {"confirmations": current["confirmations"] + 1}
+            elif expected_items:
+                template["line_items"] = None
+
+            self._save()
+
+    @staticmethod
+    def _values_match(kind: str, actual, expected) -> bool:
+        if actual is None or expected is None:
+            return False
+        if kind == "number":
+            return abs(actual - expected) <= AMOUNT_TOLERANCE
+        return actual == expected
+
+    @staticmethod
+    def _normalise_expected(kind: str, expected, rule: Dict[str, Any]):
+        if kind == "number":
+            return _parse_number(str(expected))
+        if kind == "date":
+            parsed = _parse_date(str(expected))
+            return parsed[0].strftime(rule.get("output_format") or "%Y-%m-%d") if parsed else None
+        return str(expected)
+
+    def _learn_rule(self, kind: str, expected, text: str) -> Optional[Dict[str, Any]]:
+        """Finds the expected value in the text and records the label before it."""
+        output_format = None
+        if kind == "date":
+            parsed = _parse_date(str(expected))
+            if parsed is None:
+                return None
+            expected_date, output_format = parsed
+        for line in text.splitlines():
+            for match in re.finditer(VALUE_PATTERNS[kind], line):
+                raw = match.group(0)
+                if kind == "number":
+                    value = _parse_number(raw)
+                    found = value is not None and abs(value - float(expected)) <= AMOUNT_TOLERANCE
+                elif kind == "date":
+                    parsed = _parse_date(raw)
+                    found = parsed is not None and parsed[0] == expected_date
+                else:
+                    found = raw == str(expected)
+                if not found:
+                    continue
+                # The label is the last column before the value: "Due Date" in
+                # "Date: 01/01/2024    Due Date: 31/01/2024".
+                label = re.split(r"\s{2,}|\t|\|", line[:match.start()].rstrip(" :#.-\t"))[-1]
+                anchor = label.strip()[-40:].strip()
+                if re.search(r"[A-Za-z]", anchor):
+                    return {"anchor": anchor, "confirmations": 1, "output_format": output_format}
+        return None
+
+    # --- Persistence ---
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not self.store_path or not os.path.exists(self.store_path):
+            return {}
+        try:
+            with open(self.store_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not load invoice templates: {e}")
+            return {}
+
+    def _save(self):
+        if not self.store_path:
+            return
+        directory = os.path.dirname(self.store_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.store_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._templates, f)
+            os.replace(tmp_path, self.store_path)
+        except OSError as e:
+            print(f"Could not save invoice templates: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+@lru_cache()
+def get_template_extractor() -> Optional[TemplateExtractor]:
+    """Returns the process-wide template extractor, or None if disabled."""
+    settings = get_settings()
+    if not settings.TEMPLATE_EXTRACTOR_ENABLED:
+        return None
+    return TemplateExtractor(
+        store_path=settings.TEMPLATE_STORE_PATH,
+        min_confirmations=settings.TEMPLATE_MIN_CONFIRMATIONS,
+        min_confidence=settings.TEMPLATE_MIN_CONFIDENCE,
+    )
@@ -0,0 +1,176 @@
+# services/text_compaction.py
+
+# Shrinks OCR text before it goes into the mapping prompt: page headers and
+# footers repeated on every page are kept once, whitespace runs are collapsed,
+# known boilerplate is dropped and, if the text is still over the token
+# budget, prose is cut before table rows and labelled fields.
+
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+# Pages of extracted_text are separated by form feeds (see core/workflow.py).
+PAGE_SEPARATOR = "\f"
+
+# Bump when the compaction rules change; it is part of the mapping cache key.
+COMPACTION_VERSION = "2"
+
+# Lines within this many non-empty lines of a page's top or bottom are header/footer candidates.
+HEADER_FOOTER_LINES = 3
+
+BOILERPLATE_LINE_PATTERNS = [re.compile(p, re.IGNORECASE) for p in [
+    r"page\s*\d+\s*(?:of|/)\s*\d+",
+    r"this is an? (?:computer|system)[ -]generated (?:invoice|document|bill).*",
+    r"e\.?\s*&\s*o\.?\s*e\.?",
+    r"subject to .*jurisdiction\.?",
+    r"thank you for (?:your business|shopping with us)[.!]?",
+    r"for any (?:queries|questions|clarifications?)\b.*",
+]]
+# These blocks run until the next blank line.
+BOILERPLATE_BLOCK_PATTERNS = [re.compile(p, re.IGNORECASE) for p in [
+    r"declaration\s*:?.*",
+]]
+
+# Lines worth keeping when truncating, besides table rows.
+KEY_FIELD_RE = re.compile(r"invoice|bill\s*(?:no|date)|date|due|gstin|pan\b|total|tax|gst|amount|balance|payable", re.IGNORECASE)
+# Standalone amounts and quantities, not digits inside IDs, GSTINs or dates.
+NUMBER_RE = re.compile(r"(?<![\w./-])\d[\d,]*(?:\.\d+)?%?(?![\w/-])")
+OMISSION_MARKER = "[...]"
+# Page numbers are the only numbers allowed to differ between repeated header/footer lines.
+PAGE_NUMBER_RE = re.compile(r"\bpage\s*\d+(?:\s*(?:of|/)\s*\d+)?\b", re.IGNORECASE)
+
+@lru_cache()
+def _encoder():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+def estimate_tokens(text: str) -> int:
+    """Token count with tiktoken if installed, otherwise ~4 characters per token."""
+    encoder = _encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+def _collapse_whitespace(line: str) -> str:
+    # A run of 2+ spaces or tabs usually separates columns; keep it as one tab.
+    line = re.sub(r"[ \t]{2,}", "\t", line.strip())
+    return re.sub(r"[^\S\t]+", " ", line)
+
+def _line_key(line: str) -> str:
+    # Any other number (totals, dates, amounts) makes the line distinct.
+    return PAGE_NUMBER_RE.sub("page #", line.lower())
+
+def _is_table_line(line: str) -> bool:
+    numbers = len(NUMBER_RE.findall(line))
+    return numbers >= 3 or (numbers >= 2 and "\t" in line)
+
+def _drop_boilerplate(lines: List[str]) -> Tuple[List[str], int]:
+    kept, dropped, in_block = [], 0, False
+    for line in lines:
+        if in_block:
+            if not line:
+                in_block = False
+                kept.append(line)
+            else:
+                dropped += 1
+            continue
+        if any(p.fullmatch(line) for p in BOILERPLATE_BLOCK_PATTERNS):
+            in_block = True
+            dropped += 1
+        elif any(p.fullmatch(line) for p in BOILERPLATE_LINE_PATTERNS):
+            dropped += 1
+        else:
+            kept.append(line)
+    return kept, dropped
+
+def _repeated_edge_lines(pages: List[List[str]]) -> set:
+    """Lines (page numbers masked) that sit at the top or bottom of at least half of the pages."""
+    if len(pages) < 2:
+        return set()
+    counts = Counter()
+    for lines in pages:
+        non_empty = [line for line in lines if line]
+        edges = non_empty[:HEADER_FOOTER_LINES] + non_empty[-HEADER_FOOTER_LINES:]
+        counts.update({_line_key(line) for line in edges})
+    needed = max(2, math.ceil(len(pages) / 2))
+    return {key for key, count in counts.items() if count >= needed}
+
+def _truncate(lines: List[str], budget: int) -> List[str]:
+    """
+    Keeps table rows (with the header row above each table) and labelled
+    fields first, then everything else in document order, until the budget
+    is spent. Gaps are marked so the model knows text was removed.
+    """
+    costs = [estimate_tokens(line) + 1 for line in lines]
+    priority = [_is_table_line(line) or bool(KEY_FIELD_RE.search(line)) for line in lines]
+    for i in range(len(lines) - 1):
+        if lines[i] and not priority[i] and _is_table_line(lines[i + 1]):
+            priority[i] = True  # column headings
+
+    selected, spent = set(), estimate_tokens(OMISSION_MARKER)
+    for wanted in (True, False):
+        for i, line in enumerate(lines):
+            if priority[i] == wanted and line and spent + costs[i] <= budget:
+                selected.add(i)
+                spent += costs[i]
+
+    output = []
+    for i, line in enumerate(lines):
+        if i in selected:
+            output.append(line)
+        elif line and (not output or output[-1] != OMISSION_MARKER):
+            output.append(OMISSION_MARKER)
+    return output
+
+def compact_text(text: str, token_budget: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    Returns (compacted text, stats). Stats carry the token counts before and
+    after, and how many lines each step removed. A budget of None or 0
+    disables truncation.
+    """
+    tokens_before = estimate_tokens(text)
+    pages = [[_collapse_whitespace(line) for line in page.splitlines()] for page in text.split(PAGE_SEPARATOR)]
+    lines_before = sum(1 for lines in pages for line in lines if line)
+
+    repeated = _repeated_edge_lines(pages)
+    seen, repeated_removed, boilerplate_removed, lines = set(), 0, 0, []
+    for page_lines in pages:
+        page_lines, dropped = _drop_boilerplate(page_lines)
+        boilerplate_removed += dropped
+        for line in page_lines:
+            key = _line_key(line)
+            # Table rows are never deduplicated: identical line items are separate purchases.
+            if line and key in repeated and not _is_table_line(line):
+                if key in seen:
+                    repeated_removed += 1
+                    continue
+                seen.add(key)
+            # Collapse runs of blank lines into one.
+            if line or (lines and lines[-1]):
+                lines.append(line)
+        if lines and lines[-1]:
+            lines.append("")
+    while lines and not lines[-1]:
+        lines.pop()
+
+    truncated = False
+    if token_budget and estimate_tokens("\n".join(lines)) > token_budget:
+        lines = _truncate(lines, token_budget)
+        truncated = True
+
+    compacted = "\n".join(lines)
+    stats = {
+        "tokens_before": tokens_before,
+        "tokens_after": estimate_tokens(compacted),
+        "lines_before": lines_before,
+        "lines_after": sum(1 for line in lines if line and line != OMISSION_MARKER),
+        "repeated_lines_removed": repeated_removed,
+        "boilerplate_lines_removed": boilerplate_removed,
+        "truncated": truncated,
+    }
+    return compacted, stats
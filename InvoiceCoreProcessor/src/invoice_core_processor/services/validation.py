@@ -1,7 +1,16 @@
-from typing import Dict, Any, List, Literal
+import copy
+from typing import Dict, Any, List, Literal, Optional
+
+from invoice_core_processor.services.duplicate_detection import InvoiceKey, get_duplicate_detector
+from invoice_core_processor.services.validation_rules import CompiledRule, get_validation_rule_registry, validation_rule
 
 # --- Validation Rule Definitions ---
 
+# Amounts further apart than this are a mismatch.
+AMOUNT_TOLERANCE = 0.01
+LOW_OCR_CONFIDENCE = 0.7
+INITIAL_SCORE = 100.0
+
 class ValidationResult:
     def __init__(self, rule_id: str, status: Literal['PASS', 'FAIL', 'WARN'], message: str, severity: int, deduction: float = 0.0):
         self.rule_id = rule_id; self.status = status; self.message = message; self.severity = severity; self.deduction = deduction
@@ -9,50 +18,83 @@ class ValidationResult:
         return {"rule_id": self.rule_id, "status": self.status, "message": self.message, "severity": self.severity, "deduction_points": self.deduction}
 
 # --- Rule Implementations ---
+# Each rule declares the schema fields it reads; it is skipped for invoices
+# that lack them. `severity` is the fallback when the rule table is unavailable.
 
+@validation_rule("LIT-004", inputs=["lineItems"], severity=5)
 def check_line_item_math(schema: Dict[str, Any]) -> ValidationResult:
     for i, item in enumerate(schema.get("lineItems", [])):
         qty = item.get("quantity", 0); price = item.get("unitPrice", 0); total = item.get("amount", 0)
-        if abs((qty * price) - total) > 0.01:
+        if abs((qty * price) - total) > AMOUNT_TOLERANCE:
             return ValidationResult("LIT-004", "FAIL", f"Line item {i+1} math incorrect.", 5, 20.0)
     return ValidationResult("LIT-004", "PASS", "Line item math correct.", 1)
 
+@validation_rule("TTL-001", inputs=["lineItems", "totals.subtotal"], severity=5)
 def check_subtotal(schema: Dict[str, Any]) -> ValidationResult:
     line_total = sum(item.get("amount", 0) for item in schema.get("lineItems", []))
     subtotal = schema.get("totals", {}).get("subtotal", 0)
-    if abs(line_total - subtotal) > 0.01:
+    if abs(line_total - subtotal) > AMOUNT_TOLERANCE:
         return ValidationResult("TTL-001", "FAIL", "Subtotal does not match sum of line items.", 5, 20.0)
     return ValidationResult("TTL-001", "PASS", "Subtotal is correct.", 1)
 
+@validation_rule("TTL-003", inputs=["totals.subtotal", "totals.grandTotal"], reads=["totals.gstAmount", "totals.roundOff"], severity=5)
 def check_grand_total(schema: Dict[str, Any]) -> ValidationResult:
     totals = schema.get("totals", {})
     calc_total = totals.get("subtotal", 0) + totals.get("gstAmount", 0) + totals.get("roundOff", 0)
-    if abs(calc_total - totals.get("grandTotal", 0)) > 0.01:
+    if abs(calc_total - totals.get("grandTotal", 0)) > AMOUNT_TOLERANCE:
         return ValidationResult("TTL-003", "FAIL", "Grand total does not match sum of subtotal, GST, and round-off.", 5, 20.0)
     return ValidationResult("TTL-003", "PASS", "Grand total is correct.", 1)
 
+@validation_rule("ANM-004", context=["ocr_confidence"], severity=3)
 def check_ocr_confidence(schema: Dict[str, Any], ocr_confidence: float) -> ValidationResult:
-    if ocr_confidence < 0.7:
+    if ocr_confidence < LOW_OCR_CONFIDENCE:
         return ValidationResult("ANM-004", "WARN", f"Low OCR confidence ({ocr_confidence:.2f}).", 3, 2.5)
     return ValidationResult("ANM-004", "PASS", "OCR confidence is acceptable.", 1)
 
 # ... (other rule placeholders)
+@validation_rule("INV-003", inputs=["invoiceDate"], severity=4)
 def check_invoice_date(schema: Dict[str, Any]) -> ValidationResult: return ValidationResult("INV-003", "PASS", "Date is valid.", 1)
-def check_duplicate(schema: Dict[str, Any]) -> ValidationResult: return ValidationResult("DUP-001", "PASS", "Invoice is unique.", 1)
 
-# --- Rule Engine ---
+@validation_rule("DUP-001", inputs=["invoiceNumber", "invoiceDate", "vendor"], context=["invoice_id"], severity=5)
+def check_duplicate(schema: Dict[str, Any], invoice_id: Optional[str] = None) -> ValidationResult:
+    key = InvoiceKey.from_schema(schema)
+    if key is None:
+        return duplicate_check_result(None)
+    try:
+        # An invoice that is already stored must not match itself.
+        return duplicate_check_result(key, get_duplicate_detector().find_duplicate(key, exclude_invoice_id=invoice_id))
+    except Exception as e:
+        return duplicate_check_result(key, error=e)
 
-def run_validation_checks(mapped_schema: Dict[str, Any], ocr_confidence: float = 1.0) -> Dict[str, Any]:
-    rules_to_run = [
-        check_line_item_math, check_subtotal, check_grand_total,
-        check_invoice_date, check_duplicate
-    ]
+def duplicate_check_result(key: Optional[InvoiceKey], duplicate_id: Optional[str] = None, error: Optional[Exception] = None) -> ValidationResult:
+    """The DUP-001 result for a lookup outcome; shared with the batch validator."""
+    if key is None:
+        return ValidationResult("DUP-001", "PASS", "Not enough vendor, number or date details to check for duplicates.", 1)
+    if error is not None:
+        return ValidationResult("DUP-001", "WARN", f"Duplicate check unavailable ({error}).", 5)
+    if duplicate_id is not None:
+        return ValidationResult("DUP-001", "FAIL", f"Duplicate of stored invoice {duplicate_id}.", 5, 20.0)
+    return ValidationResult("DUP-001", "PASS", "Invoice is unique.", 1)
 
-    results: List[ValidationResult] = [rule(mapped_schema) for rule in rules_to_run]
-    results.append(check_ocr_confidence(mapped_schema, ocr_confidence))
+# --- Rule Engine ---
+
+def run_validation_checks(
+    mapped_schema: Dict[str, Any],
+    ocr_confidence: float = 1.0,
+    plan: Optional[List[CompiledRule]] = None,
+    invoice_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Runs the active rules of the cached plan (compiled from the validation_rule
+    table) whose inputs are present in the schema, and scores the invoice.
+    """
+    if plan is None:
+        plan = get_validation_rule_registry().plan()
+    context = {"ocr_confidence": ocr_confidence, "invoice_id": invoice_id}
+    results: List[ValidationResult] = [rule(mapped_schema, context) for rule in plan if rule.applies(mapped_schema)]
 
     # Calculate score
-    initial_score = 100.0
+    initial_score = INITIAL_SCORE
     total_deductions = sum(res.deduction for res in results)
     final_score = max(0, initial_score - total_deductions)
 
@@ -63,3 +105,70 @@ def run_validation_checks(mapped_schema: Dict[str, Any], ocr_confidence: float =
         "overall_score": final_score,
         "validation_results": [res.to_dict() for res in results]
     }
+
+def apply_changes(mapped_schema: Dict[str, Any], changes: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns a copy of the schema with a field-level diff applied. Keys of
+    `changes` are dotted paths (list items by index, e.g. "lineItems.0.amount");
+    a value of None clears the field.
+    """
+    schema = copy.deepcopy(mapped_schema)
+    for path, value in changes.items():
+        parts = path.split(".")
+        target = schema
+        for part, next_part in zip(parts, parts[1:]):
+            child = target[int(part)] if isinstance(target, list) else target.get(part)
+            if child is None:
+                child = [] if next_part.isdigit() else {}
+                if isinstance(target, list):
+                    target[int(part)] = child
+                else:
+                    target[part] = child
+            target = child
+        if isinstance(target, list):
+            target[int(parts[-1])] = copy.deepcopy(value)
+        else:
+            target[parts[-1]] = copy.deepcopy(value)
+    return schema
+
+def revalidate(
+    mapped_schema: Dict[str, Any],
+    changes: Dict[str, Any],
+    previous_results: List[Dict[str, Any]],
+    ocr_confidence: float = 1.0,
+    plan: Optional[List[CompiledRule]] = None,
+    invoice_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Re-validates an edited invoice. Only the rules whose inputs or reads were
+    touched by `changes` (or that have no previous result) are run again; the
+    other results, and their deductions, are reused from `previous_results`.
+    Returns the same dict as run_validation_checks plus the edited
+    `mapped_schema` and the `rerun_rules`.
+    """
+    if plan is None:
+        plan = get_validation_rule_registry().plan()
+    schema = apply_changes(mapped_schema, changes)
+    previous = {r["rule_id"]: r for r in previous_results}
+    context = {"ocr_confidence": ocr_confidence, "invoice_id": invoice_id}
+
+    results, rerun = [], []
+    for rule in plan:
+        if not rule.applies(schema):
+            continue
+        cached = previous.get(rule.rule_id)
+        if cached is None or rule.depends_on(list(changes)):
+            results.append(rule(schema, context).to_dict())
+            rerun.append(rule.rule_id)
+        elif cached["status"] != "PASS":
+            results.append({**cached, "severity": rule.severity})
+        else:
+            results.append(cached)
+
+    return {
+        "status": "VALIDATED_CLEAN" if all(r["status"] == "PASS" for r in results) else "VALIDATED_FLAGGED",
+        "overall_score": max(0, INITIAL_SCORE - sum(r["deduction_points"] for r in results)),
+        "validation_results": results,
+        "mapped_schema": schema,
+        "rerun_rules": rerun,
+    }
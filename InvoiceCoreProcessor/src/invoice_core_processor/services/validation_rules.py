@@ -0,0 +1,209 @@
+# services/validation_rules.py
+
+# Registry of validation rule implementations and the plan of rules to run,
+# compiled from the validation_rule table (see database/seed_rules.py).
+
+import select
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from invoice_core_processor.config.settings import get_settings
+
+# Postgres NOTIFY channel raised by the validation_rule trigger (see schema.sql).
+VALIDATION_RULES_CHANNEL = "validation_rules_changed"
+
+
+class RuleSpec:
+    """
+    A rule implementation as registered with @validation_rule.
+
+    `inputs` are dotted paths into the mapped schema that must be present (and
+    not None) for the rule to run; `reads` are further paths the rule looks at
+    when they are there. Together they decide which rules an edit affects.
+    `context` names the extra arguments, such as ocr_confidence or invoice_id,
+    passed after the schema (None when the caller does not know them).
+    """
+
+    def __init__(self, rule_id: str, func: Callable, inputs: Sequence[str], context: Sequence[str], severity: int, reads: Sequence[str] = ()):
+        self.rule_id = rule_id
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.reads = tuple(reads)
+        self.context = tuple(context)
+        self.severity = severity
+
+
+# rule_id -> RuleSpec, in registration order (which is also the report order).
+RULE_SPECS: Dict[str, RuleSpec] = {}
+
+def validation_rule(rule_id: str, inputs: Sequence[str] = (), context: Sequence[str] = (), severity: int = 1, reads: Sequence[str] = ()):
+    """Registers a rule implementation; `severity` is used when the rule table cannot be read."""
+    def decorator(func):
+        RULE_SPECS[rule_id] = RuleSpec(rule_id, func, inputs, context, severity, reads)
+        return func
+    return decorator
+
+
+class CompiledRule:
+    """A registered rule bound to its severity from the rule table, with its input paths pre-split."""
+
+    def __init__(self, spec: RuleSpec, severity: int):
+        self.rule_id = spec.rule_id
+        self.severity = severity
+        self.inputs = spec.inputs
+        self.dependencies = spec.inputs + spec.reads
+        self.context = spec.context
+        self._func = spec.func
+        self._paths: Tuple[Tuple[str, ...], ...] = tuple(tuple(path.split(".")) for path in spec.inputs)
+
+    def applies(self, schema: Dict[str, Any]) -> bool:
+        """True if every declared input is present in the schema."""
+        for path in self._paths:
+            value = schema
+            for part in path:
+                if not isinstance(value, dict):
+                    return False
+                value = value.get(part)
+            if value is None:
+                return False
+        return True
+
+    def depends_on(self, changed_paths: Sequence[str]) -> bool:
+        """True if any changed path is, contains or lies within one of the rule's inputs or reads."""
+        for changed in changed_paths:
+            for path in self.dependencies:
+                if changed == path or path.startswith(changed + ".") or changed.startswith(path + "."):
+                    return True
+        return False
+
+    def __call__(self, schema: Dict[str, Any], context: Dict[str, Any]):
+        result = self._func(schema, *(context.get(name) for name in self.context))
+        if result.status != "PASS":
+            result.severity = self.severity
+        return result
+
+
+def compile_plan(rows: Optional[Dict[str, Tuple[int, bool]]] = None) -> List[CompiledRule]:
+    """
+    Compiles the registered rules into a plan. `rows` maps rule_id to
+    (severity, is_active) from the rule table; rules that are inactive or
+    missing from it are left out. Without rows every registered rule runs with
+    its default severity.
+    """
+    if rows is None:
+        return [CompiledRule(spec, spec.severity) for spec in RULE_SPECS.values()]
+    plan = []
+    for rule_id, spec in RULE_SPECS.items():
+        row = rows.get(rule_id)
+        if row is not None and row[1]:
+            plan.append(CompiledRule(spec, row[0]))
+    return plan
+
+
+class ValidationRuleRegistry:
+    """
+    Caches the compiled plan of active rules.
+
+    The plan is rebuilt from the validation_rule table after `ttl` seconds or,
+    when the change listener is running, as soon as any replica changes the
+    table. If the table cannot be read, the built-in rules are used until the
+    next reload.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl if ttl is not None else get_settings().VALIDATION_RULES_CACHE_TTL_SECONDS
+        self._plan: Optional[List[CompiledRule]] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._unimplemented_reported = set()
+        self._listener: Optional[threading.Thread] = None
+        self._listener_stop = threading.Event()
+
+    def plan(self) -> List[CompiledRule]:
+        with self._lock:
+            if self._plan is not None and time.monotonic() < self._expires_at:
+                return self._plan
+            self._plan = self._load()
+            self._expires_at = time.monotonic() + self.ttl
+            return self._plan
+
+    def invalidate(self):
+        with self._lock:
+            self._plan = None
+
+    def _load(self) -> List[CompiledRule]:
+        try:
+            rows = self._read_rule_table()
+        except Exception as e:
+            print(f"Could not load validation rules ({e}); using built-in rules.")
+            return compile_plan()
+        if not rows:
+            print("validation_rule table is empty; using built-in rules.")
+            return compile_plan()
+        unimplemented = set(rows) - set(RULE_SPECS) - self._unimplemented_reported
+        if unimplemented:
+            print(f"Validation rules without an implementation are skipped: {', '.join(sorted(unimplemented))}")
+            self._unimplemented_reported |= unimplemented
+        plan = compile_plan(rows)
+        print(f"Loaded validation plan: {', '.join(rule.rule_id for rule in plan)}")
+        return plan
+
+    def _read_rule_table(self) -> Dict[str, Tuple[int, bool]]:
+        from invoice_core_processor.core.database import postgres_connection
+        with postgres_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT rule_id, severity, is_active FROM validation_rule;")
+                return {rule_id: (severity, is_active) for rule_id, severity, is_active in cur.fetchall()}
+
+    # --- Change Listener ---
+
+    def start_change_listener(self):
+        """
+        Starts a background thread that LISTENs for rule table changes made
+        anywhere and drops the cached plan when one arrives.
+        """
+        if self._listener is not None and self._listener.is_alive():
+            return
+        self._listener_stop.clear()
+        self._listener = threading.Thread(target=self._listen_for_changes, name="validation-rule-listener", daemon=True)
+        self._listener.start()
+
+    def stop_change_listener(self):
+        self._listener_stop.set()
+        if self._listener is not None:
+            self._listener.join(timeout=5)
+            self._listener = None
+
+    def _listen_for_changes(self):
+        from invoice_core_processor.core.database import get_postgres_connection
+        while not self._listener_stop.is_set():
+            conn = None
+            try:
+                # LISTEN needs a dedicated connection for the lifetime of the loop.
+                conn = get_postgres_connection()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {VALIDATION_RULES_CHANNEL};")
+                # Anything could have changed while we were not listening.
+                self.invalidate()
+                while not self._listener_stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        print("Validation rules changed; reloading plan.")
+                        self.invalidate()
+            except Exception as e:
+                print(f"Validation rule listener error: {e}. Reconnecting...")
+                self._listener_stop.wait(5)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+@lru_cache()
+def get_validation_rule_registry() -> ValidationRuleRegistry:
+    return ValidationRuleRegistry()
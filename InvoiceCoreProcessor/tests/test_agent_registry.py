@@ -0,0 +1,148 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch, MagicMock
+
+from invoice_core_processor.core.agent_registry import AgentRegistryService, AGENT_REGISTRY_CHANNEL
+from invoice_core_processor.core.models import AgentCard, ToolDefinition
+from invoice_core_processor.core.routing import Provider, RoundRobinPolicy, LeastInFlightPolicy, LatencyWeightedPolicy
+
+@patch('invoice_core_processor.core.agent_registry.postgres_connection')
+class TestAgentRegistryRouting(unittest.TestCase):
+
+    def _mock_cursor(self, mock_pg_conn):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_pg_conn.return_value.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_cursor.fetchall.return_value = [("com.invoice.ocr", "ocr/extract_text_cascading", "CAPABILITY_OCR", "OCR", {}, None)]
+        return mock_cursor
+
+    def test_lookup_is_served_from_cache(self, mock_pg_conn):
+        """Repeated lookups for a capability hit Postgres only once."""
+        mock_cursor = self._mock_cursor(mock_pg_conn)
+        registry = AgentRegistryService(cache_ttl=60)
+
+        first = registry.lookup_agent_by_capability("CAPABILITY_OCR")
+        second = registry.lookup_agent_by_capability("CAPABILITY_OCR")
+
+        self.assertEqual(first[0], "com.invoice.ocr")
+        self.assertEqual(first, second)
+        self.assertEqual(mock_cursor.execute.call_count, 1)
+
+    def test_expired_entry_is_refetched(self, mock_pg_conn):
+        """Entries older than the TTL go back to the database."""
+        mock_cursor = self._mock_cursor(mock_pg_conn)
+        registry = AgentRegistryService(cache_ttl=0)
+
+        registry.lookup_agent_by_capability("CAPABILITY_OCR")
+        registry.lookup_agent_by_capability("CAPABILITY_OCR")
+
+        self.assertEqual(mock_cursor.execute.call_count, 2)
+
+    def test_register_agent_invalidates_and_notifies(self, mock_pg_conn):
+        """Registering an agent clears the routing table and notifies other replicas."""
+        mock_cursor = self._mock_cursor(mock_pg_conn)
+        registry = AgentRegistryService(cache_ttl=60)
+        registry.lookup_agent_by_capability("CAPABILITY_OCR")
+        self.assertIsNotNone(registry.get_cached_route("CAPABILITY_OCR"))
+
+        card = AgentCard(agent_id="com.invoice.ocr", description="OCR", tools=[
+            ToolDefinition(tool_id="ocr/extract_text_cascading", capability="CAPABILITY_OCR", description="OCR")
+        ])
+        result = registry.register_agent(card)
+
+        self.assertEqual(result["status"], "AGENT_FULLY_REGISTERED")
+        self.assertIsNone(registry.get_cached_route("CAPABILITY_OCR"))
+        notify_call = mock_cursor.execute.call_args_list[-1]
+        self.assertIn("pg_notify", notify_call[0][0])
+        self.assertEqual(notify_call[0][1], (AGENT_REGISTRY_CHANNEL, "com.invoice.ocr"))
+
+    def test_failed_lookup_is_not_cached(self, mock_pg_conn):
+        """Database errors return None without poisoning the routing table."""
+        mock_pg_conn.side_effect = RuntimeError("connection refused")
+        registry = AgentRegistryService(cache_ttl=60)
+
+        self.assertIsNone(registry.lookup_agent_by_capability("CAPABILITY_OCR"))
+        self.assertIsNone(registry.get_cached_route("CAPABILITY_OCR"))
+
+    def test_stale_providers_are_skipped(self, mock_pg_conn):
+        """Providers whose heartbeat is older than the TTL are never chosen."""
+        now = datetime.now(timezone.utc)
+        mock_cursor = self._mock_cursor(mock_pg_conn)
+        mock_cursor.fetchall.return_value = [
+            ("ocr-a", "ocr/extract", "CAPABILITY_OCR", "OCR", {}, now - timedelta(minutes=10)),
+            ("ocr-b", "ocr/extract", "CAPABILITY_OCR", "OCR", {}, now),
+        ]
+        registry = AgentRegistryService(cache_ttl=60, policy=RoundRobinPolicy(), heartbeat_ttl=120)
+
+        chosen = {registry.lookup_agent_by_capability("CAPABILITY_OCR")[0] for _ in range(4)}
+
+        self.assertEqual(chosen, {"ocr-b"})
+
+    def test_freshest_provider_is_used_when_all_are_stale(self, mock_pg_conn):
+        """If every provider is stale, routing falls back to the one seen alive most recently."""
+        now = datetime.now(timezone.utc)
+        mock_cursor = self._mock_cursor(mock_pg_conn)
+        mock_cursor.fetchall.return_value = [
+            ("ocr-a", "ocr/extract", "CAPABILITY_OCR", "OCR", {}, now - timedelta(minutes=30)),
+            ("ocr-b", "ocr/extract", "CAPABILITY_OCR", "OCR", {}, now - timedelta(minutes=10)),
+        ]
+        registry = AgentRegistryService(cache_ttl=60, policy=RoundRobinPolicy(), heartbeat_ttl=120)
+
+        self.assertEqual(registry.lookup_agent_by_capability("CAPABILITY_OCR")[0], "ocr-b")
+
+    def test_heartbeats_cover_given_and_registered_agents(self, mock_pg_conn):
+        """The heartbeat thread refreshes every agent this process serves in one statement."""
+        mock_cursor = self._mock_cursor(mock_pg_conn)
+        registry = AgentRegistryService(cache_ttl=60, heartbeat_ttl=120)
+        registry.register_agent(AgentCard(agent_id="com.invoice.summary", description="Summary", tools=[]))
+
+        registry.start_heartbeats(["com.invoice.ocr"], interval=60)
+        registry.stop_heartbeats()
+
+        sql, params = mock_cursor.execute.call_args[0]
+        self.assertIn("agent_id = ANY(%s)", sql)
+        self.assertEqual(params, (["com.invoice.ocr", "com.invoice.summary"],))
+
+    def test_heartbeats_are_off_when_ttl_is_disabled(self, mock_pg_conn):
+        registry = AgentRegistryService(cache_ttl=60, heartbeat_ttl=0)
+        registry.start_heartbeats(["com.invoice.ocr"])
+        self.assertIsNone(registry._heartbeats)
+
+def make_providers(*agent_ids):
+    tool = ToolDefinition(tool_id="ocr/extract", capability="CAPABILITY_OCR", description="OCR")
+    return [Provider(agent_id, tool, None) for agent_id in agent_ids]
+
+class TestRoutingPolicies(unittest.TestCase):
+
+    def test_round_robin_cycles_providers(self):
+        policy = RoundRobinPolicy()
+        providers = make_providers("ocr-a", "ocr-b", "ocr-c")
+
+        picks = [policy.choose("CAPABILITY_OCR", providers).agent_id for _ in range(6)]
+
+        self.assertEqual(picks, ["ocr-a", "ocr-b", "ocr-c", "ocr-a", "ocr-b", "ocr-c"])
+
+    def test_least_in_flight_avoids_busy_provider(self):
+        policy = LeastInFlightPolicy()
+        providers = make_providers("ocr-a", "ocr-b")
+        policy.on_start("ocr-a")
+
+        self.assertEqual(policy.choose("CAPABILITY_OCR", providers).agent_id, "ocr-b")
+
+        policy.on_finish("ocr-a", 0.5)
+        policy.on_start("ocr-b")
+        self.assertEqual(policy.choose("CAPABILITY_OCR", providers).agent_id, "ocr-a")
+
+    def test_latency_weighted_prefers_fast_provider(self):
+        policy = LatencyWeightedPolicy()
+        providers = make_providers("fast", "slow")
+        policy.on_start("fast"); policy.on_finish("fast", 0.1)
+        policy.on_start("slow"); policy.on_finish("slow", 10.0)
+
+        picks = [policy.choose("CAPABILITY_OCR", providers).agent_id for _ in range(200)]
+
+        self.assertGreater(picks.count("fast"), 150)
+
+if __name__ == '__main__':
+    unittest.main()
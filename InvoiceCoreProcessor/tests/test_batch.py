@@ -0,0 +1,100 @@
+import unittest
+import asyncio
+
+from invoice_core_processor.core.batch import BatchProcessor, STAGE_ORDER
+
+NEXT_STATUS = {
+    "ingestion": "UPLOADED",
+    "ocr": "OCR_DONE",
+    "mapping": "MAPPED",
+    "validation": "VALIDATED_CLEAN",
+    "integration": "SYNCED_SUCCESS",
+    "summary": "SUMMARY_GENERATED",
+}
+
+class TestBatchProcessor(unittest.TestCase):
+
+    def _make_stages(self, in_flight, peak, fail_mapping_for=()):
+        def make_stage(name):
+            async def stage(state):
+                in_flight[name] += 1
+                peak[name] = max(peak[name], in_flight[name])
+                await asyncio.sleep(0.001)
+                in_flight[name] -= 1
+                if name == "mapping" and state["file_path"] in fail_mapping_for:
+                    return {"status": "FAILED_MAPPING"}
+                update = {"status": NEXT_STATUS[name]}
+                if name == "ingestion":
+                    update["invoice_id"] = f"id-{state['file_path']}"
+                return update
+            return stage
+        return {name: make_stage(name) for name in STAGE_ORDER}
+
+    def test_pipeline_respects_stage_concurrency(self):
+        """Each stage never runs more invoices at once than its limit."""
+        in_flight = {name: 0 for name in STAGE_ORDER}
+        peak = {name: 0 for name in STAGE_ORDER}
+        limits = {"ingestion": 5, "ocr": 2, "mapping": 3, "validation": 4, "integration": 1, "summary": 2}
+        processor = BatchProcessor(stages=self._make_stages(in_flight, peak), concurrency=limits)
+
+        paths = [f"invoice_{i}.pdf" for i in range(40)]
+        results = asyncio.run(processor.run("test-user", paths, "TALLY"))
+
+        self.assertEqual(len(results), 40)
+        self.assertTrue(all(state["status"] == "SUMMARY_GENERATED" for state in results))
+        self.assertEqual([state["invoice_id"] for state in results], [f"id-{p}" for p in paths])
+        for name, limit in limits.items():
+            self.assertLessEqual(peak[name], limit)
+        self.assertEqual(peak["ocr"], 2)
+
+    def test_failed_invoice_leaves_pipeline(self):
+        """A failure at one stage stops that invoice without affecting the others."""
+        in_flight = {name: 0 for name in STAGE_ORDER}
+        peak = {name: 0 for name in STAGE_ORDER}
+        stages = self._make_stages(in_flight, peak, fail_mapping_for={"bad.pdf"})
+
+        async def broken_ocr(state):
+            if state["file_path"] == "crash.pdf":
+                raise RuntimeError("engine crashed")
+            return {"status": "OCR_DONE"}
+        stages["ocr"] = broken_ocr
+
+        processor = BatchProcessor(stages=stages)
+        results = asyncio.run(processor.run("test-user", ["good.pdf", "bad.pdf", "crash.pdf"], "ZOHO"))
+
+        self.assertEqual(results[0]["status"], "SUMMARY_GENERATED")
+        self.assertEqual(results[1]["status"], "FAILED_MAPPING")
+        self.assertEqual(results[2]["status"], "FAILED_OCR")
+        self.assertEqual(results[2]["error"], "engine crashed")
+
+    def test_batch_stage_groups_invoices(self):
+        """A batched stage receives groups of up to its batch size and can fail invoices individually."""
+        in_flight = {name: 0 for name in STAGE_ORDER}
+        peak = {name: 0 for name in STAGE_ORDER}
+        groups = []
+
+        async def mapping_batch(states):
+            groups.append(len(states))
+            return [
+                {"status": "FAILED_MAPPING"} if state["file_path"] == "bad.pdf" else {"status": "MAPPED"}
+                for state in states
+            ]
+
+        processor = BatchProcessor(
+            stages=self._make_stages(in_flight, peak),
+            batch_stages={"mapping": mapping_batch},
+            batch_sizes={"mapping": 4},
+            batch_wait=0.05,
+        )
+        paths = [f"invoice_{i}.pdf" for i in range(9)] + ["bad.pdf"]
+        results = asyncio.run(processor.run("test-user", paths, "TALLY"))
+
+        self.assertEqual(sum(groups), 10)
+        self.assertLessEqual(max(groups), 4)
+        self.assertGreater(max(groups), 1)
+        self.assertEqual(peak["mapping"], 0)  # the per-invoice stage was not used
+        self.assertTrue(all(state["status"] == "SUMMARY_GENERATED" for state in results[:9]))
+        self.assertEqual(results[9]["status"], "FAILED_MAPPING")
+
+if __name__ == '__main__':
+    unittest.main()
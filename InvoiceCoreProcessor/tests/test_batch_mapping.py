@@ -0,0 +1,68 @@
+import unittest
+import asyncio
+import json
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from invoice_core_processor.services.llm_rate_limiter import LLMRateLimiter
+from invoice_core_processor.services.mapping import amap_texts_to_schema_batch
+
+def _response(payload):
+    response = MagicMock()
+    response.choices[0].message.content = payload if isinstance(payload, str) else json.dumps(payload)
+    response.usage = None
+    return response
+
+@patch('invoice_core_processor.services.mapping.get_llm_rate_limiter', return_value=LLMRateLimiter(8, 0, 0))
+@patch('invoice_core_processor.services.mapping.get_template_extractor', return_value=None)
+@patch('invoice_core_processor.services.mapping.get_mapping_cache', return_value=None)
+@patch('invoice_core_processor.services.mapping.get_async_openai_client')
+@patch('invoice_core_processor.services.mapping.get_settings')
+class TestBatchedMapping(unittest.TestCase):
+
+    def _settings(self, batch_size=4, max_invoice_tokens=1500):
+        return MagicMock(
+            OPENAI_API_KEY="key", OPENAI_MODEL="gpt-4", MAPPING_TEXT_COMPACTION=False,
+            OPENAI_EXPECTED_COMPLETION_TOKENS=100, OPENAI_MAX_RETRIES=0,
+            MAPPING_BATCH_SIZE=batch_size, MAPPING_BATCH_MAX_INVOICE_TOKENS=max_invoice_tokens, MAPPING_BATCH_MAX_TOKENS=6000,
+        )
+
+    def _invoices(self, count):
+        return [{"invoice_id": f"id-{i}", "extracted_text": f"Invoice INV-{i} Total {i}00"} for i in range(count)]
+
+    def test_short_invoices_share_one_request(self, mock_settings, mock_get_client, *_):
+        mock_settings.return_value = self._settings()
+        create = mock_get_client.return_value.chat.completions.create = AsyncMock(return_value=_response(
+            {"invoices": [{"ref": str(i + 1), "data": {"invoiceNumber": f"INV-{i}"}} for i in reversed(range(3))]}
+        ))
+
+        results = asyncio.run(amap_texts_to_schema_batch(self._invoices(3), "TALLY"))
+
+        create.assert_awaited_once()
+        for i in range(3):
+            self.assertEqual(results[f"id-{i}"]["mapped_schema"], {"invoiceNumber": f"INV-{i}"})
+            self.assertEqual(results[f"id-{i}"]["source"], "llm_batch")
+
+    def test_missing_entries_fall_back_to_single_calls(self, mock_settings, mock_get_client, *_):
+        mock_settings.return_value = self._settings()
+        batch = _response({"invoices": [{"ref": "1", "data": {"invoiceNumber": "INV-0"}}, {"ref": "2", "data": "garbled"}]})
+        single = _response({"invoiceNumber": "INV-1"})
+        create = mock_get_client.return_value.chat.completions.create = AsyncMock(side_effect=[batch, single])
+
+        results = asyncio.run(amap_texts_to_schema_batch(self._invoices(2), "TALLY"))
+
+        self.assertEqual(create.await_count, 2)
+        self.assertEqual(results["id-0"]["source"], "llm_batch")
+        self.assertEqual(results["id-1"]["source"], "llm")
+        self.assertEqual(results["id-1"]["mapped_schema"], {"invoiceNumber": "INV-1"})
+
+    def test_long_invoices_are_mapped_alone(self, mock_settings, mock_get_client, *_):
+        mock_settings.return_value = self._settings(max_invoice_tokens=1)
+        create = mock_get_client.return_value.chat.completions.create = AsyncMock(return_value=_response({"invoiceNumber": "X"}))
+
+        results = asyncio.run(amap_texts_to_schema_batch(self._invoices(2), "TALLY"))
+
+        self.assertEqual(create.await_count, 2)
+        self.assertTrue(all(result["source"] == "llm" for result in results.values()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import random
+from unittest.mock import patch
+
+from invoice_core_processor.services.batch_validation import InvoiceColumns, evaluate, run_validation_checks_batch
+from invoice_core_processor.services.validation import run_validation_checks
+from invoice_core_processor.services.validation_rules import compile_plan
+
+def _random_schema(rng):
+    items = []
+    for _ in range(rng.randint(0, 4)):
+        quantity, unit_price = rng.randint(1, 5), round(rng.uniform(1, 500), 2)
+        amount = round(quantity * unit_price, 2) if rng.random() < 0.8 else round(rng.uniform(1, 2000), 2)
+        items.append({"quantity": quantity, "unitPrice": unit_price, "amount": amount})
+    subtotal = sum(item["amount"] for item in items) if rng.random() < 0.8 else round(rng.uniform(1, 2000), 2)
+    gst = round(subtotal * 0.18, 2)
+    grand_total = subtotal + gst if rng.random() < 0.8 else subtotal
+    schema = {"lineItems": items, "totals": {"subtotal": subtotal, "gstAmount": gst, "roundOff": 0.0, "grandTotal": grand_total}}
+    if rng.random() < 0.5:
+        schema["invoiceNumber"] = f"INV-{rng.randint(1, 999)}"
+    return schema
+
+class TestBatchValidation(unittest.TestCase):
+
+    def test_matches_scalar_rules(self):
+        rng = random.Random(7)
+        schemas = [_random_schema(rng) for _ in range(300)]
+        schemas += [{}, {"lineItems": [{"quantity": 1, "unitPrice": 10.0}]}, {"totals": {"grandTotal": 5}}]
+        confidences = [rng.choice([0.5, 0.69, 0.7, 0.95]) for _ in schemas]
+
+        plan = compile_plan()
+        batch = run_validation_checks_batch(schemas, confidences, plan)
+
+        self.assertEqual(batch, [run_validation_checks(schema, conf, plan) for schema, conf in zip(schemas, confidences)])
+        self.assertIn("VALIDATED_FLAGGED", {report["status"] for report in batch})
+        self.assertIn("VALIDATED_CLEAN", {report["status"] for report in batch})
+
+    def test_first_bad_line_item_is_reported_per_invoice(self):
+        schemas = [
+            {"lineItems": [{"quantity": 1, "unitPrice": 5, "amount": 5}, {"quantity": 2, "unitPrice": 5, "amount": 9}, {"quantity": 1, "unitPrice": 1, "amount": 2}]},
+            {"lineItems": [{"quantity": 1, "unitPrice": 5, "amount": 4}]},
+            {"lineItems": []},
+        ]
+        evaluated = evaluate(InvoiceColumns.from_schemas(schemas))
+        self.assertEqual(evaluated["first_bad_item"].tolist(), [1, 0, -1])
+
+    def test_irregular_invoices_use_scalar_rules(self):
+        valid = {"lineItems": [], "totals": {"subtotal": 0, "gstAmount": 0, "roundOff": 0, "grandTotal": 0}}
+        null_round_off = {"lineItems": [], "totals": {"subtotal": 0, "gstAmount": 0, "roundOff": None, "grandTotal": 0}}
+
+        plan = compile_plan()
+        batch = run_validation_checks_batch([valid, null_round_off], plan=plan)
+
+        self.assertEqual(batch[0], run_validation_checks(valid, plan=plan))
+        self.assertEqual(batch[1]["status"], "FAILED_VALIDATION")
+
+    def test_plan_severity_and_inactive_rules_apply(self):
+        plan = compile_plan({"LIT-004": (2, True), "TTL-001": (5, False), "TTL-003": (5, True), "ANM-004": (3, True)})
+        schemas = [{"lineItems": [{"quantity": 2, "unitPrice": 5, "amount": 9}], "totals": {"subtotal": 1, "grandTotal": 1}}]
+
+        batch = run_validation_checks_batch(schemas, plan=plan)
+
+        self.assertEqual(batch, [run_validation_checks(schemas[0], plan=plan)])
+        results = {r["rule_id"]: r for r in batch[0]["validation_results"]}
+        self.assertNotIn("TTL-001", results)
+        self.assertEqual(results["LIT-004"]["severity"], 2)
+
+    def test_duplicates_are_looked_up_once_per_batch(self):
+        stored = {"INV1": "stored-1", "INV2": "inv-2", "INV3": "stored-3"}  # normalised number -> stored id
+
+        class FakeDetector:
+            lookups = 0
+            def find_duplicate(self, key, exclude_invoice_id=None):
+                stored_id = stored.get(key.invoice_no)
+                return stored_id if stored_id != exclude_invoice_id else None
+            def find_duplicates(self, keys, exclude_invoice_ids):
+                FakeDetector.lookups += 1
+                return [self.find_duplicate(key, own) if key else None for key, own in zip(keys, exclude_invoice_ids)]
+
+        vendor = {"name": "Acme", "gstin": None}
+        schemas = [
+            {"invoiceNumber": f"INV-{n}", "invoiceDate": "2024-05-01", "vendor": vendor, "totals": {"subtotal": 1.0, "grandTotal": 1.0}}
+            for n in range(1, 5)
+        ]
+        schemas.append({"invoiceNumber": "INV-5", "totals": {"subtotal": 1.0, "grandTotal": 1.0}})  # DUP-001 does not apply
+        invoice_ids = ["inv-9", "inv-2", None, "inv-4", "inv-5"]
+        plan = compile_plan({"DUP-001": (4, True), "TTL-003": (5, True)})
+
+        with patch('invoice_core_processor.services.batch_validation.get_duplicate_detector', return_value=FakeDetector()), \
+             patch('invoice_core_processor.services.validation.get_duplicate_detector', return_value=FakeDetector()):
+            batch = run_validation_checks_batch(schemas, plan=plan, invoice_ids=invoice_ids)
+            self.assertEqual(FakeDetector.lookups, 1)
+            scalar = [run_validation_checks(schema, plan=plan, invoice_id=own) for schema, own in zip(schemas, invoice_ids)]
+
+        self.assertEqual(batch, scalar)
+        self.assertEqual([r["status"] for r in batch], ["VALIDATED_FLAGGED", "VALIDATED_CLEAN", "VALIDATED_FLAGGED", "VALIDATED_CLEAN", "VALIDATED_CLEAN"])
+        self.assertEqual(batch[0]["validation_results"][1]["severity"], 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import asyncio
+from unittest.mock import patch, MagicMock
+
+import psycopg2.extensions
+from psycopg2 import pool as pg_pool
+
+from invoice_core_processor.core import database
+from invoice_core_processor.core.database import PostgresConnectionPool
+
+def make_connection():
+    conn = MagicMock()
+    conn.closed = 0
+    conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    return conn
+
+@patch('invoice_core_processor.core.database.pg_pool.ThreadedConnectionPool')
+class TestPostgresConnectionPool(unittest.TestCase):
+
+    def _make_pool(self, mock_threaded_pool, max_size=2):
+        inner = MagicMock()
+        inner._used = {}
+        inner._pool = []
+        inner.getconn.side_effect = lambda: make_connection()
+        mock_threaded_pool.return_value = inner
+        return PostgresConnectionPool("postgresql://test", min_size=1, max_size=max_size, timeout=0.05, health_check_interval=30.0), inner
+
+    def test_connection_is_returned_and_counted(self, mock_threaded_pool):
+        """Checked-out connections go back to the pool and show up in the stats."""
+        pool, inner = self._make_pool(mock_threaded_pool)
+
+        with pool.connection() as conn:
+            self.assertEqual(pool.stats()["in_use"], 1)
+
+        inner.putconn.assert_called_once_with(conn)
+        stats = pool.stats()
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(stats["checkouts"], 1)
+        self.assertEqual(stats["peak_in_use"], 1)
+
+    def test_checkout_times_out_when_exhausted(self, mock_threaded_pool):
+        """Checkouts wait for a free slot and raise PoolError after the timeout."""
+        pool, _ = self._make_pool(mock_threaded_pool, max_size=1)
+
+        with pool.connection():
+            with self.assertRaises(pg_pool.PoolError):
+                pool.getconn()
+
+        self.assertEqual(pool.stats()["timeouts"], 1)
+
+    def test_uncommitted_and_broken_connections(self, mock_threaded_pool):
+        """Open transactions are rolled back; connections that fail to reset are discarded."""
+        pool, inner = self._make_pool(mock_threaded_pool)
+
+        conn = pool.getconn()
+        conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        pool.putconn(conn)
+        conn.rollback.assert_called_once()
+        inner.putconn.assert_called_with(conn)
+
+        conn = pool.getconn()
+        conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+        conn.rollback.side_effect = psycopg2.OperationalError("server closed the connection")
+        pool.putconn(conn)
+        inner.putconn.assert_called_with(conn, close=True)
+        self.assertEqual(pool.stats()["discarded"], 1)
+
+@patch('invoice_core_processor.core.database.motor.motor_asyncio.AsyncIOMotorClient')
+class TestSharedMongoClient(unittest.TestCase):
+
+    def setUp(self):
+        database.close_mongo_client()
+
+    def tearDown(self):
+        database.close_mongo_client()
+
+    def test_client_is_shared_within_a_loop(self, mock_motor_client):
+        """Every caller on the same event loop gets the same client."""
+        async def get_two():
+            return database.get_mongo_client(), database.get_mongo_client()
+
+        first, second = asyncio.run(get_two())
+
+        self.assertIs(first, second)
+        mock_motor_client.assert_called_once()
+        self.assertIn("maxPoolSize", mock_motor_client.call_args.kwargs)
+
+    def test_client_is_replaced_for_a_new_loop(self, mock_motor_client):
+        """A client bound to a finished loop is closed and recreated."""
+        mock_motor_client.side_effect = lambda *args, **kwargs: MagicMock()
+
+        async def get_client():
+            return database.get_mongo_client()
+
+        first = asyncio.run(get_client())
+        second = asyncio.run(get_client())
+
+        self.assertIsNot(first, second)
+        first.close.assert_called_once()
+
+        database.close_mongo_client()
+        second.close.assert_called_once()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,36 @@
+import os
+import re
 import unittest
 from unittest.mock import patch, MagicMock
 import uuid
 
-from invoice_core_processor.servers.database_server import save_validated_record, check_duplicate
+import invoice_core_processor
+
+from invoice_core_processor.servers.database_server import save_validated_record, save_validated_records_bulk, check_duplicate
+
+def _required_columns() -> dict:
+    """NOT NULL and primary key columns without a default, per table in database/schema.sql."""
+    path = os.path.join(os.path.dirname(invoice_core_processor.__file__), "database", "schema.sql")
+    with open(path) as f:
+        schema = f.read()
+    required = {}
+    for table, body in re.findall(r"CREATE TABLE (\w+) \((.*?)\n\);", schema, re.S):
+        required[table] = {
+            line.split()[0]
+            for line in body.splitlines()
+            if ("NOT NULL" in line or "PRIMARY KEY" in line) and "DEFAULT" not in line and "SERIAL" not in line
+        }
+    return required
 
 class TestDataStoreAgent(unittest.TestCase):
 
     @patch('invoice_core_processor.servers.database_server.execute_values')
-    @patch('invoice_core_processor.servers.database_server.get_postgres_connection')
+    @patch('invoice_core_processor.servers.database_server.postgres_connection')
     def test_save_validated_record_transaction(self, mock_get_pg_conn, mock_execute_values):
         """Tests the full transactional logic of saving a validated record."""
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
-        mock_get_pg_conn.return_value = mock_conn
+        mock_get_pg_conn.return_value.__enter__.return_value = mock_conn
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
         mock_cursor.fetchone.side_effect = [(uuid.uuid4(),), (uuid.uuid4(),)]
 
@@ -30,12 +48,80 @@ class TestDataStoreAgent(unittest.TestCase):
         mock_execute_values.assert_called_once()
         mock_conn.commit.assert_called_once()
 
-    @patch('invoice_core_processor.servers.database_server.get_postgres_connection')
+    @patch('invoice_core_processor.servers.database_server.postgres_connection')
+    def test_bulk_save_stages_with_copy_and_commits_once(self, mock_get_pg_conn):
+        """Tests that a batch is COPYed into staging tables, upserted set-based and committed once."""
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_get_pg_conn.return_value.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        copied = {}
+        mock_cursor.copy_expert.side_effect = lambda sql, buffer: copied.setdefault(sql.split()[1], buffer.read())
+        mock_cursor.fetchall.return_value = [(1, "inv-1", "ven-1"), (2, "inv-2", "ven-1")]
+
+        def record(number, total, description):
+            return {
+                "user_id": "test-user", "invoiceNumber": number, "invoiceDate": "2023-01-01",
+                "vendor": {"name": "Test Vendor", "gstin": "123"},
+                "totals": {"subtotal": total, "grandTotal": total},
+                "lineItems": [{"description": description, "quantity": 1, "unitPrice": total, "taxPercent": 0, "amount": total}],
+            }
+        # The first record is repeated by the second; the later one wins.
+        records = [record("inv-a", 100.0, "Old"), record("inv-a", 150.0, "Tab\there"), record("inv-b", 50.0, "Item")]
+
+        result = save_validated_records_bulk(records)
+
+        self.assertEqual(result["saved"], 2)
+        self.assertEqual([r["invoice_id"] for r in result["records"]], ["inv-1", "inv-1", "inv-2"])
+        self.assertEqual(mock_cursor.execute.call_count, 4)  # Staging DDL, Vendors, Invoices, Line items
+        self.assertEqual(copied["staging_invoices"].count("\n"), 2)
+        self.assertIn("Tab\\there", copied["staging_invoice_items"])
+        self.assertNotIn("Old", copied["staging_invoice_items"])
+        mock_conn.commit.assert_called_once()
+        items_sql = mock_cursor.execute.call_args_list[3][0][0]
+        self.assertIn("(id, invoice_id, line_no,", items_sql)
+        self.assertIn("gen_random_uuid(), s.invoice_id, i.line_no,", items_sql)
+
+    @patch('invoice_core_processor.servers.database_server.execute_values')
+    @patch('invoice_core_processor.servers.database_server.postgres_connection')
+    def test_inserts_cover_required_columns(self, mock_get_pg_conn, mock_execute_values):
+        """Every INSERT sets the NOT NULL columns in schema.sql that have no default."""
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_get_pg_conn.return_value.__enter__.return_value = mock_conn
+        mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
+        mock_cursor.fetchone.side_effect = [(uuid.uuid4(),), (uuid.uuid4(),)]
+        mock_cursor.fetchall.return_value = [(0, "inv-1", "ven-1")]
+        # No subtotal: it falls back to the sum of the line items.
+        record = {
+            "user_id": "test-user", "invoiceNumber": "inv-a", "invoiceDate": "2023-01-01",
+            "vendor": {"name": "Test Vendor", "gstin": "123"},
+            "totals": {"grandTotal": 118.0},
+            "lineItems": [{"description": "Item", "quantity": 1, "unitPrice": 100, "taxPercent": 18, "amount": 100.0}],
+        }
+
+        save_validated_record(record)
+        save_validated_records_bulk([record])
+
+        statements = [c[0][0] for c in mock_cursor.execute.call_args_list] + [c[0][1] for c in mock_execute_values.call_args_list]
+        inserted = {}
+        for sql in statements:
+            for table, columns in re.findall(r"INSERT INTO (\w+)\s*\(([^)]*)\)", sql):
+                inserted.setdefault(table, []).append({column.strip() for column in columns.split(",")})
+        required = _required_columns()
+        for table in ("vendors", "invoices", "invoice_items"):
+            self.assertEqual(len(inserted[table]), 2, table)
+            for columns in inserted[table]:
+                self.assertLessEqual(required[table], columns, table)
+        self.assertEqual(mock_execute_values.call_args[0][2][0][1:3], (1, "Item"))
+        self.assertIn(100.0, mock_cursor.execute.call_args_list[1][0][1])
+
+    @patch('invoice_core_processor.core.database.postgres_connection')
     def test_check_duplicate_query(self, mock_get_pg_conn):
         """Tests that the check_duplicate function uses the correct query."""
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
-        mock_get_pg_conn.return_value = mock_conn
+        mock_get_pg_conn.return_value.__enter__.return_value = mock_conn
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
         check_duplicate("Test Vendor", "test-inv-123", "2023-01-01")
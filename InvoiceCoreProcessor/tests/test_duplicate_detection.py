@@ -0,0 +1,113 @@
+import unittest
+import datetime
+from unittest.mock import patch, MagicMock
+
+from invoice_core_processor.services.duplicate_detection import BloomFilter, DuplicateDetector, InvoiceKey
+from invoice_core_processor.services.validation import check_duplicate, run_validation_checks
+from invoice_core_processor.services.validation_rules import compile_plan
+
+SCHEMA = {
+    "invoiceNumber": "INV/2024-001", "invoiceDate": "01/05/2024",
+    "vendor": {"name": "  Acme   Traders ", "gstin": "29abcde1234f1z5"},
+}
+
+def _mock_postgres(mock_pg_conn, row):
+    cursor = MagicMock()
+    cursor.fetchone.return_value = row
+    mock_pg_conn.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value = cursor
+    return cursor
+
+class TestInvoiceKey(unittest.TestCase):
+
+    def test_keys_are_normalised(self):
+        key = InvoiceKey.from_schema(SCHEMA)
+        self.assertEqual(key.lookup_token(), "gstin:29ABCDE1234F1Z5|INV2024001|2024-05-01")
+        self.assertEqual(
+            InvoiceKey.create("acme traders", None, "inv-2024-001", datetime.date(2024, 5, 1)).lookup_token(),
+            "name:acme traders|INV2024001|2024-05-01",
+        )
+        self.assertIn("name:acme traders|INV2024001|2024-05-01", key.stored_tokens())
+
+    def test_unidentifiable_invoices_have_no_key(self):
+        self.assertIsNone(InvoiceKey.create("Acme", None, "INV-1", "not a date"))
+        self.assertIsNone(InvoiceKey.create(None, " ", "INV-1", "2024-05-01"))
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_no_false_negatives_and_few_false_positives(self):
+        bloom = BloomFilter(capacity=10000, error_rate=0.01)
+        for i in range(10000):
+            bloom.add(f"stored-{i}")
+        self.assertTrue(all(f"stored-{i}" in bloom for i in range(10000)))
+        false_positives = sum(f"new-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+class TestDuplicateDetector(unittest.TestCase):
+
+    def _warmed_detector(self, stored_keys):
+        detector = DuplicateDetector(error_rate=0.001, min_capacity=1000)
+        detector._filter = BloomFilter(1000, 0.001)
+        for key in stored_keys:
+            detector.add(key)
+        return detector
+
+    @patch('invoice_core_processor.core.database.postgres_connection')
+    def test_filter_negative_skips_the_database(self, mock_pg_conn):
+        detector = self._warmed_detector([InvoiceKey.create("Other Vendor", None, "INV-9", "2024-05-01")])
+
+        self.assertIsNone(detector.find_duplicate(InvoiceKey.from_schema(SCHEMA)))
+        mock_pg_conn.assert_not_called()
+
+    @patch('invoice_core_processor.core.database.postgres_connection')
+    def test_filter_positive_is_confirmed_in_the_database(self, mock_pg_conn):
+        # Stored without a GSTIN, looked up by name only.
+        stored = InvoiceKey.create("Acme Traders", None, "INV/2024-001", "2024-05-01")
+        detector = self._warmed_detector([stored])
+        cursor = _mock_postgres(mock_pg_conn, ("a1b2",))
+
+        self.assertEqual(detector.find_duplicate(InvoiceKey.create("ACME TRADERS", None, "inv 2024 001", "01-05-2024")), "a1b2")
+        self.assertIn("JOIN vendors", cursor.execute.call_args[0][0])
+
+    @patch('invoice_core_processor.core.database.postgres_connection')
+    def test_unwarmed_detector_queries_the_database(self, mock_pg_conn):
+        _mock_postgres(mock_pg_conn, None)
+        self.assertIsNone(DuplicateDetector(error_rate=0.001, min_capacity=1000).find_duplicate(InvoiceKey.from_schema(SCHEMA)))
+        mock_pg_conn.assert_called_once()
+
+    def test_notified_keys_are_added(self):
+        detector = self._warmed_detector([])
+        detector._add_notified('{"gstin": "29ABCDE1234F1Z5", "name": "Acme Traders", "invoice_no": "INV/2024-001", "invoice_date": "2024-05-01"}')
+        self.assertTrue(detector.might_exist(InvoiceKey.from_schema(SCHEMA)))
+
+    @patch('invoice_core_processor.core.database.postgres_connection')
+    def test_the_invoice_itself_is_excluded(self, mock_pg_conn):
+        cursor = _mock_postgres(mock_pg_conn, None)
+
+        self.assertIsNone(DuplicateDetector(error_rate=0.001, min_capacity=1000).find_duplicate(InvoiceKey.from_schema(SCHEMA), exclude_invoice_id="a1b2"))
+        sql, params = cursor.execute.call_args[0]
+        self.assertIn("i.id::text <> %s", sql)
+        self.assertEqual(params[-1], "a1b2")
+
+class TestDuplicateRule(unittest.TestCase):
+
+    @patch('invoice_core_processor.services.validation.get_duplicate_detector')
+    def test_duplicate_fails(self, mock_detector):
+        mock_detector.return_value.find_duplicate.return_value = "a1b2"
+        result = check_duplicate(SCHEMA)
+        self.assertEqual((result.status, result.message), ("FAIL", "Duplicate of stored invoice a1b2."))
+
+    @patch('invoice_core_processor.services.validation.get_duplicate_detector')
+    def test_own_invoice_id_is_passed_through(self, mock_detector):
+        mock_detector.return_value.find_duplicate.return_value = None
+        result = run_validation_checks(SCHEMA, invoice_id="a1b2", plan=compile_plan({"DUP-001": (5, True)}))
+
+        self.assertEqual(result["status"], "VALIDATED_CLEAN")
+        self.assertEqual(mock_detector.return_value.find_duplicate.call_args.kwargs, {"exclude_invoice_id": "a1b2"})
+
+    @patch('invoice_core_processor.services.validation.get_duplicate_detector')
+    def test_database_errors_are_reported_not_raised(self, mock_detector):
+        mock_detector.return_value.find_duplicate.side_effect = ConnectionError("database down")
+        self.assertEqual(check_duplicate(SCHEMA).status, "WARN")
+
+if __name__ == '__main__':
+    unittest.main()
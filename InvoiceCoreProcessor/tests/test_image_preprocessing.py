@@ -0,0 +1,89 @@
+import unittest
+import os
+import tempfile
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from invoice_core_processor.services.image_preprocessing import estimate_skew, preprocess, preprocess_image
+
+def make_page(width=1200, height=900, skew=0.0):
+    """A white page with horizontal black 'text lines', optionally rotated."""
+    page = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(page)
+    for y in range(80, height - 80, 40):
+        draw.rectangle([100, y, width - 100, y + 12], fill=0)
+    if skew:
+        page = page.rotate(skew, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    return page
+
+class TestImagePreprocessing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.settings = MagicMock(
+            OCR_PREPROCESS_MAX_SIDE=1000, OCR_PREPROCESS_DESKEW=True, OCR_PREPROCESS_BINARIZE=True,
+            OCR_PREPROCESS_CACHE_DIR=os.path.join(self.tmp.name, "preprocessed"),
+            OCR_PREPROCESS_CACHE_MAX_BYTES=10 * 1024 * 1024,
+        )
+        patcher = patch('invoice_core_processor.services.image_preprocessing.get_settings', return_value=self.settings)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_skew_is_detected(self):
+        angle = estimate_skew(make_page(skew=3.0))
+        self.assertAlmostEqual(angle, -3.0, delta=0.5)
+
+    def test_output_is_downscaled_and_binary(self):
+        photo = make_page(width=4000, height=3000).convert("RGB")
+
+        result = preprocess(photo, max_side=1000)
+
+        self.assertLessEqual(max(result.size), 1000)
+        self.assertEqual(result.mode, "L")
+        self.assertTrue(set(np.unique(np.asarray(result))) <= {0, 255})
+
+    def test_output_is_cached_by_file_hash(self):
+        path = os.path.join(self.tmp.name, "photo.png")
+        make_page(width=2000, height=1500).save(path)
+
+        first = preprocess_image(path)
+        with patch('invoice_core_processor.services.image_preprocessing.preprocess') as mock_preprocess:
+            second = preprocess_image(path)
+
+        self.assertNotEqual(first, path)
+        self.assertEqual(first, second)
+        mock_preprocess.assert_not_called()
+        with Image.open(first) as image:
+            self.assertLessEqual(max(image.size), 1000)
+
+    def test_cache_directory_is_scanned_only_when_needed(self):
+        """Writes update a running size; the directory is re-scanned on the first write and once over budget."""
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(self.tmp.name, f"photo-{i}.png"))
+            make_page(width=1200 + 100 * i, height=900).save(paths[-1])
+
+        with patch('invoice_core_processor.services.image_preprocessing.evict_least_recently_used', return_value=0) as mock_evict:
+            preprocess_image(paths[0])
+            preprocess_image(paths[1])
+            self.assertEqual(mock_evict.call_count, 1)
+
+            self.settings.OCR_PREPROCESS_CACHE_MAX_BYTES = 1
+            preprocess_image(paths[2])
+            self.assertEqual(mock_evict.call_count, 2)
+
+    def test_unreadable_image_falls_back_to_original(self):
+        path = os.path.join(self.tmp.name, "broken.png")
+        with open(path, "wb") as f:
+            f.write(b"not an image")
+
+        self.assertEqual(preprocess_image(path), path)
+        self.assertEqual(preprocess_image("missing.png"), "missing.png")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import asyncio
+
+from invoice_core_processor.core.jobs import InvoiceJobManager, JobQueueFullError
+
+class FakeWorkflow:
+    """Streams a fixed sequence of statuses, pausing until released."""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.release = asyncio.Event()
+
+    async def astream(self, state, stream_mode="values"):
+        await self.release.wait()
+        for status in self.statuses:
+            state = {**state, "status": status}
+            yield state
+
+class TestInvoiceJobManager(unittest.IsolatedAsyncioTestCase):
+
+    async def test_job_reports_final_state(self):
+        """A submitted job runs in the background and exposes its latest state."""
+        workflow = FakeWorkflow(["UPLOADED", "OCR_DONE", "SUMMARY_GENERATED"])
+        manager = InvoiceJobManager(workflow, max_workers=1, queue_size=5)
+        await manager.start()
+        try:
+            job_id = manager.submit("test-user", "invoice.pdf", "TALLY")
+            self.assertEqual(manager.get_job(job_id)["job_status"], "QUEUED")
+
+            workflow.release.set()
+            await manager._queue.join()
+
+            job = manager.get_job(job_id)
+            self.assertEqual(job["job_status"], "COMPLETED")
+            self.assertEqual(job["state"]["status"], "SUMMARY_GENERATED")
+            self.assertIsNotNone(job["finished_at"])
+        finally:
+            await manager.stop()
+
+    async def test_full_queue_rejects_submission(self):
+        """Backpressure surfaces as JobQueueFullError rather than blocking."""
+        workflow = FakeWorkflow(["SUMMARY_GENERATED"])
+        manager = InvoiceJobManager(workflow, max_workers=1, queue_size=1)
+        await manager.start()
+        try:
+            manager.submit("test-user", "a.pdf", "TALLY")
+            await asyncio.sleep(0)  # let the worker pick up the first job
+            manager.submit("test-user", "b.pdf", "TALLY")
+            with self.assertRaises(JobQueueFullError):
+                manager.submit("test-user", "c.pdf", "TALLY")
+        finally:
+            workflow.release.set()
+            await manager.stop()
+
+class FakeBatchProcessor:
+    """Finishes the files one by one, pausing until released."""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+
+    async def run(self, user_id, file_paths, target_system, on_result=None):
+        states = []
+        for index, path in enumerate(file_paths):
+            state = {"file_path": path, "status": "FAILED_OCR" if path == "bad.pdf" else "SUMMARY_GENERATED"}
+            on_result(index, state)
+            states.append(state)
+            await self.release.wait()
+        return states
+
+class TestBatchJobs(unittest.IsolatedAsyncioTestCase):
+
+    async def test_batch_job_reports_results_as_they_finish(self):
+        """A batch returns a job id at once and exposes each invoice's state as it completes."""
+        processor = FakeBatchProcessor()
+        manager = InvoiceJobManager(FakeWorkflow([]), max_workers=1, queue_size=5, batch_processor_factory=lambda: processor)
+        await manager.start()
+        try:
+            job_id = manager.submit_batch("test-user", ["a.pdf", "bad.pdf"], "TALLY")
+            job = manager.get_job(job_id)
+            self.assertEqual((job["kind"], job["job_status"]), ("batch", "QUEUED"))
+
+            await asyncio.sleep(0)  # the worker finishes the first file, then waits
+            self.assertEqual(job["job_status"], "RUNNING")
+            self.assertEqual(job["results"][0]["status"], "SUMMARY_GENERATED")
+            self.assertIsNone(job["results"][1])
+
+            processor.release.set()
+            await manager._queue.join()
+
+            self.assertEqual(job["job_status"], "COMPLETED")
+            self.assertEqual([state["status"] for state in job["results"]], ["SUMMARY_GENERATED", "FAILED_OCR"])
+            self.assertIsNotNone(job["finished_at"])
+        finally:
+            await manager.stop()
+
+if __name__ == '__main__':
+    unittest.main()
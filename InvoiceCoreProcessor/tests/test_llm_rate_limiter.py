@@ -0,0 +1,155 @@
+import unittest
+import asyncio
+import json
+from unittest.mock import patch, MagicMock, AsyncMock
+
+import httpx
+import openai
+
+from invoice_core_processor.services.llm_rate_limiter import LLMRateLimiter, TokenBucket, retry_delay
+from invoice_core_processor.services import mapping
+from invoice_core_processor.services.mapping import amap_text_to_schema
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_reservations_beyond_capacity_wait_for_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(capacity=60, period=60.0, clock=clock)  # 1 unit per second
+
+        self.assertEqual(bucket.reserve(60), 0.0)
+        self.assertAlmostEqual(bucket.reserve(1), 1.0)
+        self.assertAlmostEqual(bucket.reserve(1), 2.0)  # queued behind the previous reservation
+
+        clock.now = 10.0
+        self.assertEqual(bucket.reserve(5), 0.0)
+
+    def test_usage_above_estimate_is_charged(self):
+        clock = FakeClock()
+        bucket = TokenBucket(capacity=100, period=60.0, clock=clock)
+        bucket.reserve(50)
+        bucket.adjust(50)  # the request actually used 100
+        self.assertGreater(bucket.reserve(1), 0.0)
+
+    def test_retry_delay_respects_cap_and_retry_after(self):
+        for attempt in range(10):
+            self.assertLessEqual(retry_delay(attempt, base=0.5, cap=4.0), 4.0)
+        self.assertGreaterEqual(retry_delay(0, base=0.5, cap=30.0, retry_after=3.0), 3.0)
+
+class TestLLMRateLimiter(unittest.TestCase):
+
+    def test_in_flight_requests_are_capped(self):
+        limiter = LLMRateLimiter(max_in_flight=2, requests_per_minute=0, tokens_per_minute=0)
+        in_flight, peak = 0, 0
+
+        async def request():
+            nonlocal in_flight, peak
+            async with limiter.slot(100):
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+
+        async def main():
+            await asyncio.gather(*(request() for _ in range(6)))
+
+        asyncio.run(main())
+        self.assertEqual(peak, 2)
+
+def _rate_limit_error():
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after-ms": "1"}, request=request)
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+class TestAsyncMapping(unittest.TestCase):
+
+    @patch('invoice_core_processor.services.mapping.get_llm_rate_limiter')
+    @patch('invoice_core_processor.services.mapping.get_template_extractor', return_value=None)
+    @patch('invoice_core_processor.services.mapping.get_mapping_cache', return_value=None)
+    @patch('invoice_core_processor.services.mapping.get_async_openai_client')
+    @patch('invoice_core_processor.services.mapping.get_settings')
+    def test_rate_limited_call_is_retried(self, mock_settings, mock_get_client, _cache, _extractor, mock_limiter):
+        mock_settings.return_value = MagicMock(
+            OPENAI_API_KEY="key", OPENAI_MODEL="gpt-4", MAPPING_TEXT_COMPACTION=False, OPENAI_EXPECTED_COMPLETION_TOKENS=100,
+            OPENAI_MAX_RETRIES=3, OPENAI_RETRY_BASE_SECONDS=0.001, OPENAI_RETRY_MAX_SECONDS=0.01,
+        )
+        limiter = LLMRateLimiter(max_in_flight=4, requests_per_minute=0, tokens_per_minute=0)
+        mock_limiter.return_value = limiter
+        response = MagicMock()
+        response.choices[0].message.content = json.dumps({"invoiceNumber": "INV-1"})
+        mock_get_client.return_value.chat.completions.create = AsyncMock(side_effect=[_rate_limit_error(), response])
+
+        result = asyncio.run(amap_text_to_schema("Invoice INV-1", "TALLY"))
+
+        self.assertEqual(result["status"], "MAPPING_COMPLETE")
+        self.assertEqual(result["mapped_schema"], {"invoiceNumber": "INV-1"})
+        self.assertEqual(mock_get_client.return_value.chat.completions.create.await_count, 2)
+
+    @patch('invoice_core_processor.services.mapping.get_template_extractor', return_value=None)
+    @patch('invoice_core_processor.services.mapping.get_mapping_cache', return_value=None)
+    @patch('invoice_core_processor.services.mapping.get_async_openai_client')
+    @patch('invoice_core_processor.services.mapping.get_settings')
+    def test_non_retryable_error_fails_mapping(self, mock_settings, mock_get_client, _cache, _extractor):
+        mock_settings.return_value = MagicMock(OPENAI_API_KEY="key", OPENAI_MODEL="gpt-4", MAPPING_TEXT_COMPACTION=False, OPENAI_EXPECTED_COMPLETION_TOKENS=100, OPENAI_MAX_RETRIES=3)
+        mock_get_client.return_value.chat.completions.create = AsyncMock(side_effect=ValueError("bad request"))
+
+        result = asyncio.run(amap_text_to_schema("Invoice INV-1", "TALLY"))
+
+        self.assertEqual(result["status"], "FAILED_MAPPING")
+        mock_get_client.return_value.chat.completions.create.assert_awaited_once()
+
+    @patch('invoice_core_processor.services.mapping.get_template_extractor', return_value=None)
+    @patch('invoice_core_processor.services.mapping.get_mapping_cache', return_value=None)
+    @patch('invoice_core_processor.services.mapping.get_settings')
+    def test_missing_api_key_uses_stub_client(self, mock_settings, _cache, _extractor):
+        mock_settings.return_value = MagicMock(OPENAI_API_KEY=None, OPENAI_MODEL="gpt-4", MAPPING_TEXT_COMPACTION=False, OPENAI_EXPECTED_COMPLETION_TOKENS=100, OPENAI_MAX_RETRIES=0)
+
+        with patch.object(mapping, "_async_client", None), patch.object(mapping, "get_llm_rate_limiter", return_value=LLMRateLimiter(max_in_flight=1, requests_per_minute=0, tokens_per_minute=0)):
+            result = asyncio.run(amap_text_to_schema("Invoice INV-1", "TALLY"))
+            self.assertIsInstance(mapping._async_client, mapping.StubOpenAIClient)
+
+        self.assertEqual(result["status"], "MAPPING_COMPLETE")
+        self.assertEqual(result["mapped_schema"]["invoiceNumber"], "mock-inv-123")
+
+class FakeAsyncClient:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+class TestAsyncClientLifecycle(unittest.TestCase):
+
+    @patch('invoice_core_processor.services.mapping.get_settings', return_value=MagicMock(OPENAI_API_KEY=None))
+    def test_client_is_closed_when_the_loop_changes(self, _settings):
+        old_client, old_loop = FakeAsyncClient(), asyncio.new_event_loop()
+        try:
+            with patch.object(mapping, "_async_client", old_client), patch.object(mapping, "_async_client_loop", old_loop):
+                async def main():
+                    return mapping.get_async_openai_client()
+                new_client = asyncio.run(main())
+        finally:
+            old_loop.close()
+
+        self.assertTrue(old_client.closed)
+        self.assertIsInstance(new_client, mapping.StubOpenAIClient)
+
+    def test_close_releases_the_shared_client(self):
+        client = FakeAsyncClient()
+
+        async def main():
+            with patch.object(mapping, "_async_client", client), patch.object(mapping, "_async_client_loop", asyncio.get_running_loop()):
+                await mapping.close_async_openai_client()
+                return mapping._async_client
+
+        self.assertIsNone(asyncio.run(main()))
+        self.assertTrue(client.closed)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import os
+import json
+import tempfile
+from unittest.mock import patch, MagicMock
+
+from invoice_core_processor.services.mapping import map_text_to_schema
+from invoice_core_processor.services.mapping_cache import MemoryMappingCache, SQLiteMappingCache, make_mapping_key
+
+class TestMappingCacheKey(unittest.TestCase):
+
+    def test_key_ignores_whitespace_but_not_model_or_prompt(self):
+        key = make_mapping_key("Invoice  INV-1\n Total 100", "gpt-4", "1")
+        self.assertEqual(key, make_mapping_key("Invoice INV-1 Total 100 ", "gpt-4", "1"))
+        self.assertNotEqual(key, make_mapping_key("Invoice INV-1 Total 100", "gpt-4o", "1"))
+        self.assertNotEqual(key, make_mapping_key("Invoice INV-1 Total 100", "gpt-4", "2"))
+        self.assertNotEqual(key, make_mapping_key("Invoice INV-2 Total 100", "gpt-4", "1"))
+
+class TestMappingCacheBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _backends(self, max_entries, ttl):
+        return [
+            MemoryMappingCache(max_entries, ttl),
+            SQLiteMappingCache(os.path.join(self.tmp.name, f"cache-{ttl}-{max_entries}.sqlite3"), max_entries, ttl),
+        ]
+
+    def test_least_recently_used_entry_is_evicted(self):
+        for cache in self._backends(max_entries=2, ttl=60):
+            with self.subTest(backend=type(cache).__name__):
+                cache.set("a", {"invoiceNumber": "A"})
+                cache.set("b", {"invoiceNumber": "B"})
+                self.assertEqual(cache.get("a"), {"invoiceNumber": "A"})  # "a" is now the most recently used
+                cache.set("c", {"invoiceNumber": "C"})
+
+                self.assertIsNotNone(cache.get("a"))
+                self.assertIsNone(cache.get("b"))
+                self.assertIsNotNone(cache.get("c"))
+
+    def test_expired_entries_are_not_served(self):
+        for cache in self._backends(max_entries=10, ttl=0):
+            with self.subTest(backend=type(cache).__name__):
+                cache.set("a", {"invoiceNumber": "A"})
+                self.assertIsNone(cache.get("a"))
+
+    def test_callers_cannot_modify_cached_entries(self):
+        for cache in self._backends(max_entries=10, ttl=60):
+            with self.subTest(backend=type(cache).__name__):
+                value = {"invoiceNumber": "A", "lineItems": [{"amount": 1.0}]}
+                cache.set("a", value)
+                value["lineItems"].append({"amount": 2.0})
+                cache.get("a")["invoiceNumber"] = "edited"
+
+                self.assertEqual(cache.get("a"), {"invoiceNumber": "A", "lineItems": [{"amount": 1.0}]})
+
+class TestMapTextToSchemaCaching(unittest.TestCase):
+
+    @patch('invoice_core_processor.services.mapping.get_template_extractor', return_value=None)
+    @patch('invoice_core_processor.services.mapping.get_openai_client')
+    @patch('invoice_core_processor.services.mapping.get_mapping_cache')
+    @patch('invoice_core_processor.services.mapping.get_settings')
+    def test_repeat_text_skips_llm(self, mock_settings, mock_get_cache, mock_get_client, _):
+        mock_settings.return_value = MagicMock(OPENAI_API_KEY="key", OPENAI_MODEL="gpt-4", MAPPING_TEXT_COMPACTION=False)
+        mock_get_cache.return_value = MemoryMappingCache(max_entries=10, ttl=60)
+        response = MagicMock()
+        response.choices[0].message.content = json.dumps({"invoiceNumber": "INV-1"})
+        mock_get_client.return_value.chat.completions.create.return_value = response
+
+        first = map_text_to_schema("Invoice INV-1\nTotal 100", "TALLY")
+        second = map_text_to_schema("Invoice INV-1  Total 100", "TALLY")
+
+        mock_get_client.return_value.chat.completions.create.assert_called_once()
+        self.assertEqual(first["cache"], "miss")
+        self.assertEqual(second["cache"], "hit")
+        self.assertEqual(second["mapped_schema"], {"invoiceNumber": "INV-1"})
+
+if __name__ == '__main__':
+    unittest.main()
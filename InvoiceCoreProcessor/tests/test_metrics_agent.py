@@ -3,7 +3,7 @@ from unittest.mock import patch, MagicMock
 
 from invoice_core_processor.services.metrics import get_all_metrics
 
-@patch('invoice_core_processor.services.metrics.get_postgres_connection')
+@patch('invoice_core_processor.services.metrics.postgres_connection')
 class TestMetricsCollectorAgent(unittest.TestCase):
 
     def test_metric_calculations(self, mock_get_pg_conn):
@@ -13,7 +13,7 @@ class TestMetricsCollectorAgent(unittest.TestCase):
         # --- Mock Setup ---
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
-        mock_get_pg_conn.return_value = mock_conn
+        mock_get_pg_conn.return_value.__enter__.return_value = mock_conn
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
         # Define the return values for each query
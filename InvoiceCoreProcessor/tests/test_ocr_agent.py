@@ -1,7 +1,11 @@
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
 
-from invoice_core_processor.services.ocr_processor import run_image_ocr_cascade, OCRResult
+from invoice_core_processor.services import ocr_executor, ocr_processor
+from invoice_core_processor.services.ocr_stats import OCREngineStats
+from invoice_core_processor.services.ocr_processor import run_image_ocr_cascade, try_tesseract, extract_pdf, OCRResult
 
 class TestOCRCascade(unittest.TestCase):
 
@@ -47,5 +51,201 @@ class TestOCRCascade(unittest.TestCase):
         self.assertEqual(result.raw_engine_trace["easyocr"], "success")
         self.assertEqual(result.pages[0]["text"], "Success from EasyOCR")
 
+def engine_result(text, confidence):
+    return OCRResult(
+        status="OCR_DONE", avg_confidence=confidence,
+        pages=[{"page_number": 1, "text": text}], tables=[], raw_engine_trace={}
+    )
+
+class TestConcurrentCascade(unittest.TestCase):
+
+    def _settings(self, mode, parallel=2, hedge_delay=0.05):
+        settings = MagicMock(OCR_ADAPTIVE_ORDERING=False, OCR_PREPROCESS_ENABLED=False, OCR_CASCADE_MODE=mode, OCR_CASCADE_PARALLEL_ENGINES=parallel, OCR_CASCADE_HEDGE_DELAY_SECONDS=hedge_delay)
+        return patch('invoice_core_processor.services.ocr_processor.get_settings', return_value=settings)
+
+    def _engines(self, **behaviour):
+        def make(delay, result):
+            def engine(image_paths):
+                time.sleep(delay)
+                return result
+            return MagicMock(side_effect=engine)
+        engines = {name: make(0, None) for name in ["typhoon", "gpt_vision", "azure", "tesseract", "easyocr"]}
+        for name, (delay, result) in behaviour.items():
+            engines[name] = make(delay, result)
+        return patch('invoice_core_processor.services.ocr_processor._engine_functions', return_value=engines), engines
+
+    def test_hedged_mode_starts_next_engine_after_budget(self):
+        """A slow first engine does not block the cascade past its latency budget."""
+        engines_patch, engines = self._engines(
+            typhoon=(1.0, engine_result("slow", 0.9)),
+            gpt_vision=(0, engine_result("fast", 0.8)),
+        )
+        with self._settings("hedged"), engines_patch:
+            started = time.monotonic()
+            result = run_image_ocr_cascade(["scan.png"])
+            elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 0.9)
+        self.assertEqual(result.pages[0]["text"], "fast")
+        self.assertEqual(result.raw_engine_trace["gpt_vision"], "success")
+        self.assertEqual(result.raw_engine_trace["typhoon"], "cancelled")
+        self.assertIn("gpt_vision", result.raw_engine_trace["timings"])
+        engines["tesseract"].assert_not_called()
+
+    def test_parallel_mode_replaces_failed_engines(self):
+        """When the first engines fail, the next ones are started until one is accepted."""
+        engines_patch, engines = self._engines(tesseract=(0, engine_result("tesseract text", 0.7)))
+        with self._settings("parallel", parallel=2), engines_patch:
+            result = run_image_ocr_cascade(["scan.png"])
+
+        self.assertEqual(result.raw_engine_trace["tesseract"], "success")
+        self.assertEqual(result.raw_engine_trace["typhoon"], "failed")
+        self.assertLessEqual({"typhoon", "gpt_vision", "azure", "tesseract"}, set(result.raw_engine_trace["timings"]))
+
+    def test_abandoned_engine_outcome_is_still_recorded(self):
+        """An engine that loses the race is recorded once it finishes, not dropped."""
+        def slow(image_paths):
+            time.sleep(0.2)
+            return None
+        engines = [("typhoon", slow, 0.8), ("gpt_vision", lambda paths: engine_result("fast", 0.8), 0.75)]
+        record = MagicMock()
+
+        result = ocr_processor._run_concurrent_cascade(engines, ["scan.png"], 1, 0.05, {"timings": {}}, record)
+        self.assertEqual(result.pages[0]["text"], "fast")
+        self.assertEqual([c.args[0] for c in record.call_args_list], ["gpt_vision"])
+
+        time.sleep(0.4)
+        self.assertEqual([c.args[0] for c in record.call_args_list], ["gpt_vision", "typhoon"])
+
+    def test_hedging_pauses_while_abandoned_runs_fill_the_pool(self):
+        """No hedge is queued into a process pool already busy with abandoned engines."""
+        def slow(image_paths):
+            time.sleep(0.3)
+            return None
+        engines = [("tesseract", slow, 0.6), ("easyocr", lambda paths: engine_result("easy", 0.6), 0.0)]
+        trace = {"timings": {}}
+
+        with patch.object(ocr_processor, "ocr_worker_count", return_value=1), patch.object(ocr_processor, "_abandoned_pool_runs", 1):
+            result = ocr_processor._run_concurrent_cascade(engines, ["scan.png"], 1, 0.05, trace, MagicMock())
+
+        self.assertEqual(result.pages[0]["text"], "easy")
+        self.assertEqual(trace["tesseract"], "failed")
+
+class TestAdaptiveOrdering(unittest.TestCase):
+
+    def _engines(self):
+        return [("typhoon", None, 0.8), ("gpt_vision", None, 0.75), ("tesseract", None, 0.6), ("easyocr", None, 0.0)]
+
+    def test_engine_that_never_succeeds_is_demoted(self):
+        stats = OCREngineStats(window=50, min_samples=5)
+        for _ in range(5):
+            stats.record("typhoon", "png", ">=12MP", False, 0.0, 2.0)
+            stats.record("gpt_vision", "png", ">=12MP", True, 0.9, 1.5)
+
+        order = [name for name, _, _ in stats.order(self._engines(), "png", ">=12MP")]
+
+        self.assertEqual(order, ["gpt_vision", "typhoon", "tesseract", "easyocr"])
+        # Other slices keep the configured order.
+        self.assertEqual([name for name, _, _ in stats.order(self._engines(), "pdf", "<1MP")], ["typhoon", "gpt_vision", "tesseract", "easyocr"])
+
+    def test_last_resort_engine_stays_last(self):
+        stats = OCREngineStats(window=50, min_samples=5)
+        for _ in range(5):
+            stats.record("typhoon", "png", "<1MP", False, 0.0, 2.0)
+            stats.record("easyocr", "png", "<1MP", True, 0.6, 0.1)
+
+        order = [name for name, _, _ in stats.order(self._engines(), "png", "<1MP")]
+
+        self.assertEqual(order[-1], "easyocr")
+        snapshot = {row["engine"]: row for row in stats.snapshot()}
+        self.assertEqual(snapshot["easyocr"]["success_rate"], 1.0)
+        self.assertEqual(snapshot["typhoon"]["samples"], 5)
+
+class TestOCRExecutor(unittest.TestCase):
+
+    @patch('invoice_core_processor.services.ocr_executor.get_ocr_executor')
+    def test_engine_work_is_submitted_to_process_pool(self, mock_get_executor):
+        """Tesseract runs in a worker process, not in the calling thread."""
+        mock_executor = MagicMock()
+        mock_executor.submit.return_value.result.return_value = "INVOICE 42"
+        mock_get_executor.return_value = mock_executor
+
+        result = try_tesseract(["scan.png"])
+
+        mock_executor.submit.assert_called_once_with(ocr_executor.tesseract_extract, ["scan.png"])
+        self.assertEqual(result.pages[0]["text"], "INVOICE 42")
+
+    @patch('invoice_core_processor.services.ocr_executor.get_ocr_executor', return_value=None)
+    def test_tasks_run_inline_when_pool_disabled(self, _):
+        task = MagicMock(return_value="text")
+
+        self.assertEqual(ocr_executor.run_ocr_task(task, ["scan.png"]), "text")
+        task.assert_called_once_with(["scan.png"])
+
+    @patch('invoice_core_processor.services.ocr_executor._get_reader')
+    def test_workers_load_easyocr_only_when_they_use_it(self, mock_get_reader):
+        ocr_executor._init_worker("en", None)
+        mock_get_reader.assert_not_called()
+
+    @patch('invoice_core_processor.services.ocr_executor._get_reader')
+    @patch('invoice_core_processor.services.ocr_executor.ocr_worker_count', return_value=3)
+    @patch('invoice_core_processor.services.ocr_executor.get_ocr_executor')
+    def test_warm_up_occupies_every_worker(self, mock_get_executor, _workers, mock_get_reader):
+        """Warm-up tasks wait for each other, so the pool must run all of them at once."""
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            mock_get_executor.return_value = pool
+            ocr_executor.warm_up_ocr_engines()
+        self.assertEqual(mock_get_reader.call_count, 3)
+
+class TestPDFExtraction(unittest.TestCase):
+
+    def _mock_pdf(self, mock_open, pages):
+        mock_pdf = MagicMock()
+        mock_pdf.pages = pages
+        mock_open.return_value.__enter__.return_value = mock_pdf
+
+    def _page(self, text, tables=()):
+        page = MagicMock()
+        page.extract_text.return_value = text
+        page.extract_tables.return_value = list(tables)
+        return page
+
+    @patch('invoice_core_processor.services.ocr_processor.run_image_ocr_cascade')
+    @patch('pdfplumber.open')
+    def test_text_layer_pages_skip_ocr(self, mock_open, mock_cascade):
+        """Digital PDFs are read from the text layer without touching the OCR engines."""
+        self._mock_pdf(mock_open, [
+            self._page("Invoice INV-1 from ACME Ltd", tables=[[["Item", "Total"], ["Widget", None]]]),
+            self._page("Page two: total due 1,070.00"),
+        ])
+
+        result = extract_pdf("invoice.pdf")
+
+        mock_cascade.assert_not_called()
+        self.assertEqual(result.status, "OCR_DONE")
+        self.assertEqual([p["page_number"] for p in result.pages], [1, 2])
+        self.assertEqual(result.tables[0]["cells"], [["Item", "Total"], ["Widget", ""]])
+        self.assertEqual(result.raw_engine_trace["text_layer_pages"], 2)
+
+    @patch('invoice_core_processor.services.ocr_processor.run_image_ocr_cascade')
+    @patch('pdfplumber.open')
+    def test_image_only_pages_are_ocrd_in_order(self, mock_open, mock_cascade):
+        """Only scanned pages go through the image cascade, and pages come back in order."""
+        scanned = self._page("")
+        self._mock_pdf(mock_open, [scanned, self._page("Digital page with a text layer")])
+        mock_cascade.return_value = OCRResult(
+            status="OCR_DONE", avg_confidence=0.7,
+            pages=[{"page_number": 1, "text": "Scanned page text"}], tables=[],
+            raw_engine_trace={"engine": "tesseract"}
+        )
+
+        result = extract_pdf("invoice.pdf")
+
+        scanned.to_image.return_value.save.assert_called_once()
+        mock_cascade.assert_called_once()
+        self.assertEqual([p["text"] for p in result.pages], ["Scanned page text", "Digital page with a text layer"])
+        self.assertEqual(result.raw_engine_trace["page_sources"], {"1": "tesseract", "2": "text_layer"})
+        self.assertAlmostEqual(result.avg_confidence, (0.7 + 0.95) / 2)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from invoice_core_processor.services.ocr_cache import OCRResultCache
+from invoice_core_processor.services.ocr_processor import run_cascading_ocr, OCRResult
+
+class TestOCRResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = OCRResultCache(os.path.join(self.tmp.name, "cache"), max_bytes=10_000)
+        self.image_path = os.path.join(self.tmp.name, "invoice.png")
+        with open(self.image_path, "wb") as f:
+            f.write(b"fake image bytes")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_key_depends_on_content_and_config(self):
+        key = self.cache.make_key(self.image_path, {"engines": ["tesseract"]})
+        self.assertEqual(key, self.cache.make_key(self.image_path, {"engines": ["tesseract"]}))
+        self.assertNotEqual(key, self.cache.make_key(self.image_path, {"engines": ["easyocr"]}))
+
+        with open(self.image_path, "wb") as f:
+            f.write(b"different bytes")
+        self.assertNotEqual(key, self.cache.make_key(self.image_path, {"engines": ["tesseract"]}))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = OCRResultCache(os.path.join(self.tmp.name, "small"), max_bytes=250)
+        payload = {"text": "x" * 80}
+        cache.put("a", payload)
+        cache.put("b", payload)
+        old = time.time() - 60
+        os.utime(cache._path("a"), (old, old))
+        os.utime(cache._path("b"), (old, old))
+        self.assertIsNotNone(cache.get("a"))  # "a" is now the most recently used
+
+        cache.put("c", payload)
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+
+    @patch('invoice_core_processor.services.ocr_processor.run_image_ocr_cascade')
+    def test_repeat_upload_is_served_from_cache(self, mock_cascade):
+        mock_cascade.return_value = OCRResult(
+            status="OCR_DONE", avg_confidence=0.7,
+            pages=[{"page_number": 1, "text": "Invoice 42"}], tables=[],
+            raw_engine_trace={"engine": "tesseract", "tesseract": "success"}
+        )
+
+        with patch('invoice_core_processor.services.ocr_processor.get_ocr_cache', return_value=self.cache):
+            first = run_cascading_ocr(self.image_path, ".png")
+            second = run_cascading_ocr(self.image_path, ".png")
+
+        mock_cascade.assert_called_once()
+        self.assertEqual(first.raw_engine_trace["cache"], "miss")
+        self.assertEqual(second.raw_engine_trace["cache"], "hit")
+        self.assertEqual(second.pages[0]["text"], "Invoice 42")
+        self.assertEqual(second.raw_engine_trace["tesseract"], "success")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from invoice_core_processor.services.validation import apply_changes, revalidate, run_validation_checks
+from invoice_core_processor.services.validation_rules import compile_plan
+
+SCHEMA = {
+    "invoiceNumber": "INV-1",
+    "lineItems": [{"quantity": 2, "unitPrice": 500.00, "amount": 999.00}],
+    "totals": {"subtotal": 1000.00, "gstAmount": 180.0, "roundOff": 0.0, "grandTotal": 1180.00},
+}
+
+class TestRevalidation(unittest.TestCase):
+
+    def setUp(self):
+        self.plan = compile_plan()
+        self.previous = run_validation_checks(SCHEMA, plan=self.plan)
+
+    def test_only_affected_rules_rerun_and_match_a_full_run(self):
+        result = revalidate(SCHEMA, {"lineItems.0.amount": 1000.00}, self.previous["validation_results"], plan=self.plan)
+
+        self.assertEqual(result["rerun_rules"], ["LIT-004", "TTL-001"])
+        full = run_validation_checks(result["mapped_schema"], plan=self.plan)
+        for field in ("status", "overall_score", "validation_results"):
+            self.assertEqual(result[field], full[field])
+        self.assertEqual(SCHEMA["lineItems"][0]["amount"], 999.00)  # the input is not modified
+
+    def test_unaffected_results_are_reused(self):
+        previous = [dict(r) for r in self.previous["validation_results"]]
+        ttl_003 = next(r for r in previous if r["rule_id"] == "TTL-003")
+        ttl_003.update(status="FAIL", message="cached", deduction_points=20.0)
+
+        result = revalidate(SCHEMA, {"lineItems.0.amount": 1000.00}, previous, plan=self.plan)
+
+        self.assertIn({**ttl_003, "severity": 5}, result["validation_results"])
+        self.assertEqual(result["overall_score"], 80.0)
+
+    def test_fields_a_rule_reads_but_does_not_require_trigger_it(self):
+        result = revalidate(SCHEMA, {"totals.gstAmount": 200.0}, self.previous["validation_results"], plan=self.plan)
+        self.assertEqual(result["rerun_rules"], ["TTL-003"])
+        self.assertEqual(result["status"], "VALIDATED_FLAGGED")
+
+    def test_cleared_inputs_drop_the_rule(self):
+        result = revalidate(SCHEMA, {"lineItems": None}, self.previous["validation_results"], plan=self.plan)
+        self.assertNotIn("LIT-004", [r["rule_id"] for r in result["validation_results"]])
+
+    def test_apply_changes_creates_missing_containers(self):
+        schema = apply_changes({}, {"vendor.name": "Acme", "lineItems": [{"amount": 1}], "lineItems.0.amount": 2})
+        self.assertEqual(schema, {"vendor": {"name": "Acme"}, "lineItems": [{"amount": 2}]})
+
+if __name__ == '__main__':
+    unittest.main()
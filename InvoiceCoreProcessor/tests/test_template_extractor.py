@@ -0,0 +1,140 @@
+import unittest
+import os
+import json
+import tempfile
+from unittest.mock import patch, MagicMock
+
+from invoice_core_processor.services.mapping import map_text_to_schema
+from invoice_core_processor.services.template_extractor import TemplateExtractor
+
+def acme_invoice(number, date, due, items):
+    subtotal = sum(qty * price for _, qty, price in items)
+    gst = round(subtotal * 0.18, 2)
+    rows = "\n".join(f"{desc}  {qty}  {price:,.2f}  18%  {qty * price:,.2f}" for desc, qty, price in items)
+    text = (
+        "ACME Supplies Pvt Ltd\n"
+        "GSTIN: 29ABCDE1234F1Z5\n"
+        f"Invoice No: {number}\n"
+        f"Invoice Date: {date}    Due Date: {due}\n"
+        "Description  Qty  Rate  Tax  Amount\n"
+        f"{rows}\n"
+        f"Sub Total: {subtotal:,.2f}\n"
+        f"GST: {gst:,.2f}\n"
+        f"Grand Total: {subtotal + gst:,.2f}\n"
+    )
+    mapped = {
+        "invoiceNumber": number,
+        "invoiceDate": "-".join(reversed(date.split("/"))),
+        "dueDate": "-".join(reversed(due.split("/"))),
+        "vendor": {"name": "ACME Supplies Pvt Ltd", "gstin": "29ABCDE1234F1Z5", "pan": None, "address": None},
+        "customer": {"name": None, "address": None},
+        "lineItems": [
+            {"description": desc, "quantity": qty, "unitPrice": price, "taxPercent": 18, "amount": qty * price}
+            for desc, qty, price in items
+        ],
+        "totals": {"subtotal": subtotal, "gstAmount": gst, "roundOff": None, "grandTotal": subtotal + gst},
+        "paymentDetails": {"mode": None, "reference": None, "status": None},
+    }
+    return text, mapped
+
+class TestTemplateExtractor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = os.path.join(self.tmp.name, "templates.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _train(self, extractor):
+        for text, mapped in [
+            acme_invoice("INV-1001", "05/01/2024", "04/02/2024", [("Widget", 2, 500.0)]),
+            acme_invoice("INV-1002", "12/01/2024", "11/02/2024", [("Widget", 1, 500.0), ("Bolt pack", 10, 25.0)]),
+        ]:
+            extractor.learn(text, mapped)
+
+    def test_unknown_vendor_goes_to_llm(self):
+        extractor = TemplateExtractor(self.store)
+        text, _ = acme_invoice("INV-1003", "20/01/2024", "19/02/2024", [("Widget", 3, 500.0)])
+        self.assertIsNone(extractor.extract(text))
+
+    def test_confirmed_template_extracts_new_invoice(self):
+        extractor = TemplateExtractor(self.store, min_confirmations=2)
+        self._train(extractor)
+        text, expected = acme_invoice("INV-1003", "20/01/2024", "19/02/2024", [("Widget", 3, 500.0), ("Nut pack", 4, 12.5)])
+
+        result = extractor.extract(text)
+
+        self.assertIsNotNone(result)
+        mapped = result["mapped_schema"]
+        self.assertEqual(result["template_id"], "gstin:29ABCDE1234F1Z5")
+        self.assertEqual(mapped["invoiceNumber"], "INV-1003")
+        self.assertEqual(mapped["invoiceDate"], "2024-01-20")
+        self.assertEqual(mapped["dueDate"], "2024-02-19")
+        self.assertEqual(mapped["vendor"]["name"], "ACME Supplies Pvt Ltd")
+        self.assertAlmostEqual(mapped["totals"]["grandTotal"], expected["totals"]["grandTotal"])
+        self.assertEqual([item["amount"] for item in mapped["lineItems"]], [1500.0, 50.0])
+
+    def test_single_sample_is_not_trusted(self):
+        extractor = TemplateExtractor(self.store, min_confirmations=2)
+        text, mapped = acme_invoice("INV-1001", "05/01/2024", "04/02/2024", [("Widget", 2, 500.0)])
+        extractor.learn(text, mapped)
+
+        self.assertIsNone(extractor.extract(acme_invoice("INV-1003", "20/01/2024", "19/02/2024", [("Widget", 3, 500.0)])[0]))
+
+    def test_inconsistent_totals_fall_back_to_llm(self):
+        extractor = TemplateExtractor(self.store)
+        self._train(extractor)
+        text, _ = acme_invoice("INV-1004", "21/01/2024", "20/02/2024", [("Widget", 1, 500.0)])
+        text = text.replace("Grand Total: 590.00", "Grand Total: 990.00")
+
+        self.assertIsNone(extractor.extract(text))
+
+    def test_templates_persist_across_instances(self):
+        self._train(TemplateExtractor(self.store))
+        text, _ = acme_invoice("INV-1005", "22/01/2024", "21/02/2024", [("Widget", 1, 500.0)])
+
+        self.assertIsNotNone(TemplateExtractor(self.store).extract(text))
+
+    def test_extract_reads_a_snapshot_of_the_template(self):
+        """extract() works on a copy, so a concurrent learn() cannot change the rules it iterates."""
+        extractor = TemplateExtractor(self.store)
+        self._train(extractor)
+        text, _ = acme_invoice("INV-1006", "23/01/2024", "22/02/2024", [("Widget", 1, 500.0)])
+
+        template_id, template = extractor._find_template(text)
+        extractor._templates[template_id]["rules"].clear()
+
+        self.assertIn("dueDate", template["rules"])
+        self.assertIsNot(template, extractor._templates[template_id])
+
+class TestMappingUsesTemplates(unittest.TestCase):
+
+    @patch('invoice_core_processor.services.mapping.get_mapping_cache', return_value=None)
+    @patch('invoice_core_processor.services.mapping.get_openai_client')
+    @patch('invoice_core_processor.services.mapping.get_settings')
+    def test_llm_is_skipped_for_learned_vendor(self, mock_settings, mock_get_client, _):
+        mock_settings.return_value = MagicMock(OPENAI_API_KEY="key", OPENAI_MODEL="gpt-4", MAPPING_TEXT_COMPACTION=False)
+        extractor = TemplateExtractor(None)
+        samples = [
+            acme_invoice("INV-1001", "05/01/2024", "04/02/2024", [("Widget", 2, 500.0)]),
+            acme_invoice("INV-1002", "12/01/2024", "11/02/2024", [("Widget", 1, 500.0)]),
+        ]
+        responses = []
+        for _, mapped in samples:
+            response = MagicMock()
+            response.choices[0].message.content = json.dumps(mapped)
+            responses.append(response)
+        mock_get_client.return_value.chat.completions.create.side_effect = responses
+
+        with patch('invoice_core_processor.services.mapping.get_template_extractor', return_value=extractor):
+            for text, _ in samples:
+                self.assertEqual(map_text_to_schema(text, "TALLY")["source"], "llm")
+            result = map_text_to_schema(acme_invoice("INV-1003", "20/01/2024", "19/02/2024", [("Widget", 3, 500.0)])[0], "TALLY")
+
+        self.assertEqual(result["source"], "template")
+        self.assertEqual(result["mapped_schema"]["invoiceNumber"], "INV-1003")
+        self.assertEqual(mock_get_client.return_value.chat.completions.create.call_count, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from invoice_core_processor.services.text_compaction import OMISSION_MARKER, PAGE_SEPARATOR, compact_text
+
+HEADER = "ACME Supplies Pvt Ltd\nGSTIN: 29ABCDE1234F1Z5"
+FOOTER = "This is a computer generated invoice\nPage {page} of 2"
+
+class TestTextCompaction(unittest.TestCase):
+
+    def _document(self):
+        page_1 = f"{HEADER}\nInvoice No: INV-1   Date: 01/02/2024\n\n\nWidget A     2    100.00   18   236.00\n{FOOTER.format(page=1)}"
+        page_2 = f"{HEADER}\nWidget B     1    50.00    18   59.00\nGrand Total       295.00\n{FOOTER.format(page=2)}"
+        return PAGE_SEPARATOR.join([page_1, page_2])
+
+    def test_repeated_headers_and_boilerplate_are_removed(self):
+        compacted, stats = compact_text(self._document())
+
+        self.assertEqual(compacted.count("ACME Supplies Pvt Ltd"), 1)
+        self.assertEqual(compacted.count("GSTIN: 29ABCDE1234F1Z5"), 1)
+        self.assertNotIn("computer generated", compacted)
+        self.assertNotIn("Page 2 of 2", compacted)
+        self.assertIn("Widget A\t2\t100.00\t18\t236.00", compacted)
+        self.assertIn("Widget B\t1\t50.00\t18\t59.00", compacted)
+        self.assertNotIn("\n\n\n", compacted)
+        self.assertEqual(stats["repeated_lines_removed"], 2)
+        self.assertEqual(stats["boilerplate_lines_removed"], 4)
+        self.assertLess(stats["tokens_after"], stats["tokens_before"])
+        self.assertFalse(stats["truncated"])
+
+    def test_truncation_keeps_table_rows_and_fields(self):
+        prose = "\n".join(f"Our warehouse is open on weekdays and serves customers across the region {i}." for i in range(40))
+        text = f"Invoice No: INV-9\n{prose}\nItem\tQty\tRate\tAmount\nWidget\t3\t10.00\t30.00\nGrand Total 30.00"
+
+        compacted, stats = compact_text(text, token_budget=60)
+
+        self.assertTrue(stats["truncated"])
+        self.assertLessEqual(stats["tokens_after"], 60)
+        for line in ["Invoice No: INV-9", "Item\tQty\tRate\tAmount", "Widget\t3\t10.00\t30.00", "Grand Total 30.00"]:
+            self.assertIn(line, compacted)
+        self.assertIn(OMISSION_MARKER, compacted)
+
+    def test_lines_with_different_amounts_are_kept(self):
+        """A per-page total is not a repeated footer just because only its number changes."""
+        page_1 = f"{HEADER}\nWidget A     2    100.00   18   236.00\nBalance due: 100.00\nPage 1 of 2"
+        page_2 = f"{HEADER}\nWidget B     1    50.00    18   59.00\nBalance due: 180.00\nPage 2 of 2"
+
+        compacted, stats = compact_text(PAGE_SEPARATOR.join([page_1, page_2]))
+
+        self.assertIn("Balance due: 100.00", compacted)
+        self.assertIn("Balance due: 180.00", compacted)
+        self.assertEqual(compacted.count("ACME Supplies Pvt Ltd"), 1)
+        self.assertEqual(stats["repeated_lines_removed"], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import patch
+
+from invoice_core_processor.services.validation import run_validation_checks
+from invoice_core_processor.services.validation_rules import RULE_SPECS, ValidationRuleRegistry, compile_plan
+
+FLAGGED_SCHEMA = {
+    "invoiceNumber": "INV-1",
+    "lineItems": [{"quantity": 2, "unitPrice": 500.00, "amount": 999.00}],
+    "totals": {"subtotal": 1000.00, "gstAmount": 180.0, "roundOff": 0.0, "grandTotal": 1200.00},
+}
+
+class TestRulePlan(unittest.TestCase):
+
+    def test_builtin_plan_covers_every_registered_rule(self):
+        self.assertEqual([rule.rule_id for rule in compile_plan()], list(RULE_SPECS))
+
+    def test_inactive_and_unknown_rules_are_left_out(self):
+        rows = {rule_id: (5, True) for rule_id in RULE_SPECS}
+        rows["TTL-003"] = (5, False)
+        rows["VND-001"] = (5, True)  # seeded but not implemented
+        plan = compile_plan(rows)
+
+        self.assertNotIn("TTL-003", [rule.rule_id for rule in plan])
+        self.assertNotIn("VND-001", [rule.rule_id for rule in plan])
+        result = run_validation_checks(FLAGGED_SCHEMA, plan=plan)
+        self.assertNotIn("TTL-003", [r["rule_id"] for r in result["validation_results"]])
+        self.assertEqual(result["overall_score"], 60.0)
+
+    def test_severity_comes_from_the_rule_table(self):
+        rows = {rule_id: (spec.severity, True) for rule_id, spec in RULE_SPECS.items()}
+        rows["LIT-004"] = (2, True)
+        result = run_validation_checks(FLAGGED_SCHEMA, plan=compile_plan(rows))
+
+        severities = {r["rule_id"]: r["severity"] for r in result["validation_results"]}
+        self.assertEqual(severities["LIT-004"], 2)
+
+    def test_rules_without_their_inputs_are_skipped(self):
+        result = run_validation_checks({"totals": {"subtotal": 100.0, "grandTotal": 100.0}}, plan=compile_plan())
+        self.assertEqual([r["rule_id"] for r in result["validation_results"]], ["TTL-003", "ANM-004"])
+
+class TestValidationRuleRegistry(unittest.TestCase):
+
+    def test_plan_is_cached_until_invalidated(self):
+        registry = ValidationRuleRegistry(ttl=3600)
+        rows = {rule_id: (spec.severity, True) for rule_id, spec in RULE_SPECS.items()}
+        with patch.object(registry, "_read_rule_table", return_value=rows) as read:
+            first = registry.plan()
+            self.assertIs(registry.plan(), first)
+            self.assertEqual(read.call_count, 1)
+
+            rows["ANM-004"] = (3, False)
+            registry.invalidate()
+            self.assertNotIn("ANM-004", [rule.rule_id for rule in registry.plan()])
+            self.assertEqual(read.call_count, 2)
+
+    def test_builtin_rules_are_used_when_the_table_is_unavailable(self):
+        registry = ValidationRuleRegistry(ttl=3600)
+        with patch.object(registry, "_read_rule_table", side_effect=ConnectionError("database down")):
+            self.assertEqual([rule.rule_id for rule in registry.plan()], list(RULE_SPECS))
+
+if __name__ == '__main__':
+    unittest.main()
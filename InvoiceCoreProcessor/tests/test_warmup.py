@@ -0,0 +1,36 @@
+import unittest
+import subprocess
+import sys
+from unittest.mock import patch, MagicMock
+
+from invoice_core_processor.core import warmup
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_heavy_dependencies_are_not_imported_at_startup(self):
+        """Importing the workflow and MCP client must not load OCR engines or LLM SDKs."""
+        heavy = ["easyocr", "torch", "pytesseract", "pdfplumber", "docx", "openai", "google.generativeai", "langgraph.graph"]
+        code = (
+            "import sys\n"
+            "import invoice_core_processor.core.workflow, invoice_core_processor.core.jobs, invoice_core_processor.core.batch\n"
+            f"print('LOADED:' + ','.join(m for m in {heavy!r} if m in sys.modules))\n"
+        )
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, timeout=60)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "LOADED:")
+
+class TestWarmUp(unittest.TestCase):
+
+    def test_failures_are_reported_not_raised(self):
+        steps = {"ok": MagicMock(), "broken": MagicMock(side_effect=RuntimeError("no model"))}
+        with patch.dict(warmup.WARMUP_STEPS, steps, clear=True):
+            report = warmup.warm_up(["ok", "broken", "missing"])
+
+        steps["ok"].assert_called_once()
+        self.assertTrue(report["ok"].endswith("s"))
+        self.assertEqual(report["broken"], "failed: no model")
+        self.assertEqual(report["missing"], "unknown component")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,7 @@ import os
 import asyncio
 from unittest.mock import patch, MagicMock, AsyncMock
 
-from invoice_core_processor.core.workflow import build_workflow_graph
+from invoice_core_processor.core.workflow import build_workflow_graph, build_async_workflow_graph
 
 # Patch all the factories that create clients with external dependencies
 @patch('invoice_core_processor.core.workflow.get_agent_registry')
@@ -71,5 +71,83 @@ class TestWorkflow(unittest.TestCase):
         self.assertTrue(mock_ingestion.ingest_file.called)
         self.assertEqual(mock_mcp.call_tool.call_count, 9)
 
+    def test_async_workflow_execution(self, mock_get_ingestion_client, mock_get_mcp_client, mock_get_registry):
+        """
+        Tests that the coroutine graph awaits every client on a single event loop.
+        """
+        mock_ingestion = MagicMock()
+        mock_ingestion.ingest_file = AsyncMock(return_value={
+            'status': 'SUCCESS', 'invoice_id': 'test-inv-456', 'storage_path': 'new/path.pdf'
+        })
+        mock_get_ingestion_client.return_value = mock_ingestion
+
+        mock_registry = MagicMock()
+        mock_registry.get_cached_route.return_value = None
+        mock_registry.lookup_agent_by_capability.return_value = ('mock-agent-id', MagicMock(tool_id='mock-tool'))
+        mock_get_registry.return_value = mock_registry
+
+        mock_mcp = MagicMock()
+        mock_mcp.acall_tool = AsyncMock(side_effect=[
+            {'status': 'AUDIT_STEP_SAVED'}, # ingestion audit
+            {'status': 'OCR_DONE', 'pages': [{'text': '...'}], 'avg_confidence': 0.9}, # ocr
+            {'status': 'AUDIT_STEP_SAVED'}, # ocr audit
+            {'status': 'MAPPING_COMPLETE', 'mapped_schema': {}}, # mapping
+            {'status': 'AUDIT_STEP_SAVED'}, # mapping audit
+            {'status': 'VALIDATED_CLEAN', 'overall_score': 100, 'validation_results': []}, # validation
+            {'status': 'AUDIT_STEP_SAVED'}, # validation audit
+            {'status': 'SYNCED_SUCCESS'}, # integration
+            {'status': 'AUDIT_STEP_SAVED'}, # integration audit
+            {'status': 'CLEAN', 'headline': '...'}, # summary
+            {'status': 'AUDIT_STEP_SAVED'} # summary audit
+        ])
+        mock_get_mcp_client.return_value = mock_mcp
+
+        workflow_app = build_async_workflow_graph()
+        initial_state = {
+            "user_id": "test-user", "file_path": self.dummy_file, "target_system": "ZOHO",
+            "status": "UPLOADED", "invoice_id": None, "extracted_text": None,
+            "mapped_schema": None, "validation_flags": [], "reliability_score": None,
+            "anomaly_details": [], "integration_payload_preview": None,
+            "current_step": "start", "history": []
+        }
+        final_state = asyncio.run(workflow_app.ainvoke(initial_state))
+
+        self.assertEqual(final_state['status'], 'SUMMARY_GENERATED')
+        self.assertEqual(final_state['invoice_id'], 'test-inv-456')
+        mock_ingestion.ingest_file.assert_awaited_once()
+        self.assertEqual(mock_mcp.acall_tool.await_count, 11)
+        mock_mcp.call_tool.assert_not_called()
+
+    def test_missing_route_fails_the_invoice(self, mock_get_ingestion_client, mock_get_mcp_client, mock_get_registry):
+        """
+        Tests that a capability nobody provides ends in a FAILED_* status instead of a crash.
+        """
+        mock_ingestion = MagicMock()
+        mock_ingestion.ingest_file = AsyncMock(return_value={
+            'status': 'SUCCESS', 'invoice_id': 'test-inv-789', 'storage_path': 'new/path.pdf'
+        })
+        mock_get_ingestion_client.return_value = mock_ingestion
+
+        mock_registry = MagicMock()
+        mock_registry.get_cached_route.return_value = None
+        mock_registry.lookup_agent_by_capability.return_value = None
+        mock_get_registry.return_value = mock_registry
+
+        mock_mcp = MagicMock()
+        mock_mcp.acall_tool = AsyncMock(return_value={'status': 'AUDIT_STEP_SAVED'})
+        mock_get_mcp_client.return_value = mock_mcp
+
+        initial_state = {
+            "user_id": "test-user", "file_path": self.dummy_file, "target_system": "ZOHO",
+            "status": "UPLOADED", "invoice_id": None, "extracted_text": None,
+            "mapped_schema": None, "validation_flags": [], "reliability_score": None,
+            "anomaly_details": [], "integration_payload_preview": None,
+            "current_step": "start", "history": []
+        }
+        final_state = asyncio.run(build_async_workflow_graph().ainvoke(initial_state))
+
+        self.assertEqual(final_state['status'], 'FAILED_OCR')
+        self.assertEqual(mock_mcp.acall_tool.await_count, 1)  # ingestion audit only
+
 if __name__ == '__main__':
     unittest.main()